@@ -0,0 +1,84 @@
+"""
+Benchmark for bundle-level deduplication of repeated paragraphs
+
+Builds a synthetic email-heavy bundle (threads exported several times, replies
+quoting the previous message and letters from one template) and reports the
+time to plan the deduplication and the share of text still sent to PII and
+POS analysis.
+
+Run from the repository root:
+    python -m benchmarks.bench_dedup
+"""
+
+import random
+import time
+
+from src.core.dedup import DedupPlan, document_text
+
+THREAD_COUNT = 60
+THREAD_LENGTH = 4
+EXPORT_COPIES = 3
+LETTER_COUNT = 40
+NAMES = ["Mark Harrison", "Bob Jones", "Alice Smith", "Priya Patel", "Tom Reed"]
+WORDS = (
+    "meeting report review office request team file copy attached week manager "
+    "project update note schedule budget contract call follow approve draft"
+).split()
+
+
+def paragraph(rng, words=40):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def build_bundle():
+    rng = random.Random(0)
+    bundle = {}
+    for thread in range(THREAD_COUNT):
+        messages = []
+        for idx in range(THREAD_LENGTH):
+            sender, recipient = rng.sample(NAMES, 2)
+            body = "\n\n".join(paragraph(rng) for _ in range(3))
+            message = f"From: {sender}\nTo: {recipient}\n\n{body}\n\nRegards,\n{sender}"
+            if messages:
+                quoted = "\n".join(f"> {line}" for line in messages[-1].split("\n"))
+                message += f"\n\nOn Monday {recipient} wrote:\n{quoted}"
+            messages.append(message)
+            for copy in range(EXPORT_COPIES):
+                bundle[f"thread_{thread}_{idx}_copy_{copy}.pdf"] = message
+
+    template = "\n\n".join(paragraph(random.Random(1)) for _ in range(4))
+    for idx in range(LETTER_COUNT):
+        name = NAMES[idx % len(NAMES)]
+        bundle[f"letter_{idx}.pdf"] = f"Dear {name},\n{template}\n\nYours sincerely"
+    return bundle
+
+
+def main():
+    bundle = build_bundle()
+    total_chars = sum(len(text) for text in bundle.values())
+
+    start = time.perf_counter()
+    plan = DedupPlan(bundle)
+    plan_seconds = time.perf_counter() - start
+
+    pii_chars = pos_chars = 0
+    for file_name, text in bundle.items():
+        pii_content, _ = plan.analysis_input(file_name, text, "pii")
+        pos_content, _ = plan.analysis_input(file_name, text, "pos")
+        pii_chars += len(document_text(pii_content or ""))
+        pos_chars += len(document_text(pos_content or ""))
+
+    stats = plan.stats()
+    print(
+        f"{len(bundle)} files, {total_chars} characters, {stats['blocks']} paragraphs"
+    )
+    print(
+        f"{stats['exact_duplicates']} exact and {stats['near_duplicates']} near "
+        f"duplicates, planned in {plan_seconds * 1000:.0f} ms"
+    )
+    print(f"PII input: {pii_chars} characters ({pii_chars / total_chars:.1%})")
+    print(f"POS input: {pos_chars} characters ({pos_chars / total_chars:.1%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Micro-benchmark for classifying pronouns and gender nouns in a parsed document
+
+Builds a large synthetic parsed Doc (so no model download is needed) and times
+the previous per-token loop over token.text/pos_/tag_/dep_ strings against
+classify_tokens, which works on Doc.to_array columns with NumPy masks.
+
+Run from the repository root:
+    python -m benchmarks.bench_pos_classification
+"""
+
+import random
+import time
+
+import spacy
+from spacy.tokens import Doc
+
+from src.core.pos_redaction import GENDER_NOUNS, classify_tokens
+
+TOKEN_COUNT = 500_000
+SENTENCE_LENGTH = 20
+
+# (word, pos, tag, dep) pool the synthetic document is drawn from, with roughly
+# one pronoun or gender noun in ten tokens as in ordinary prose
+TOKENS = [
+    ("He", "PRON", "PRP", "nsubj"),
+    ("she", "PRON", "PRP", "nsubjpass"),
+    ("him", "PRON", "PRP", "dobj"),
+    ("her", "PRON", "PRP$", "poss"),
+    ("them", "PRON", "PRP", "pobj"),
+    ("who", "PRON", "WP", "nsubj"),
+    ("which", "PRON", "WDT", "nsubj"),
+    ("it", "PRON", "PRP", "expl"),
+    ("Mother", "NOUN", "NN", "nsubj"),
+    ("wives", "NOUN", "NNS", "dobj"),
+    ("meeting", "NOUN", "NN", "dobj"),
+    ("attended", "VERB", "VBD", "ROOT"),
+    ("the", "DET", "DT", "det"),
+    ("office", "NOUN", "NN", "pobj"),
+    ("in", "ADP", "IN", "prep"),
+]
+WEIGHTS = [1] * 10 + [18] * 5
+
+
+def build_doc(nlp):
+    rng = random.Random(0)
+    rows = rng.choices(TOKENS, weights=WEIGHTS, k=TOKEN_COUNT)
+    words, pos, tags, deps = (list(column) for column in zip(*rows))
+    sent_starts = [idx % SENTENCE_LENGTH == 0 for idx in range(TOKEN_COUNT)]
+    return Doc(
+        nlp.vocab,
+        words=words,
+        pos=pos,
+        tags=tags,
+        deps=deps,
+        sent_starts=sent_starts,
+    )
+
+
+def per_token_loop(doc):
+    """The previous approach: string comparisons one token at a time."""
+    matches = []
+    for token in doc:
+        if token.text.lower() in GENDER_NOUNS:
+            matches.append((token.i, "gender_nouns"))
+            continue
+
+        if token.pos_ == "PRON":
+            if token.tag_ in ["WP", "WDT", "WP$"]:
+                category = "interrogative_pronouns"
+            elif token.tag_ == "PRP$":
+                category = "possessive_pronouns"
+            elif token.dep_ in ["nsubj", "nsubjpass"]:
+                category = "personal_pronouns"
+            elif token.dep_ in ["dobj", "pobj", "iobj"]:
+                category = "objective_pronouns"
+            else:
+                category = "personal_pronouns"
+            matches.append((token.i, category))
+    return matches
+
+
+def timed(label, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{label}: {elapsed * 1000:.1f} ms")
+    return result
+
+
+def main():
+    doc = build_doc(spacy.blank("en"))
+    print(f"{len(doc)} tokens")
+    baseline = timed("Per-token loop", per_token_loop, doc)
+    arrays = timed("classify_tokens", classify_tokens, doc)
+
+    assert arrays == baseline
+    print(f"{len(arrays)} pronouns and gender nouns")
+
+
+if __name__ == "__main__":
+    main()
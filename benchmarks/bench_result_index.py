@@ -0,0 +1,122 @@
+"""
+Micro-benchmark for grouping, deduplicating and filtering contextual results
+
+Builds 100k synthetic mentions spread over a set of files and times the
+ResultIndex passes against the previous approach of keying on whole context
+strings and checking aliases against a list.
+
+Run from the repository root:
+    python -m benchmarks.bench_result_index
+"""
+
+import random
+import time
+
+from src.core.records import ContextStore, Mention
+from src.core.result_index import ResultIndex
+
+ENTITY_COUNT = 100_000
+FILE_COUNT = 200
+ALIAS_COUNT = 50
+ENTITY_TYPES = ["Person", "PersonType", "Organization", "Email", "Address"]
+
+
+def build_mentions(context_store):
+    rng = random.Random(0)
+    contexts = [
+        f"Sentence {idx} about a meeting held in the office. " * 8
+        for idx in range(ENTITY_COUNT // 4)
+    ]
+    mentions = []
+    for idx in range(ENTITY_COUNT):
+        context = rng.choice(contexts)
+        mentions.append(
+            Mention(
+                file_name=f"file_{idx % FILE_COUNT}.pdf",
+                entity_type=rng.choice(ENTITY_TYPES),
+                entity_text=f"Name {rng.randrange(ALIAS_COUNT * 4)}",
+                context_id=context_store.add(context),
+                start=0,
+                end=len(context),
+            )
+        )
+    return mentions
+
+
+def string_keyed_passes(mentions, context_store, files_alias, subject):
+    """The previous approach: context strings as keys and list alias checks."""
+    seen_contexts = {}
+    for idx, mention in enumerate(mentions):
+        if mention.entity_type == "Person":
+            seen_contexts.setdefault(context_store.get(mention.context_id), idx)
+    for idx, mention in enumerate(mentions):
+        if mention.entity_type == "PersonType":
+            seen_contexts.setdefault(context_store.get(mention.context_id), idx)
+    keep = set(seen_contexts.values())
+    deduplicated = [
+        mention
+        for idx, mention in enumerate(mentions)
+        if mention.entity_type not in ("Person", "PersonType") or idx in keep
+    ]
+
+    segregated = {}
+    for mention in deduplicated:
+        segregated.setdefault(mention.file_name, []).append(mention)
+
+    filtered = {}
+    for file_name, file_mentions in segregated.items():
+        file_aliases = files_alias.get(file_name, [])
+        filtered[file_name] = [
+            mention
+            for mention in file_mentions
+            if mention.entity_type != "Person"
+            or (
+                mention.entity_text not in file_aliases
+                and mention.entity_text != subject
+            )
+        ]
+    return filtered
+
+
+def indexed_passes(mentions, files_alias, subject):
+    index = ResultIndex()
+    index.add_mentions(mentions)
+    index.mentions_by_file()
+    return index.filtered_mentions(files_alias, subject)
+
+
+def timed(label, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{label}: {elapsed * 1000:.1f} ms")
+    return result
+
+
+def main():
+    context_store = ContextStore()
+    mentions = build_mentions(context_store)
+    files_alias = {
+        f"file_{idx}.pdf": [f"Name {alias}" for alias in range(ALIAS_COUNT)]
+        for idx in range(FILE_COUNT)
+    }
+    subject = "Name 0"
+
+    print(f"{len(mentions)} mentions, {len(context_store)} distinct contexts")
+    baseline = timed(
+        "String keyed passes",
+        string_keyed_passes,
+        mentions,
+        context_store,
+        files_alias,
+        subject,
+    )
+    indexed = timed("ResultIndex", indexed_passes, mentions, files_alias, subject)
+
+    kept = sum(len(file_mentions) for file_mentions in indexed.values())
+    assert kept == sum(len(file_mentions) for file_mentions in baseline.values())
+    print(f"{kept} mentions left to redact")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Startup benchmark based on python -X importtime
+
+Imports each entry point in a fresh interpreter, several times, and reports
+the best wall time, the total import time and the slowest top-level imports,
+so regressions in cold start (a heavy module imported at module level again)
+show up at a glance.
+
+Run from the repository root:
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup main src.jobs.worker --repeat 5
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+
+DEFAULT_MODULES = ["main", "src.jobs.worker", "src.api.app"]
+TOP_IMPORTS = 8
+
+
+def import_profile(module):
+    """
+    Import a module in a new interpreter
+
+    Returns:
+        tuple: (wall time in seconds, list of (depth, cumulative seconds, name))
+    """
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    elapsed = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{completed.stderr}")
+
+    # Lines look like "import time:  self [us] | cumulative | imported package",
+    # with the package name indented two spaces per nesting level
+    timings = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        timings.append((depth, int(cumulative) / 1e6, name.strip()))
+    return elapsed, timings
+
+
+def direct_imports(timings, module):
+    """Imports made by the module itself, slowest first."""
+    # Children are printed before their parent, so the module's direct imports
+    # are the depth 1 lines since the previous top-level line
+    direct, pending = [], []
+    for depth, cumulative, name in timings:
+        if depth == 1:
+            pending.append((cumulative, name))
+        elif depth == 0:
+            if name == module:
+                direct = pending
+            pending = []
+    return sorted(direct, reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import time of entry points")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for module in args.modules:
+        runs = [import_profile(module) for _ in range(args.repeat)]
+        elapsed, timings = min(runs, key=lambda run: run[0])
+        total = next(
+            cumulative for depth, cumulative, name in timings if name == module
+        )
+        print(
+            f"{module}: wall {elapsed * 1000:.0f} ms, "
+            f"import {total * 1000:.0f} ms, slowest direct imports:"
+        )
+        for cumulative, name in direct_imports(timings, module)[:TOP_IMPORTS]:
+            print(f"    {cumulative * 1000:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
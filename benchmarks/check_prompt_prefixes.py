@@ -0,0 +1,75 @@
+"""
+Check that every LLM prompt starts with a static system message
+
+Renders each prompt template of the prompt modules with two different inputs
+and asserts the system message is byte-identical, so the prompt prefix can be
+served from the prompt cache whatever the file, subject or entity. The group
+variant of an entity prompt must share the system message of its single-entity
+prompt, and the redaction prompts, sent for every mention, must reach the
+length from which Azure caches a prompt prefix.
+
+Run from the repository root:
+    python -m benchmarks.check_prompt_prefixes
+"""
+
+from langchain_core.prompts import ChatPromptTemplate
+
+from src.core.llm import prompts, redaction_prompts
+from src.core.planner import MIN_CACHED_PREFIX_TOKENS
+from src.utils.context_budget import count_tokens
+
+# Two unrelated inputs, one of them asking for a repair of the last answer
+INPUTS = [
+    ({"subjects": ["Mark Harrison"], "subject": "Mark Harrison"}, None),
+    (
+        {"subjects": ["Jane Doe", "Ms. Doe"], "subject": "Jane Doe"},
+        "1 validation error for RedactionResult",
+    ),
+]
+
+
+def prompt_templates():
+    for module in (prompts, redaction_prompts):
+        for name, value in vars(module).items():
+            if isinstance(value, ChatPromptTemplate):
+                yield f"{module.__name__.rsplit('.', 1)[-1]}.{name}", value
+
+
+def render(prompt: ChatPromptTemplate, values, variant: int, repair):
+    from langchain_core.messages import HumanMessage
+
+    inputs = {
+        name: values.get(name, f"{name} of input {variant}")
+        for name in prompt.input_variables
+    }
+    if repair is not None:
+        inputs["repair"] = [HumanMessage(repair)]
+    return prompt.format_messages(**inputs)
+
+
+def main():
+    system_messages = {}
+    for name, prompt in prompt_templates():
+        rendered = [
+            render(prompt, values, variant, repair)
+            for variant, (values, repair) in enumerate(INPUTS)
+        ]
+        first, second = (messages[0] for messages in rendered)
+        assert first.type == "system", f"{name} does not start with a system message"
+        assert first.content == second.content, f"{name} system message varies"
+        system_messages[name] = first.content
+        tokens = count_tokens(first.content)
+        print(f"{name}: static system message of {tokens} tokens")
+        # The alias prompt runs once per file, too rarely to be worth padding
+        if name.startswith("redaction_prompts."):
+            assert tokens >= MIN_CACHED_PREFIX_TOKENS, f"{name} is too short to cache"
+
+    for name, content in system_messages.items():
+        if "_group_prompt" in name:
+            single = name.replace("_group_prompt", "_prompt")
+            assert content == system_messages[single], f"{name} differs from {single}"
+    print(f"{len(system_messages)} prompts start with a static system message")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Check of the local pronoun decisions made before the LLM is asked
+
+Runs classify_pronoun on hand-written antecedent links, including a relative
+sharing the subject's surname and honorifics found outside the name span, and
+asserts which ones are resolved locally and which ones are left to the LLM.
+
+Run from the repository root:
+    python -m benchmarks.check_pronoun_resolution
+"""
+
+from src.core.pronoun_resolution import alias_profiles, classify_pronoun
+from src.core.records import Antecedent, PronounOccurrence
+
+ALIASES = ["Mark Harrison", "Mr. Harrison"]
+
+# (aliases, pronoun, antecedent text, honorific gender outside it, expected)
+CASES = [
+    (ALIASES, "he", "Mark Harrison", None, "subject"),
+    (ALIASES, "he", "Harrison", None, "subject"),
+    (ALIASES, "his", "Mr. Harrison", None, "subject"),
+    # A longer name sharing the surname may be a relative
+    (ALIASES, "she", "Jane Harrison", None, "llm"),
+    (ALIASES, "he", "Mark Harrison Jr", None, "llm"),
+    # "Mr. Harrison" makes "she" unlikely to be the subject
+    (ALIASES, "she", "Harrison", None, "llm"),
+    (ALIASES, "he", "Mrs. Harrison", None, "llm"),
+    # "Mrs. Harrison ... she" where the title is not part of the PERSON span
+    (ALIASES, "she", "Harrison", "female", "llm"),
+    (["Mark Harrison"], "she", "Harrison", "female", "llm"),
+    # A bare surname needs an alias with a matching honorific
+    (["Mark Harrison"], "he", "Harrison", None, "llm"),
+    (["Mark Harrison"], "he", "Harrison", "male", "llm"),
+    (ALIASES, "he", "Harrison", "male", "subject"),
+    (ALIASES, "she", "Alice Smith", None, "non_subject"),
+    (ALIASES, "him", "Bob Jones", None, "non_subject"),
+]
+
+
+def pronoun(text, antecedent_text, gender):
+    return PronounOccurrence(
+        text=text,
+        pos_category="personal_pronouns",
+        start=0,
+        end=len(text),
+        sentence_start=0,
+        sentence_end=0,
+        antecedent=Antecedent(
+            antecedent_text, 0, len(antecedent_text), 0, False, gender
+        ),
+    )
+
+
+def main():
+    for aliases, text, antecedent_text, gender, expected in CASES:
+        decision = classify_pronoun(
+            pronoun(text, antecedent_text, gender), alias_profiles(aliases)
+        )
+        print(f"{text!r} -> {antecedent_text!r} ({gender}) for {aliases}: {decision}")
+        assert decision == expected, f"expected {expected}"
+    print(f"{len(CASES)} pronoun links classified as expected")
+
+
+if __name__ == "__main__":
+    main()
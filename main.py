@@ -1,35 +1,235 @@
-from ftplib import all_errors
 import streamlit as st
-import pdfplumber
-from pathlib import Path
-import shutil
 import asyncio
+import time
+import uuid
 from dotenv import load_dotenv
 import os
-from langchain_community.callbacks import get_openai_callback
-import pandas as pd
 from datetime import datetime
-from src.utils.download_excel import create_combined_report
-from src.utils.file_processing import (
-    process_documents_pos,
-    process_entities_with_context,
-    process_pos_with_context,
-    process_all_results,
-    segregate_by_file,
-    find_filtered_entities,
-    clean_nested_dict,
+from src.core.events import STAGES
+from src.jobs.job_queue import (
+    DEFAULT_QUEUE_URL,
+    FAILED,
+    FINISHED_STATES,
+    PARQUET_ARTIFACT,
+    QUEUED,
+    REPORT_ARTIFACT,
+    create_job_queue,
 )
-from src.core.llm.pronoun_redaction import redact_pronouns
-from src.core.entity_redaction import redact_entity
-from src.utils.intial_file_processing import process_uploaded_files
-from src.core.llm.alias_identification import process_all_files_alias
-from src.core.llm.redaction_ai import generate_redactions
-from src.core.pos_redaction import process_pos_analysis
 
 load_dotenv()
 
-key = os.getenv("AZURE_PII_KEY")
-endpoint = os.getenv("AZURE_PII_ENDPOINT")
+# Rows shown per page of the redactions table
+PAGE_SIZE = 50
+
+# Minimum seconds between refreshes of the live redactions table
+TABLE_REFRESH_INTERVAL = 0.5
+
+# Seconds between polls of the job queue while a job is queued or running
+JOB_POLL_INTERVAL = 1.0
+
+
+@st.cache_resource
+def get_job_queue():
+    """Open the job queue once per server process, shared by all sessions."""
+    return create_job_queue(os.getenv("JOB_QUEUE_URL", DEFAULT_QUEUE_URL))
+
+
+def redaction_row(item):
+    """Flatten an entity or pronoun redaction into one table row."""
+    return {
+        "File": item["file_name"],
+        "Type": item["kind"],
+        "Target": item["target"],
+        "Redacted Text": ", ".join(item["redacted_text"]),
+        "Reason": item["reason"],
+    }
+
+
+async def follow_job(queue, job_id):
+    """
+    Poll a queued job, updating progress bars and a live table from its events
+
+    A job queued again after its worker stopped starts a new attempt with new
+    events, so the progress and the rows of the earlier attempt are dropped.
+
+    Returns:
+        tuple: (final job status, redaction rows)
+    """
+    # pandas is only needed once there are results, keep it off the first paint
+    import pandas as pd
+
+    status_placeholder = st.empty()
+    progress_area = st.empty()
+    aliases_placeholder = st.empty()
+    live_table = st.empty()
+    attempt = None
+    last_refresh = 0.0
+
+    while True:
+        status = queue.status(job_id)
+        if status["attempt"] != attempt:
+            attempt = status["attempt"]
+            progress_bars = {}
+            progress_container = progress_area.container()
+            aliases_placeholder.empty()
+            live_table.empty()
+            rows = []
+            last_seq = 0
+
+        for seq, event in queue.events(job_id, after=last_seq):
+            last_seq = seq
+            if event["event"] == "stage":
+                label = STAGES[event["stage"]]
+                if event["status"] == "start":
+                    progress_bars[event["stage"]] = progress_container.progress(
+                        0.0, text=label
+                    )
+                else:
+                    progress_bars[event["stage"]].progress(
+                        1.0, text=f"{label} - done in {event['elapsed']:.1f}s"
+                    )
+
+            elif event["event"] == "progress":
+                progress_bars[event["stage"]].progress(
+                    event["done"] / event["total"],
+                    text=f"{STAGES[event['stage']]}: {event['done']}/{event['total']} "
+                    f"({event['file_name']})",
+                )
+
+            elif event["event"] == "aliases":
+                aliases_placeholder.info(
+                    f"Aliases of the subject are {event['aliases']}"
+                )
+
+            elif event["event"] == "redaction":
+                rows.append(redaction_row(event["item"]))
+
+        now = time.monotonic()
+        if rows and now - last_refresh >= TABLE_REFRESH_INTERVAL:
+            live_table.dataframe(
+                pd.DataFrame(rows[-PAGE_SIZE:]), use_container_width=True
+            )
+            last_refresh = now
+
+        if status["status"] == QUEUED:
+            status_placeholder.info(
+                f"Job queued, {status['queued_ahead']} job(s) ahead of it"
+            )
+        elif status["status"] in FINISHED_STATES:
+            break
+        else:
+            status_placeholder.info(f"Job running on {status['worker_id']}")
+
+        await asyncio.sleep(JOB_POLL_INTERVAL)
+
+    status_placeholder.empty()
+    aliases_placeholder.empty()
+    live_table.empty()
+    return status, rows
+
+
+def render_results(job):
+    """Render a finished job: paginated redactions table and report download."""
+    import pandas as pd
+
+    st.caption(
+        f"Total Cost (USD): ${format(job['total_cost'], '.6f')} - cached prompt "
+        f"tokens: {job['prompt_tokens_cached']} of {job['prompt_tokens']} "
+        f"({job['cached_prompt_ratio']:.1%})"
+    )
+    if job.get("failed_files"):
+        st.warning(
+            "Some calls failed, so these files may be missing redactions and will "
+            "be processed again next time: "
+            + ", ".join(
+                f"{file_name} ({', '.join(stages)})"
+                for file_name, stages in job["failed_files"].items()
+            )
+        )
+    tier_stats = job.get("tier_stats")
+    if tier_stats and tier_stats["fast"]["calls"]:
+        st.caption(
+            " - ".join(
+                f"{tier} model: {tier_stats[tier]['calls']} calls, "
+                f"${tier_stats[tier]['cost']:.6f}"
+                for tier in ("fast", "advanced")
+            )
+            + f" - {tier_stats['decisions'].get('escalated_output', 0)} answers "
+            "escalated to the advanced model"
+        )
+    if job.get("reused_analysis"):
+        st.caption(
+            f"Document analysis reused for {job['reused_analysis']} files, "
+            "only aliases and redactions were generated for this subject"
+        )
+    dedup_stats = job.get("dedup_stats")
+    if dedup_stats and (
+        dedup_stats["exact_duplicates"] or dedup_stats["near_duplicates"]
+    ):
+        st.caption(
+            f"{dedup_stats['exact_duplicates']} repeated and "
+            f"{dedup_stats['near_duplicates']} near-duplicate paragraphs were "
+            f"analysed once: {dedup_stats['pii_chars']} of "
+            f"{dedup_stats['fresh_chars']} characters sent for PII detection"
+        )
+    st.info(f"Aliases of the subject are {job['aliases']}")
+
+    rows = job["rows"]
+    st.info(f"{len(rows)} redactions generated")
+    if rows:
+        page_count = (len(rows) - 1) // PAGE_SIZE + 1
+        page = st.number_input("Page", min_value=1, max_value=page_count, value=1)
+        start = (page - 1) * PAGE_SIZE
+        st.dataframe(
+            pd.DataFrame(rows[start : start + PAGE_SIZE]), use_container_width=True
+        )
+        st.caption(f"Page {page} of {page_count}")
+
+    if job["report"] is not None:
+        st.download_button(
+            label="Download Complete Analysis Report",
+            data=job["report"],
+            file_name=f"document_analysis_report_{job['finished_at']}.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        )
+
+    if job["parquet"] is not None:
+        st.download_button(
+            label="Download Parquet Export",
+            data=job["parquet"],
+            file_name=f"document_analysis_{job['finished_at']}_parquet.zip",
+            mime="application/zip",
+        )
+
+
+def render_plan(plan):
+    """Render a dry-run plan: estimated time, cost and calls per stage."""
+    import pandas as pd
+    from src.core.planner import format_duration
+
+    st.subheader(f"Estimate for {plan['subject']}")
+    time_column, cost_column, calls_column = st.columns(3)
+    time_column.metric("Estimated time", format_duration(plan["total_seconds"]))
+    cost_column.metric("Estimated cost (USD)", f"${plan['total_cost']:.4f}")
+    calls_column.metric(
+        "LLM calls",
+        sum(
+            row["calls"]
+            for row in plan["stages"]
+            if row["stage"] not in ("local", "pii")
+        ),
+    )
+    st.dataframe(
+        pd.DataFrame(plan["stages"]).assign(
+            seconds=lambda frame: frame["seconds"].map(format_duration)
+        ),
+        hide_index=True,
+        use_container_width=True,
+    )
+    st.caption(
+        "Aliases are not known before the run, so entity and pronoun requests are "
+        "counted with the subject name only and are an upper bound."
+    )
 
 
 async def render_ui():
@@ -42,94 +242,74 @@ async def render_ui():
         "Please enter the subject:", placeholder="e.g., Mark Harrison"
     )
 
+    # Optional bundle reference, resubmitting a bundle only reprocesses changed files
+    bundle_id = st.text_input(
+        "Bundle reference (optional):",
+        placeholder="e.g., SAR-2024-0153",
+        help="Reuse results of unchanged files from earlier runs of this bundle",
+    )
+
     # File uploader
     uploaded_files = st.file_uploader(
         "Choose PDF files", type="pdf", accept_multiple_files=True
     )
 
     if uploaded_files and subject:
-        if st.button("Process PDFs"):
-            with st.spinner("Processing PDFs..."):
-                documents = await process_uploaded_files(uploaded_files)
-
-            with st.spinner("Detecting PIIS and POS..."):
-                if documents:
-                    documents = process_documents_pos(documents)
-                    results1 = await redact_entity(
-                        documents=documents, key=key, endpoint=endpoint
-                    )
-
-                    results2 = await process_pos_analysis(documents)
-
-            with st.spinner("Preprocess Data"):
-                contextual_results1 = process_entities_with_context(results1, documents)
-                contextual_results2 = process_pos_with_context(results2, documents)
-
-                final_results = process_all_results(
-                    contextual_results1, contextual_results2
-                )
-                unique_files = list(
-                    set(item["file_name"] for item in final_results["pii_results"])
-                )
-                segregated_results = segregate_by_file(
-                    final_results["pii_results"], unique_files
-                )
-                files_alias = await process_all_files_alias(segregated_results, subject)
-
-                all_aliases = []
-                for aliases in files_alias.values():
-                    all_aliases.extend(aliases)
-
-                unique_all_aliases = list(set(all_aliases))
-                all_aliases = [subject] + unique_all_aliases
-                st.info(f"Aliases of the subject are {all_aliases}")
-
-                segregated_results_pos = segregate_by_file(
-                    final_results["pos_results"], unique_files
-                )
+        files = {
+            uploaded_file.name: uploaded_file.getvalue()
+            for uploaded_file in uploaded_files
+        }
+        estimate_column, process_column = st.columns(2)
+        if estimate_column.button("Estimate cost and time"):
+            # The planner runs the local stages here, so it is only imported on use
+            from src.core.planner import plan_bundle
 
-                non_alias_perameters = find_filtered_entities(
-                    segregated_results, files_alias, subject=subject
+            with st.spinner("Running the local stages to plan the job..."):
+                st.session_state["plan"] = await plan_bundle(
+                    files, subject, bundle_id.strip() or None
                 )
-                non_alias_perameters = clean_nested_dict(non_alias_perameters)
-                clean_pronouns = clean_nested_dict(segregated_results_pos)
+        if "plan" in st.session_state:
+            render_plan(st.session_state["plan"])
 
-            with st.spinner("Generating Redactions......."):
-                with get_openai_callback() as cb:
-                    redactions = await generate_redactions(
-                        non_alias_parameters=non_alias_perameters, alias=all_aliases
-                    )
-                    pronouns_redaction = await redact_pronouns(
-                        clean_pronouns, all_aliases
-                    )
-                    print(f"Total Cost (USD): ${format(cb.total_cost, '.6f')}")
+        if process_column.button("Process PDFs"):
+            # Each browser session counts as one user for fair scheduling
+            user_id = st.session_state.setdefault("user_id", uuid.uuid4().hex)
+            st.session_state["active_job"] = get_job_queue().submit(
+                user_id, subject, files, bundle_id=bundle_id.strip() or None
+            )
+            st.session_state.pop("job", None)
+            st.session_state.pop("plan", None)
 
-                st.toast(
-                    f"Total Cost (USD): ${format(cb.total_cost, '.6f')}", icon="💰"
-                )
+    elif uploaded_files and not subject:
+        st.warning("Please enter a subject before processing.")
 
-                st.info("These are the redactions")
-                st.json(redactions)
+    if "active_job" in st.session_state:
+        queue = get_job_queue()
+        job_id = st.session_state["active_job"]
+        status, rows = await follow_job(queue, job_id)
+        del st.session_state["active_job"]
 
-                st.info("These are the pronouns redacted")
-                st.json(pronouns_redaction)
+        if status["status"] == FAILED:
+            st.error(f"Job failed: {status['error']}")
+        else:
+            summary = status["summary"]
+            st.toast(
+                f"Total Cost (USD): ${format(summary['total_cost'], '.6f')}",
+                icon="💰",
+            )
+            # Keep the finished job so paging through results survives reruns
+            st.session_state["job"] = {
+                **summary,
+                "rows": rows,
+                "report": queue.artifact(job_id, REPORT_ARTIFACT),
+                "parquet": queue.artifact(job_id, PARQUET_ARTIFACT),
+                "finished_at": datetime.fromtimestamp(status["finished_at"]).strftime(
+                    "%Y%m%d_%H%M"
+                ),
+            }
 
-                # Add download buttons
-                try:
-                    combined_report = create_combined_report(
-                        results1, redactions, subject, pronouns_redaction
-                    )
-                    st.download_button(
-                        label="Download Complete Analysis Report",
-                        data=combined_report,
-                        file_name=f"document_analysis_report_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    )
-                except Exception as e:
-                    st.error(f"Error generating report: {str(e)}")
-
-    elif uploaded_files and not subject:
-        st.warning("Please enter a subject before processing.")
+    if "job" in st.session_state:
+        render_results(st.session_state["job"])
 
 
 async def main():
@@ -0,0 +1,412 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi.responses import Response, StreamingResponse
+
+from src.core.bundle_manifest import BundleManifest, upload_reference
+from src.core.entity_redaction import authenticate_client
+from src.core.events import serialize_event
+from src.core.pipeline import run_pipeline
+from src.jobs.job_queue import (
+    DONE,
+    FAILED,
+    PARQUET_ARTIFACT,
+    QUEUED,
+    RUNNING,
+)
+from src.jobs.worker import job_summary
+from src.utils.download_excel import create_combined_report
+from src.utils.intial_file_processing import extract_pdf_texts
+from src.utils.parquet_export import create_parquet_bundle
+
+load_dotenv()
+
+key = os.getenv("AZURE_PII_KEY")
+endpoint = os.getenv("AZURE_PII_ENDPOINT")
+
+# Jobs allowed to run the pipeline at the same time, the rest wait queued
+MAX_CONCURRENT_JOBS = int(os.getenv("API_MAX_CONCURRENT_JOBS", "8"))
+
+# Seconds a finished job and its results are kept in memory before eviction
+API_JOB_TTL_SECONDS = float(os.getenv("API_JOB_TTL_SECONDS", "3600"))
+
+# Seconds between keep-alive comments on an idle progress stream
+SSE_KEEPALIVE_SECONDS = 15
+
+# Bytes of the report sent per chunk of a download
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+
+
+class PipelineJob:
+    """A pipeline run owned by the API, with its events kept for replay."""
+
+    def __init__(
+        self, subject: str, file_names: List[str], bundle_id: Optional[str] = None
+    ):
+        self.id = uuid.uuid4().hex
+        self.subject = subject
+        self.bundle_id = bundle_id
+        self.file_names = file_names
+        self.status = QUEUED
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.events: List[Dict] = []
+        self.result: Optional[Dict] = None
+        self.artifacts: Dict[str, bytes] = {}
+        # Spooled report workbook, shared by every download of it and closed
+        # once the job is closed and no download is streaming it any more
+        self.report_file = None
+        self.report_lock = threading.Lock()
+        self.report_readers = 0
+        self.closed = False
+        self.changed = asyncio.Condition()
+        self.task: Optional[asyncio.Task] = None
+
+    async def publish(self, event: Dict) -> None:
+        async with self.changed:
+            self.events.append(event)
+            self.changed.notify_all()
+
+    async def set_status(self, status: str, error: Optional[str] = None) -> None:
+        async with self.changed:
+            self.status = status
+            self.error = error
+            if status in (DONE, FAILED):
+                self.finished_at = time.time()
+            self.changed.notify_all()
+
+    def _close_report(self) -> None:
+        if self.report_file is not None and not self.report_readers:
+            self.report_file.close()
+
+    def open_report(self) -> None:
+        with self.report_lock:
+            self.report_readers += 1
+
+    def release_report(self) -> None:
+        with self.report_lock:
+            self.report_readers -= 1
+            if self.closed:
+                self._close_report()
+
+    def close(self) -> None:
+        with self.report_lock:
+            self.closed = True
+            self._close_report()
+
+    def describe(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "subject": self.subject,
+            "bundle_id": self.bundle_id,
+            "files": self.file_names,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "events": len(self.events),
+            "summary": job_summary(self.result) if self.result else None,
+        }
+
+
+class ApiState:
+    """Clients and jobs shared by every request handled by this process."""
+
+    def __init__(self):
+        self.jobs: Dict[str, PipelineJob] = {}
+        self.client = None
+        self.slots = asyncio.Semaphore(MAX_CONCURRENT_JOBS)
+
+
+state = ApiState()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One Azure PII client for all jobs instead of one per run
+    state.client = await authenticate_client(endpoint=endpoint, key=key)
+    yield
+    for job in state.jobs.values():
+        if job.task is not None:
+            job.task.cancel()
+        job.close()
+
+
+app = FastAPI(title="SAR Redactions API", lifespan=lifespan)
+
+
+async def execute_job(job: PipelineJob, files: Dict[str, bytes]) -> None:
+    # Hashing the upload and loading the manifest pickle are CPU-bound
+    manifest = await asyncio.to_thread(
+        lambda: BundleManifest.for_bundle(job.bundle_id or upload_reference(files))
+    )
+    documents = await extract_pdf_texts(files, manifest)
+    async for event in run_pipeline(
+        documents,
+        job.subject,
+        key,
+        endpoint,
+        client=state.client,
+        manifest=manifest,
+    ):
+        if event["event"] == "result":
+            job.result = event
+        else:
+            await job.publish(serialize_event(event))
+
+
+async def run_job(job: PipelineJob, files: Dict[str, bytes]) -> None:
+    """
+    Run one job on the server's event loop, publishing every pipeline event
+
+    A job cancelled while queued or running ends as FAILED, so its clients and
+    event streams see it finish.
+    """
+    try:
+        async with state.slots:
+            await job.set_status(RUNNING)
+            await execute_job(job, files)
+    except asyncio.CancelledError:
+        await job.set_status(FAILED, "Job was cancelled")
+        raise
+    except Exception as e:
+        print(f"Job {job.id} failed: {str(e)}")
+        await job.set_status(FAILED, str(e))
+        return
+    await job.set_status(DONE)
+
+
+def evict_finished_jobs() -> None:
+    """Forget jobs that finished more than API_JOB_TTL_SECONDS ago."""
+    cutoff = time.time() - API_JOB_TTL_SECONDS
+    expired = [
+        job_id
+        for job_id, job in state.jobs.items()
+        if job.finished_at is not None and job.finished_at < cutoff
+    ]
+    for job_id in expired:
+        state.jobs.pop(job_id).close()
+    if expired:
+        print(f"Evicted {len(expired)} finished jobs")
+
+
+def get_job(job_id: str) -> PipelineJob:
+    job = state.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return job
+
+
+def get_finished_job(job_id: str) -> PipelineJob:
+    job = get_job(job_id)
+    if job.status == FAILED:
+        raise HTTPException(status_code=409, detail=f"Job failed: {job.error}")
+    if job.status != DONE:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    return job
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(
+    subject: str = Form(...),
+    files: List[UploadFile] = File(...),
+    bundle_id: Optional[str] = Form(None),
+):
+    """
+    Submit a bundle of PDF files for a subject; the job starts in the background.
+
+    Jobs sent with the same bundle_id only reprocess new or changed files.
+    """
+    evict_finished_jobs()
+    contents = {upload.filename: await upload.read() for upload in files}
+    job = PipelineJob(subject, list(contents), bundle_id or None)
+    state.jobs[job.id] = job
+    job.task = asyncio.create_task(run_job(job, contents))
+    return job.describe()
+
+
+@app.post("/plan")
+async def plan_job(
+    subject: str = Form(...),
+    files: List[UploadFile] = File(...),
+    bundle_id: Optional[str] = Form(None),
+):
+    """
+    Dry-run a bundle: estimated calls, tokens, time and cost per stage, without
+    calling Azure or the LLM and without touching the bundle's manifest.
+    """
+    from src.core.planner import plan_bundle
+
+    contents = {upload.filename: await upload.read() for upload in files}
+    return await plan_bundle(contents, subject, bundle_id or None)
+
+
+@app.get("/jobs")
+async def list_jobs():
+    evict_finished_jobs()
+    return [job.describe() for job in state.jobs.values()]
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    return get_job(job_id).describe()
+
+
+@app.delete("/jobs/{job_id}", status_code=204)
+async def delete_job(job_id: str):
+    job = get_job(job_id)
+    if job.task is not None and not job.task.done():
+        job.task.cancel()
+    state.jobs.pop(job_id).close()
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, after: int = 0):
+    """
+    Stream a job's progress as server-sent events
+
+    Events already produced are replayed first, starting after the given
+    sequence number, and the stream ends with an "end" event once the job has
+    finished.
+    """
+    job = get_job(job_id)
+
+    async def stream():
+        seq = after
+        while True:
+            async with job.changed:
+                try:
+                    await asyncio.wait_for(
+                        job.changed.wait_for(
+                            lambda: (
+                                len(job.events) > seq or job.status in (DONE, FAILED)
+                            )
+                        ),
+                        SSE_KEEPALIVE_SECONDS,
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                events = job.events[seq:]
+                finished = job.status in (DONE, FAILED)
+
+            if not events and not finished:
+                yield ": keep-alive\n\n"
+                continue
+
+            for event in events:
+                seq += 1
+                yield f"id: {seq}\nevent: {event['event']}\ndata: {json.dumps(event)}\n\n"
+
+            if finished and seq >= len(job.events):
+                end = {"status": job.status, "error": job.error}
+                yield f"event: end\ndata: {json.dumps(end)}\n\n"
+                return
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/jobs/{job_id}/results")
+async def job_results(job_id: str):
+    """Full results of a finished job as JSON, with the context of every redaction."""
+    job = get_finished_job(job_id)
+    result = job.result
+    context_store = result["context_store"]
+
+    def with_context(redaction):
+        return {
+            **redaction._asdict(),
+            "context": context_store.get(redaction.context_id),
+        }
+
+    return {
+        **job.describe(),
+        "files_alias": result["files_alias"],
+        "redactions": [with_context(item) for item in result["redactions"]],
+        "pronoun_redactions": [
+            with_context(item) for item in result["pronouns_redaction"]
+        ],
+        "stage_metrics": result["stage_metrics"],
+    }
+
+
+async def build_artifact(job: PipelineJob, name: str, build) -> bytes:
+    """Build a download once per job in a worker thread, keeping the loop free."""
+    if name not in job.artifacts:
+        job.artifacts[name] = await asyncio.to_thread(build)
+    return job.artifacts[name]
+
+
+def read_report_chunk(job: PipelineJob, offset: int) -> bytes:
+    # Downloads of the same report share one file and its position
+    with job.report_lock:
+        job.report_file.seek(offset)
+        return job.report_file.read(DOWNLOAD_CHUNK_BYTES)
+
+
+async def stream_report(job: PipelineJob):
+    """Stream the report of a job opened with open_report, releasing it at the end."""
+    try:
+        offset = 0
+        while True:
+            chunk = await asyncio.to_thread(read_report_chunk, job, offset)
+            if not chunk:
+                return
+            offset += len(chunk)
+            yield chunk
+    finally:
+        job.release_report()
+
+
+@app.get("/jobs/{job_id}/report.xlsx")
+async def job_report(job_id: str):
+    """Download the Excel report, built once per job and streamed in chunks."""
+    job = get_finished_job(job_id)
+    if job.report_file is None:
+        result = job.result
+        report_file = await asyncio.to_thread(
+            create_combined_report,
+            result["pii_results"],
+            result["redactions"],
+            job.subject,
+            result["context_store"],
+            result["pronouns_redaction"],
+        )
+        # Another download may have built it, or the job was deleted, meanwhile
+        if job.report_file is None and not job.closed:
+            job.report_file = report_file
+        else:
+            report_file.close()
+    if job.closed:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    job.open_report()
+    return StreamingResponse(
+        stream_report(job),
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={"Content-Disposition": f'attachment; filename="report_{job_id}.xlsx"'},
+    )
+
+
+@app.get("/jobs/{job_id}/parquet.zip")
+async def job_parquet(job_id: str):
+    job = get_finished_job(job_id)
+    bundle = await build_artifact(
+        job, PARQUET_ARTIFACT, lambda: create_parquet_bundle(job.result)
+    )
+    return Response(
+        bundle,
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="parquet_{job_id}.zip"'},
+    )
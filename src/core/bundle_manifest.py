@@ -0,0 +1,315 @@
+import hashlib
+import os
+import pickle
+import tempfile
+from contextlib import contextmanager
+from typing import Dict, FrozenSet, Iterable, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: saves still merge, without the lock
+    fcntl = None
+
+from src.core.records import ContextStore
+
+# Bump whenever cached records change shape so older manifests are ignored
+MANIFEST_VERSION = 2
+
+# Directory holding one manifest file per bundle
+BUNDLE_CACHE_DIR = os.getenv("BUNDLE_CACHE_DIR", "bundle_cache")
+
+
+def content_hash(content) -> str:
+    """SHA-256 of raw file bytes or of extracted text."""
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
+
+def upload_reference(files: Dict[str, bytes]) -> str:
+    """
+    Bundle reference derived from the uploaded files themselves, so uploading
+    the same files again for another subject finds their document analysis
+    """
+    digest = hashlib.sha256()
+    for file_name in sorted(files):
+        digest.update(file_name.encode("utf-8"))
+        digest.update(content_hash(files[file_name]).encode("ascii"))
+    return f"upload-{digest.hexdigest()}"
+
+
+def relocate(records: Iterable, source: ContextStore, target: ContextStore) -> List:
+    """Copy records into another context store, re-adding each record's context."""
+    return [
+        record._replace(context_id=target.add(source.get(record.context_id)))
+        for record in records
+    ]
+
+
+class BundleManifest:
+    """
+    Per-file content hashes and stage outputs of a bundle, kept between runs.
+
+    Each file entry holds the hash of the uploaded file with its extracted text,
+    the hash of that text with the subject-independent stage outputs (PII, POS
+    and contexts), and per subject the file's aliases and its redactions together
+    with the alias set they were produced for. Every entry keeps its own context
+    store, so records are copied in and out of a job's store by context text.
+    Entries are reset as soon as a file's content changes. A read-only manifest
+    serves cached outputs but never writes its file.
+
+    Several jobs may run on the same bundle at once, so save only writes the
+    parts this manifest changed, merged into the file as it is on disk.
+    """
+
+    def __init__(self, path: str, read_only: bool = False):
+        self.path = path
+        self.read_only = read_only
+        self.files: Dict[str, Dict] = self._load()
+        # Parts changed since loading, per file: "text", "analysis",
+        # ("aliases", subject) and ("redactions", subject)
+        self.changed: Dict[str, set] = {}
+
+    def _load(self) -> Dict[str, Dict]:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "rb") as f:
+                data = pickle.load(f)
+            if data.get("version") == MANIFEST_VERSION:
+                return data["files"]
+        except Exception as e:
+            print(f"Ignoring unreadable bundle manifest {self.path}: {str(e)}")
+        return {}
+
+    @classmethod
+    def for_bundle(
+        cls, bundle_id: str, cache_dir: str = BUNDLE_CACHE_DIR, read_only: bool = False
+    ):
+        """Open the manifest of a bundle, named by its reference."""
+        return cls(
+            os.path.join(cache_dir, f"{content_hash(bundle_id)[:32]}.pkl"),
+            read_only=read_only,
+        )
+
+    def _entry(self, file_name: str, text_hash: str) -> Dict:
+        """The file's entry, emptied first if it was built from other content."""
+        entry = self.files.get(file_name)
+        if entry is None or entry["hash"] != text_hash:
+            entry = {
+                "hash": text_hash,
+                "source_hash": None,
+                "text": None,
+                "analysis": None,
+                "subjects": {},
+                "contexts": ContextStore(),
+            }
+            self.files[file_name] = entry
+        return entry
+
+    def _current(self, file_name: str, text_hash: str) -> Optional[Dict]:
+        entry = self.files.get(file_name)
+        if entry is None or entry["hash"] != text_hash:
+            return None
+        return entry
+
+    def cached_text(self, file_name: str, source_hash: str) -> Optional[str]:
+        """Extracted text of a file when the same file was extracted before."""
+        entry = self.files.get(file_name)
+        if entry is None or entry["source_hash"] != source_hash:
+            return None
+        return entry["text"]
+
+    def store_text(self, file_name: str, source_hash: str, text: str) -> None:
+        entry = self._entry(file_name, content_hash(text))
+        entry["source_hash"] = source_hash
+        entry["text"] = text
+        self.changed.setdefault(file_name, set()).add("text")
+
+    def analysis(
+        self, file_name: str, text_hash: str, context_store: ContextStore
+    ) -> Optional[Dict]:
+        """
+        Subject-independent outputs of an unchanged file, with its mentions and
+        windows copied into context_store
+
+        Returns:
+            dict: "pii" and "pos" results (None when nothing was found), "mentions"
+                and "windows", or None when the file has to be analysed again
+        """
+        entry = self._current(file_name, text_hash)
+        if entry is None or entry["analysis"] is None:
+            return None
+
+        analysis = entry["analysis"]
+        return {
+            "pii": analysis["pii"],
+            "pos": analysis["pos"],
+            "mentions": relocate(
+                analysis["mentions"], entry["contexts"], context_store
+            ),
+            "windows": relocate(analysis["windows"], entry["contexts"], context_store),
+        }
+
+    def store_analysis(
+        self,
+        file_name: str,
+        text_hash: str,
+        pii: Optional[Dict],
+        pos: Optional[Dict],
+        mentions: List,
+        windows: List,
+        context_store: ContextStore,
+    ) -> None:
+        entry = self._entry(file_name, text_hash)
+        entry["analysis"] = {
+            "pii": pii,
+            "pos": pos,
+            "mentions": relocate(mentions, context_store, entry["contexts"]),
+            "windows": relocate(windows, context_store, entry["contexts"]),
+        }
+        self.changed.setdefault(file_name, set()).add("analysis")
+
+    def aliases(self, file_name: str, text_hash: str, subject: str) -> Optional[List]:
+        entry = self._current(file_name, text_hash)
+        if entry is None:
+            return None
+        return entry["subjects"].get(subject, {}).get("aliases")
+
+    def store_aliases(
+        self, file_name: str, text_hash: str, subject: str, aliases: List[str]
+    ) -> None:
+        entry = self._entry(file_name, text_hash)
+        entry["subjects"].setdefault(subject, {})["aliases"] = list(aliases)
+        self.changed.setdefault(file_name, set()).add(("aliases", subject))
+
+    def redactions(
+        self,
+        file_name: str,
+        text_hash: str,
+        subject: str,
+        alias_set: FrozenSet[str],
+        context_store: ContextStore,
+    ) -> Optional[Dict]:
+        """
+        Earlier redactions of an unchanged file, reusable only when they were
+        produced for exactly the same subject and alias set
+
+        Returns:
+            dict: "redactions" and "pronoun_redactions" copied into context_store,
+                or None when the file has to be redacted again
+        """
+        entry = self._current(file_name, text_hash)
+        if entry is None:
+            return None
+        state = entry["subjects"].get(subject, {})
+        if state.get("alias_set") != alias_set:
+            return None
+
+        return {
+            "redactions": relocate(
+                state["redactions"], entry["contexts"], context_store
+            ),
+            "pronoun_redactions": relocate(
+                state["pronoun_redactions"], entry["contexts"], context_store
+            ),
+        }
+
+    def store_redactions(
+        self,
+        file_name: str,
+        text_hash: str,
+        subject: str,
+        alias_set: FrozenSet[str],
+        redactions: List,
+        pronoun_redactions: List,
+        context_store: ContextStore,
+    ) -> None:
+        entry = self._entry(file_name, text_hash)
+        state = entry["subjects"].setdefault(subject, {})
+        state["alias_set"] = alias_set
+        state["redactions"] = relocate(redactions, context_store, entry["contexts"])
+        state["pronoun_redactions"] = relocate(
+            pronoun_redactions, context_store, entry["contexts"]
+        )
+        self.changed.setdefault(file_name, set()).add(("redactions", subject))
+
+    @contextmanager
+    def _locked(self):
+        """Hold an exclusive lock on the manifest while it is merged and written."""
+        if fcntl is None:
+            yield
+            return
+        with open(f"{self.path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _merge(self, files: Dict[str, Dict]) -> Dict[str, Dict]:
+        """
+        The manifest on disk with the parts this manifest changed applied to it
+
+        An entry built from other content than the one on disk replaces it.
+        Otherwise only the changed parts are copied, so entries other jobs added
+        for other files or subjects are kept.
+        """
+        for file_name, parts in self.changed.items():
+            entry = self.files[file_name]
+            target = files.get(file_name)
+            if target is None or target["hash"] != entry["hash"]:
+                files[file_name] = entry
+                continue
+
+            source, contexts = entry["contexts"], target["contexts"]
+            for part in parts:
+                if part == "text":
+                    target["source_hash"] = entry["source_hash"]
+                    target["text"] = entry["text"]
+                elif part == "analysis":
+                    analysis = entry["analysis"]
+                    target["analysis"] = {
+                        "pii": analysis["pii"],
+                        "pos": analysis["pos"],
+                        "mentions": relocate(analysis["mentions"], source, contexts),
+                        "windows": relocate(analysis["windows"], source, contexts),
+                    }
+                else:
+                    kind, subject = part
+                    state = entry["subjects"][subject]
+                    target_state = target["subjects"].setdefault(subject, {})
+                    if kind == "aliases":
+                        target_state["aliases"] = list(state["aliases"])
+                    else:
+                        target_state["alias_set"] = state["alias_set"]
+                        target_state["redactions"] = relocate(
+                            state["redactions"], source, contexts
+                        )
+                        target_state["pronoun_redactions"] = relocate(
+                            state["pronoun_redactions"], source, contexts
+                        )
+        return files
+
+    def save(self) -> None:
+        """
+        Merge the changed parts into the manifest on disk and write it
+        atomically, under a lock, so a crash or a concurrent job never leaves
+        half a file or drops another job's entries
+        """
+        if self.read_only or not self.changed:
+            return
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        with self._locked():
+            files = self._merge(self._load())
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump({"version": MANIFEST_VERSION, "files": files}, f)
+                os.replace(temp_path, self.path)
+            except BaseException:
+                os.remove(temp_path)
+                raise
+        self.files = files
+        self.changed = {}
@@ -0,0 +1,557 @@
+import asyncio
+import hashlib
+import os
+import re
+import zlib
+from bisect import bisect_right
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from src.core.records import Entity, intern_label
+
+# Blocks shorter than this are only matched byte for byte, they are too short
+# to fingerprint; blocks under MIN_EXACT_BLOCK_CHARS are always analysed
+DEDUP_MIN_BLOCK_CHARS = int(os.getenv("DEDUP_MIN_BLOCK_CHARS", "80"))
+MIN_EXACT_BLOCK_CHARS = 20
+
+# Estimated Jaccard similarity of word shingles above which blocks are near
+# duplicates
+DEDUP_SIMILARITY = float(os.getenv("DEDUP_SIMILARITY", "0.8"))
+
+# MinHash signature length, split into LSH bands of equal rows
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16
+SHINGLE_WORDS = 3
+
+# Maximum size of the chunks residual text is analysed in, as for documents
+CHUNK_SIZE = 500
+
+# Paragraphs are separated by blank lines, also blank quoted lines of a reply,
+# and so are the pages of a PDF
+BLOCK_SEPARATOR = re.compile(r"\n[ \t>]*\n\s*")
+QUOTE_MARKER = re.compile(r"^[ \t]*(?:>[ \t]?)+", re.MULTILINE)
+WORD = re.compile(r"\w+")
+
+# Separator between the pieces of a residual text
+PIECE_SEPARATOR = "\n\n"
+
+# Kinds of block: analysed, byte-identical repeat, or repeat with changes
+UNIQUE = "unique"
+EXACT = "exact"
+NEAR = "near"
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_rng = np.random.default_rng(0x5EED)
+_HASH_A = _rng.integers(1, 1 << 32, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+_HASH_B = _rng.integers(0, 1 << 32, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+
+class Block(NamedTuple):
+    """
+    A paragraph of a document, in document coordinates
+
+    canonical is the index of the analysed block it repeats, None for unique
+    blocks. novel holds the ranges of a near duplicate's lines that do not occur
+    in its canonical block.
+    """
+
+    file_name: str
+    start: int
+    end: int
+    kind: str
+    canonical: Optional[int]
+    novel: Tuple[Tuple[int, int], ...] = ()
+
+
+def document_text(content) -> str:
+    """Text of a document as every stage sees it, chunks joined with a space."""
+    return " ".join(content) if isinstance(content, list) else content
+
+
+def split_blocks(text: str) -> List[Tuple[int, int]]:
+    """Offsets of the paragraphs of a text, without their surrounding whitespace."""
+    blocks = []
+    start = 0
+    for separator in BLOCK_SEPARATOR.finditer(text):
+        if text[start : separator.start()].strip():
+            blocks.append((start, separator.start()))
+        start = separator.end()
+    if text[start:].strip():
+        blocks.append((start, len(text.rstrip())))
+    return blocks
+
+
+def normalize(text: str) -> str:
+    """Block text without reply quote markers and with whitespace collapsed."""
+    return " ".join(QUOTE_MARKER.sub("", text).split())
+
+
+def minhash(normalized: str) -> np.ndarray:
+    """MinHash signature of the word shingles of a normalized block."""
+    words = WORD.findall(normalized.lower())
+    shingles = {
+        " ".join(words[idx : idx + SHINGLE_WORDS])
+        for idx in range(max(len(words) - SHINGLE_WORDS + 1, 1))
+    }
+    values = np.fromiter(
+        (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+    return ((np.outer(values, _HASH_A) + _HASH_B) % _MERSENNE_PRIME).min(axis=0)
+
+
+def _line_ranges(text: str, start: int, end: int):
+    """(start, end, normalized text) of every non-empty line of a block."""
+    position = start
+    for line in text[start:end].split("\n"):
+        normalized = normalize(line)
+        if normalized:
+            yield position, position + len(line), normalized
+        position += len(line) + 1
+
+
+def _merge_ranges(text: str, ranges: Iterable[Tuple[int, int]]) -> List[List[int]]:
+    """Join ranges separated by whitespace only, so pieces keep the original text."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and not text[merged[-1][1] : start].strip():
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def split_chunks(text: str, chunk_size: int = CHUNK_SIZE) -> List[str]:
+    """
+    Split text into chunks of about chunk_size at spaces
+
+    Each split consumes exactly one space, so the chunks joined with a single
+    space give back the text and offsets in the joined chunks are text offsets.
+    """
+    chunks = []
+    start = 0
+    while len(text) - start > chunk_size:
+        split = text.rfind(" ", start + 1, start + chunk_size)
+        if split == -1:
+            split = text.find(" ", start + chunk_size)
+            if split == -1:
+                break
+        chunks.append(text[start:split])
+        start = split + 1
+    chunks.append(text[start:])
+    return chunks
+
+
+class ResidualText:
+    """
+    The parts of a document that still need analysing, joined into one text
+
+    Offsets found in the residual text are mapped back to the document with
+    to_document.
+    """
+
+    def __init__(self, text: str, ranges: Iterable[Tuple[int, int]]):
+        self.starts: List[int] = []
+        self.document_starts: List[int] = []
+        self.lengths: List[int] = []
+        pieces = []
+        position = 0
+        for start, end in ranges:
+            if pieces:
+                position += len(PIECE_SEPARATOR)
+            self.starts.append(position)
+            self.document_starts.append(start)
+            self.lengths.append(end - start)
+            pieces.append(text[start:end])
+            position += end - start
+        self.text = PIECE_SEPARATOR.join(pieces)
+
+    def chunks(self) -> List[str]:
+        return split_chunks(self.text)
+
+    def _piece(self, offset: int) -> int:
+        return max(bisect_right(self.starts, offset) - 1, 0)
+
+    def to_document(self, offset: int) -> int:
+        piece = self._piece(offset)
+        return self.document_starts[piece] + offset - self.starts[piece]
+
+    def piece_bounds(self, offset: int) -> Tuple[int, int]:
+        """Residual offsets of the piece holding offset."""
+        piece = self._piece(offset)
+        return self.starts[piece], self.starts[piece] + self.lengths[piece]
+
+
+def _best_entities(result: Optional[Dict]) -> Dict[Tuple[str, str], Entity]:
+    """Entities of a PII result keyed by (category, text)."""
+    if not result:
+        return {}
+    return {
+        (entity.category, entity.text): entity
+        for entities in result["categories"].values()
+        for entity in entities
+    }
+
+
+def _pii_result(file_name: str, entities: Dict) -> Dict:
+    categories = {}
+    for entity in entities.values():
+        categories.setdefault(entity.category, []).append(entity)
+    return {"file_name": file_name, "categories": categories}
+
+
+def _pos_result(file_name: str, occurrences: List) -> Dict:
+    """POS result rebuilt from its occurrences, categories listing each word once."""
+    words = {}
+    for occurrence in occurrences:
+        words.setdefault(occurrence.pos_category, set()).add(occurrence.text)
+    return {
+        "file_name": file_name,
+        "categories": {
+            category: [{"text": word} for word in sorted(entries)]
+            for category, entries in words.items()
+        },
+        "occurrences": occurrences,
+    }
+
+
+def map_pii_result(result: Optional[Dict], residual: ResidualText) -> Optional[Dict]:
+    """Move the entity offsets of a PII result from residual to document text."""
+    if not result or residual is None:
+        return result
+    return {
+        **result,
+        "categories": {
+            category: [
+                entity._replace(offset=residual.to_document(entity.offset))
+                if entity.offset >= 0
+                else entity
+                for entity in entities
+            ]
+            for category, entities in result["categories"].items()
+        },
+    }
+
+
+def map_pos_result(result: Optional[Dict], residual: ResidualText) -> Optional[Dict]:
+    """
+    Move the occurrence offsets of a POS result from residual to document text,
+    keeping each sentence within the piece its token came from
+    """
+    if not result or residual is None:
+        return result
+
+    occurrences = []
+    for occurrence in result.get("occurrences", ()):
+        piece_start, piece_end = residual.piece_bounds(occurrence.start)
+        antecedent = occurrence.antecedent
+        if antecedent is not None:
+            antecedent = antecedent._replace(
+                start=residual.to_document(antecedent.start),
+                end=residual.to_document(antecedent.end),
+            )
+        occurrences.append(
+            occurrence._replace(
+                start=residual.to_document(occurrence.start),
+                end=residual.to_document(occurrence.end),
+                sentence_start=residual.to_document(
+                    max(occurrence.sentence_start, piece_start)
+                ),
+                sentence_end=residual.to_document(
+                    min(occurrence.sentence_end, piece_end)
+                ),
+                antecedent=antecedent,
+            )
+        )
+    return {**result, "occurrences": occurrences}
+
+
+class DedupPlan:
+    """
+    Duplicate paragraphs and pages of a bundle, found before any analysis
+
+    Every paragraph (pages are separated by blank lines too) is fingerprinted
+    three ways: a hash of its bytes, a hash of its text without reply quote
+    markers or whitespace changes, and a MinHash of its word shingles. The first
+    occurrence of a paragraph is analysed; later byte-identical copies are
+    skipped by both PII and POS analysis, and other near duplicates only send
+    their changed lines to PII analysis. The results of the analysed paragraph
+    are then projected onto every copy.
+    """
+
+    def __init__(
+        self,
+        texts: Dict[str, str],
+        order: Optional[Iterable[str]] = None,
+        min_block_chars: int = DEDUP_MIN_BLOCK_CHARS,
+        similarity: float = DEDUP_SIMILARITY,
+    ):
+        self.texts = texts
+        self.blocks: List[Block] = []
+        self.file_blocks: Dict[str, List[int]] = {file_name: [] for file_name in texts}
+
+        exact = {}
+        normalized_index = {}
+        bands = {}
+        signatures = {}
+        rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+
+        for file_name in order or texts:
+            text = texts[file_name]
+            for start, end in split_blocks(text):
+                raw = text[start:end]
+                kind = UNIQUE
+                canonical = None
+                raw_hash = hashlib.sha1(raw.encode("utf-8")).digest()
+                fingerprinted = len(raw) >= min_block_chars
+                if len(raw) >= MIN_EXACT_BLOCK_CHARS and raw_hash in exact:
+                    kind, canonical = EXACT, exact[raw_hash]
+                elif fingerprinted:
+                    normalized = normalize(raw)
+                    normalized_hash = hashlib.sha1(normalized.encode("utf-8")).digest()
+                    signature = minhash(normalized)
+                    keys = [
+                        (band, signature[band * rows : (band + 1) * rows].tobytes())
+                        for band in range(MINHASH_BANDS)
+                    ]
+                    if normalized_hash in normalized_index:
+                        kind, canonical = NEAR, normalized_index[normalized_hash]
+                    else:
+                        candidates = {idx for key in keys for idx in bands.get(key, ())}
+                        best = 0.0
+                        for idx in sorted(candidates):
+                            score = float(np.mean(signatures[idx] == signature))
+                            if score >= similarity and score > best:
+                                kind, canonical, best = NEAR, idx, score
+
+                if kind == UNIQUE:
+                    idx = len(self.blocks)
+                    exact.setdefault(raw_hash, idx)
+                    if fingerprinted:
+                        normalized_index[normalized_hash] = idx
+                        signatures[idx] = signature
+                        for key in keys:
+                            bands.setdefault(key, []).append(idx)
+
+                novel = ()
+                if kind == NEAR:
+                    source = self.blocks[canonical]
+                    known = {
+                        line
+                        for _, _, line in _line_ranges(
+                            texts[source.file_name], source.start, source.end
+                        )
+                    }
+                    novel = tuple(
+                        (line_start, line_end)
+                        for line_start, line_end, line in _line_ranges(text, start, end)
+                        if line not in known
+                    )
+
+                self.file_blocks[file_name].append(len(self.blocks))
+                self.blocks.append(Block(file_name, start, end, kind, canonical, novel))
+
+    def _residual(self, file_name: str, ranges) -> Optional[ResidualText]:
+        """None when the ranges cover the whole document, which is analysed as is."""
+        text = self.texts[file_name]
+        merged = _merge_ranges(text, ranges)
+        if len(merged) == 1 and not text[: merged[0][0]].strip():
+            if not text[merged[0][1] :].strip():
+                return None
+        return ResidualText(text, merged)
+
+    def pii_residual(self, file_name: str) -> Optional[ResidualText]:
+        """Unique paragraphs and the changed lines of near duplicates."""
+        ranges = []
+        for idx in self.file_blocks[file_name]:
+            block = self.blocks[idx]
+            if block.kind == UNIQUE:
+                ranges.append((block.start, block.end))
+            elif block.kind == NEAR:
+                ranges.extend(block.novel)
+        return self._residual(file_name, ranges)
+
+    def pos_residual(self, file_name: str) -> Optional[ResidualText]:
+        """Every paragraph except byte-identical copies."""
+        return self._residual(
+            file_name,
+            [
+                (self.blocks[idx].start, self.blocks[idx].end)
+                for idx in self.file_blocks[file_name]
+                if self.blocks[idx].kind != EXACT
+            ],
+        )
+
+    def analysis_input(self, file_name: str, content, stage: str):
+        """
+        What to analyse for a file in the "pii" or "pos" stage
+
+        Returns:
+            tuple: (content to analyse or None when nothing is left, and the
+                ResidualText its offsets are mapped back with, or None when the
+                whole document is analysed)
+        """
+        if stage == "pii":
+            residual = self.pii_residual(file_name)
+        else:
+            residual = self.pos_residual(file_name)
+        if residual is None:
+            return content, None
+        if not residual.text:
+            return None, residual
+        return residual.chunks(), residual
+
+    def _repeats(self, targets: Iterable[str]):
+        """Repeated blocks of the target files with the block each one repeats."""
+        for file_name in targets:
+            for idx in self.file_blocks[file_name]:
+                block = self.blocks[idx]
+                if block.kind != UNIQUE:
+                    yield block, self.blocks[block.canonical]
+
+    def repeating_files(self, sources: Iterable[str], targets: Iterable[str]) -> set:
+        """Target files repeating a paragraph whose analysis belongs to a source file."""
+        sources = set(sources)
+        return {
+            block.file_name
+            for block, source in self._repeats(targets)
+            if source.file_name in sources
+        }
+
+    def project_pii(
+        self, results: Dict[str, Optional[Dict]], targets: Iterable[str]
+    ) -> Dict:
+        """
+        Add the entities of analysed paragraphs to the target files repeating them
+
+        An entity of the canonical file that occurs in the canonical paragraph is
+        located in the copy by its text. Each file keeps its most confident
+        detection per entity, as pii_recognition_by_category does.
+        """
+        own = {
+            file_name: _best_entities(result) for file_name, result in results.items()
+        }
+        merged = {file_name: dict(entities) for file_name, entities in own.items()}
+        for block, source in self._repeats(targets):
+            if block.file_name not in merged:
+                continue
+            source_text = self.texts[source.file_name][source.start : source.end]
+            copy_text = self.texts[block.file_name][block.start : block.end]
+            entities = merged[block.file_name]
+            for key, entity in own.get(source.file_name, {}).items():
+                if entity.text not in source_text:
+                    continue
+                position = copy_text.find(entity.text)
+                if position == -1:
+                    continue
+                current = entities.get(key)
+                if (
+                    current is None
+                    or entity.confidence_score > current.confidence_score
+                ):
+                    entities[key] = entity._replace(
+                        file_name=intern_label(block.file_name),
+                        offset=block.start + position,
+                    )
+
+        projected = dict(results)
+        for file_name, entities in merged.items():
+            if len(entities) != len(own[file_name]) or entities != own[file_name]:
+                projected[file_name] = _pii_result(file_name, entities)
+        return projected
+
+    def project_pos(
+        self, results: Dict[str, Optional[Dict]], targets: Iterable[str]
+    ) -> Dict:
+        """Copy the occurrences of analysed paragraphs onto exact copies in targets."""
+        own = {
+            file_name: sorted(
+                (result or {}).get("occurrences", ()), key=lambda item: item.start
+            )
+            for file_name, result in results.items()
+        }
+        starts = {
+            file_name: [occurrence.start for occurrence in occurrences]
+            for file_name, occurrences in own.items()
+        }
+        added = {}
+        for block, source in self._repeats(targets):
+            if block.kind != EXACT or block.file_name not in own:
+                continue
+            occurrences = own.get(source.file_name, [])
+            first = bisect_right(starts.get(source.file_name, []), source.start - 1)
+            shift = block.start - source.start
+            for occurrence in occurrences[first:]:
+                if occurrence.end > source.end:
+                    break
+                antecedent = occurrence.antecedent
+                if antecedent is not None:
+                    if antecedent.start < source.start or antecedent.end > source.end:
+                        antecedent = None
+                    else:
+                        antecedent = antecedent._replace(
+                            start=antecedent.start + shift, end=antecedent.end + shift
+                        )
+                added.setdefault(block.file_name, []).append(
+                    occurrence._replace(
+                        start=occurrence.start + shift,
+                        end=occurrence.end + shift,
+                        sentence_start=max(occurrence.sentence_start, source.start)
+                        + shift,
+                        sentence_end=min(occurrence.sentence_end, source.end) + shift,
+                        antecedent=antecedent,
+                    )
+                )
+
+        projected = dict(results)
+        for file_name, occurrences in added.items():
+            projected[file_name] = _pos_result(
+                file_name,
+                sorted(own[file_name] + occurrences, key=lambda item: item.start),
+            )
+        return projected
+
+    def stats(self) -> Dict:
+        counts = {UNIQUE: 0, EXACT: 0, NEAR: 0}
+        for block in self.blocks:
+            counts[block.kind] += 1
+        return {
+            "blocks": len(self.blocks),
+            "exact_duplicates": counts[EXACT],
+            "near_duplicates": counts[NEAR],
+        }
+
+
+class SharedCalls:
+    """
+    Runs each distinct request once per job; repeats of it await the same task
+
+    Used for LLM requests whose payload is identical across files, such as the
+    same mention in the same context of a duplicated email. A shared task is
+    cancelled once every caller awaiting it has been cancelled, and only then.
+    """
+
+    def __init__(self):
+        self._tasks: Dict = {}
+        self._waiters: Dict = {}
+        self.requests = 0
+
+    async def run(self, key, factory):
+        self.requests += 1
+        task = self._tasks.get(key)
+        if task is None or task.cancelled():
+            task = asyncio.ensure_future(factory())
+            self._tasks[key] = task
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key] and not task.done():
+                task.cancel()
+
+    @property
+    def calls(self) -> int:
+        return len(self._tasks)
@@ -3,12 +3,26 @@ from azure.core.credentials import AzureKeyCredential
 from collections import defaultdict
 import asyncio
 from typing import Dict, List, Union
+from src.core.records import Entity, intern_label
+from src.core.resilience import get_breaker, guarded_call, retry_call
+
+# PII categories used downstream; Azure is asked for these only
+PII_CATEGORIES = [
+    "Organization",
+    "PhoneNumber",
+    "PersonType",
+    "Address",
+    "Person",
+    "Email",
+    "DateTime",
+]
 
 
 async def authenticate_client(endpoint: str, key: str) -> TextAnalyticsClient:
     ta_credential = AzureKeyCredential(key)
+    # retry_call owns the retries, so the SDK retry policy is turned off
     text_analytics_client = TextAnalyticsClient(
-        endpoint=endpoint, credential=ta_credential
+        endpoint=endpoint, credential=ta_credential, retry_total=0
     )
     return text_analytics_client
 
@@ -18,6 +32,10 @@ async def pii_recognition_by_category(
 ):
     """
     Process either a single document or a list of document chunks
+
+    Only the categories in PII_CATEGORIES are requested. Each entity keeps the
+    offset of its most confident detection, mapped from its chunk to the
+    document text with chunks joined by a single space.
     """
     # Ensure document_chunks is a list
     if isinstance(document_chunks, str):
@@ -25,49 +43,60 @@ async def pii_recognition_by_category(
     else:
         documents = document_chunks
 
-    categories = [
-        "Organization",
-        "PhoneNumber",
-        "PersonType",
-        "Address",
-        "Person",
-        "Email",
-        "DateTime",
-    ]
-
+    file_name = intern_label(file_name)
     categorized_results = {
         "file_name": file_name,
-        "categories": {category: [] for category in categories},
+        "categories": {category: [] for category in PII_CATEGORIES},
     }
 
-    # Track unique entities across all chunks
-    unique_entries = defaultdict(lambda: defaultdict(float))
+    # Track unique entities across all chunks as (confidence, offset, length)
+    unique_entries = defaultdict(dict)
+
+    # Start offset of each chunk in the joined document text
+    chunk_offsets = []
+    offset = 0
+    for chunk in documents:
+        chunk_offsets.append(offset)
+        offset += len(chunk) + 1
 
     try:
         # Process each chunk separately
-        for chunk in documents:
-            # Run the synchronous operation in a thread pool
-            response = await asyncio.to_thread(
-                client.recognize_pii_entities, [chunk], language="en"
+        for chunk, chunk_offset in zip(documents, chunk_offsets):
+            # Run the synchronous operation in a thread pool, sent
+            # through the endpoint's circuit breaker, retried per error class
+            response = await retry_call(
+                lambda repair: guarded_call(
+                    get_breaker("azure_pii"),
+                    lambda: asyncio.to_thread(
+                        client.recognize_pii_entities,
+                        [chunk],
+                        language="en",
+                        categories_filter=PII_CATEGORIES,
+                    ),
+                ),
+                f"PII of {file_name}",
+                "azure_pii",
             )
             result = [doc for doc in response if not doc.is_error]
 
             for doc in result:
                 for entity in doc.entities:
                     if entity.confidence_score > confidence_threshold:
-                        # Update if this is a new entry or has higher confidence
-                        current_confidence = unique_entries[entity.category][
-                            entity.text
-                        ]
-                        if entity.confidence_score > current_confidence:
+                        # Keep the most confident detection of each entity text
+                        current = unique_entries[entity.category].get(entity.text)
+                        if current is None or entity.confidence_score > current[0]:
                             unique_entries[entity.category][entity.text] = (
-                                entity.confidence_score
+                                entity.confidence_score,
+                                chunk_offset + entity.offset,
+                                entity.length,
                             )
 
         # Convert the unique entries to the final format
-        for category in categories:
-            for text, confidence in unique_entries[category].items():
-                entity_info = {"text": text, "confidence_score": confidence}
+        for category in PII_CATEGORIES:
+            for text, (confidence, offset, length) in unique_entries[category].items():
+                entity_info = Entity(
+                    file_name, intern_label(category), text, confidence, offset, length
+                )
                 categorized_results["categories"][category].append(entity_info)
 
     except Exception as e:
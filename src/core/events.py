@@ -0,0 +1,61 @@
+"""
+Pipeline stages and the progress events streamed while they run
+
+Kept free of heavy dependencies so the UI can render progress without importing
+the pipeline itself.
+"""
+
+import time
+from typing import Dict, Optional
+
+# Human readable label for each pipeline stage
+STAGES = {
+    "pii": "Detecting PII",
+    "pos": "Analysing parts of speech",
+    "context": "Building contexts",
+    "aliases": "Identifying subject aliases",
+    "redactions": "Generating entity redactions",
+    "pronouns": "Generating pronoun redactions",
+}
+
+
+def stage_event(stage: str, status: str, **fields) -> Dict:
+    return {"event": "stage", "stage": stage, "status": status, **fields}
+
+
+def progress_event(stage: str, file_name: str, done: int, total: int) -> Dict:
+    return {
+        "event": "progress",
+        "stage": stage,
+        "file_name": file_name,
+        "done": done,
+        "total": total,
+    }
+
+
+class StageMetrics:
+    """Times pipeline stages and keeps one metric per finished stage."""
+
+    def __init__(self):
+        self.metrics = []
+        self._started = {}
+        self._totals = {}
+
+    def start(self, stage: str, total: Optional[int] = None) -> Dict:
+        self._started[stage] = time.perf_counter()
+        self._totals[stage] = total
+        return stage_event(stage, "start", total=total)
+
+    def done(self, stage: str) -> Dict:
+        elapsed = time.perf_counter() - self._started[stage]
+        self.metrics.append(
+            {"stage": stage, "elapsed": elapsed, "total": self._totals[stage]}
+        )
+        return stage_event(stage, "done", elapsed=elapsed)
+
+
+def serialize_event(event: Dict) -> Dict:
+    """Turn a progress event into plain JSON, flattening Redaction records."""
+    if event["event"] == "redaction":
+        return {**event, "item": event["item"]._asdict()}
+    return event
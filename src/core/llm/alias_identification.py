@@ -1,61 +1,101 @@
-from src.core.llm.prompts import alias_prompt
-from langchain_openai import AzureChatOpenAI
+from functools import lru_cache
+from src.core.llm.client import get_structured_llm
 from src.core.llm.pydantic_classes import AliasMatch
-from dotenv import load_dotenv
-import os
-import json
-import asyncio
+from src.core.llm.routing import RoutedChain
+from src.core.resilience import retry_call, with_repair
+from src.utils.context_budget import count_tokens
 
-load_dotenv()
-version = os.getenv("AZURE_OPENAI_API_VERSION")
-azure_deployment = os.getenv("AZURE_OPENAI_CHAT_MODEL_ADVANCE")
 
+@lru_cache(maxsize=None)
+def get_tier_alias_chain(tier):
+    """Alias identification chain of a model tier."""
+    from src.core.llm.prompts import alias_prompt
 
-llm = AzureChatOpenAI(
-    azure_deployment=azure_deployment,
-    api_version=version,
-    temperature=0,
-    max_retries=2,
-)
+    return alias_prompt | get_structured_llm(AliasMatch, tier)
 
 
-async def get_allias_list(final_result, subject):
-    filtered_data = [
-        item for item in final_result if item["entity_type"] in ["Person", "PersonType"]
-    ]
+def alias_context_tokens(input_data):
+    return sum(count_tokens(item["context"]) for item in input_data["final_result"])
 
-    # Remove 'file_name' key from each dictionary in the list
-    for item in filtered_data:
-        item.pop("file_name", None)
 
-    # Write filtered data to JSON file
-    with open("filter_data.json", "w") as f:
-        json.dump(filtered_data, f, indent=4)
+def aliases_answered(input_data, result):
+    """
+    A fast answer is kept when it found aliases and each of them appears in the
+    file's mentions or contexts; an empty list may be a missed subject, which
+    would leave the subject's own mentions redacted, and an alias found nowhere
+    in the input is a guess
+    """
+    texts = [
+        text
+        for item in input_data["final_result"]
+        for text in (item["entity_text"], item["context"] or "")
+    ]
+    return bool(result.aliases) and all(
+        any(alias in text for text in texts) for alias in result.aliases
+    )
 
-    structured_llm = llm.with_structured_output(AliasMatch)
-    alias_chain = alias_prompt | structured_llm
-    input_data = {"subject": subject, "final_result": filtered_data}
-    alias_result = await alias_chain.ainvoke(input_data)
-    return alias_result
 
+@lru_cache(maxsize=None)
+def get_alias_chain():
+    """Routed alias identification chain, built on first use."""
+    return RoutedChain(
+        "aliases", get_tier_alias_chain, aliases_answered, alias_context_tokens
+    )
 
-async def process_all_files_alias(segregated_results, subject):
-    async def safe_process(file_name, file_data):
-        try:
-            result = await get_allias_list(file_data, subject)
-            return file_name, result.aliases
-        except Exception as e:
-            print(f"Error processing {file_name}: {str(e)}")
-            return file_name, []
 
-    # Create tasks for each file
-    tasks = [
-        safe_process(file_name, file_data)
-        for file_name, file_data in segregated_results.items()
+def alias_input(final_result, subject, context_store):
+    """Alias prompt input: the file's Person and PersonType mentions with context."""
+    filtered_data = [
+        {
+            "entity_type": item.entity_type,
+            "entity_text": item.entity_text,
+            "context": context_store.get(item.context_id),
+        }
+        for item in final_result
+        if item.entity_type in ("Person", "PersonType")
     ]
+    return {"subject": subject, "final_result": filtered_data}
+
+
+def alias_key(final_result):
+    """Files with the same key send the same alias request."""
+    return tuple(
+        (item.entity_type, item.entity_text, item.context_id)
+        for item in final_result
+        if item.entity_type in ("Person", "PersonType")
+    )
+
+
+async def get_allias_list(final_result, subject, context_store, max_retries=3):
+    input_data = alias_input(final_result, subject, context_store)
+    alias_result = await retry_call(
+        lambda repair: get_alias_chain().ainvoke(with_repair(input_data, repair)),
+        f"aliases of {subject}",
+        "llm",
+        max_retries,
+    )
+    return alias_result
+
 
-    # Run all tasks concurrently
-    results = await asyncio.gather(*tasks)
+async def get_file_aliases(
+    file_name, file_data, subject, context_store, shared_calls=None
+):
+    """
+    Find the subject aliases in one file, returning None as its aliases when the
+    call failed.
 
-    # Convert results to dictionary
-    return {file_name: aliases for file_name, aliases in results}
+    With shared_calls, files with the same Person mentions in the same contexts
+    (duplicated documents) share one call.
+    """
+    try:
+        if shared_calls is None:
+            result = await get_allias_list(file_data, subject, context_store)
+        else:
+            result = await shared_calls.run(
+                alias_key(file_data),
+                lambda: get_allias_list(file_data, subject, context_store),
+            )
+        return file_name, result.aliases
+    except Exception as e:
+        print(f"Error processing {file_name}: {str(e)}")
+        return file_name, None
@@ -0,0 +1,250 @@
+import asyncio
+import os
+import time
+import weakref
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Dict, Generator, List, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Azure OpenAI deployment of each model tier; the fast tier is optional, see
+# src.core.llm.routing
+LLM_DEPLOYMENTS = {
+    "advanced": os.getenv("AZURE_OPENAI_CHAT_MODEL_ADVANCE"),
+    "fast": os.getenv("AZURE_OPENAI_CHAT_MODEL_FAST"),
+}
+
+# Connection pool shared by every LLM chain, per event loop
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "200"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "50"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "").lower() in ("1", "true", "yes")
+
+# Seconds allowed to connect, to wait for a free pooled connection and to read
+# or write a response; a slow structured output is well within the read timeout
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_POOL_TIMEOUT = float(os.getenv("LLM_POOL_TIMEOUT", "120"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "120"))
+LLM_WRITE_TIMEOUT = float(os.getenv("LLM_WRITE_TIMEOUT", "30"))
+
+# httpcore trace steps of opening a connection, with the counter each one bumps
+CONNECT_STEPS = {
+    "connection.connect_tcp": "connections_opened",
+    "connection.start_tls": "tls_handshakes",
+}
+
+# Stats that only grow, so the share of one run is the difference of snapshots
+CUMULATIVE_STATS = (
+    "requests",
+    "failed_requests",
+    "connections_opened",
+    "tls_handshakes",
+    "connect_seconds",
+)
+
+# Counters of the requests made by one job, see get_connection_stats
+connection_stats_var: ContextVar[Optional[Dict]] = ContextVar(
+    "connection_stats", default=None
+)
+
+
+def _new_stats() -> Dict:
+    return {
+        "requests": 0,
+        "failed_requests": 0,
+        "active_requests": 0,
+        "peak_active_requests": 0,
+        "connections_opened": 0,
+        "tls_handshakes": 0,
+        "connect_seconds": 0.0,
+        "event_loops": 0,
+    }
+
+
+class LoopLocalTransport(httpx.AsyncBaseTransport):
+    """
+    Pooled HTTP transport keeping one connection pool per event loop
+
+    Pooled connections belong to the loop that opened them, and the workers and
+    Streamlit start a fresh loop with asyncio.run for every run, so one pool
+    would hand out connections of a loop that is already closed. Each loop gets
+    its own AsyncHTTPTransport with the configured limits, dropped together
+    with the loop. Connection statistics are collected from httpcore's trace
+    events across all loops, and for the job making the request.
+    """
+
+    def __init__(self, limits: httpx.Limits, http2: bool = False):
+        self.limits = limits
+        self.http2 = http2
+        self._transports = weakref.WeakKeyDictionary()
+        self.stats = _new_stats()
+
+    def _counters(self) -> List[Dict]:
+        """Process-wide counters, and those of the current job if any."""
+        job_stats = connection_stats_var.get()
+        return [self.stats] if job_stats is None else [self.stats, job_stats]
+
+    def _loop_transport(self) -> httpx.AsyncHTTPTransport:
+        loop = asyncio.get_running_loop()
+        transport = self._transports.get(loop)
+        if transport is None:
+            transport = httpx.AsyncHTTPTransport(limits=self.limits, http2=self.http2)
+            self._transports[loop] = transport
+            for stats in self._counters():
+                stats["event_loops"] += 1
+        return transport
+
+    def _tracer(self, parent_trace):
+        """Trace callback counting new connections and their handshake time."""
+        started = {}
+        counters = self._counters()
+
+        async def trace(event_name, info):
+            step, _, phase = event_name.rpartition(".")
+            if step in CONNECT_STEPS:
+                if phase == "started":
+                    started[step] = time.perf_counter()
+                else:
+                    elapsed = time.perf_counter() - started.pop(step)
+                    for stats in counters:
+                        stats["connect_seconds"] += elapsed
+                        if phase == "complete":
+                            stats[CONNECT_STEPS[step]] += 1
+            if parent_trace is not None:
+                await parent_trace(event_name, info)
+
+        return trace
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        transport = self._loop_transport()
+        request.extensions = {
+            **request.extensions,
+            "trace": self._tracer(request.extensions.get("trace")),
+        }
+
+        counters = self._counters()
+        for stats in counters:
+            stats["requests"] += 1
+            stats["active_requests"] += 1
+            stats["peak_active_requests"] = max(
+                stats["peak_active_requests"], stats["active_requests"]
+            )
+        try:
+            return await transport.handle_async_request(request)
+        except Exception:
+            for stats in counters:
+                stats["failed_requests"] += 1
+            raise
+        finally:
+            for stats in counters:
+                stats["active_requests"] -= 1
+
+    async def aclose(self) -> None:
+        """Close the pool of the running loop; other loops keep theirs."""
+        transport = self._transports.pop(asyncio.get_running_loop(), None)
+        if transport is not None:
+            await transport.aclose()
+
+
+def get_timeout() -> httpx.Timeout:
+    """Timeouts of every LLM request, also passed to the OpenAI client itself."""
+    return httpx.Timeout(
+        connect=LLM_CONNECT_TIMEOUT,
+        read=LLM_READ_TIMEOUT,
+        write=LLM_WRITE_TIMEOUT,
+        pool=LLM_POOL_TIMEOUT,
+    )
+
+
+@lru_cache(maxsize=None)
+def get_transport() -> LoopLocalTransport:
+    if LLM_HTTP2:
+        try:
+            import h2  # noqa: F401
+        except ImportError as e:
+            raise ImportError(
+                "The h2 package is required for LLM_HTTP2, install httpx[http2]"
+            ) from e
+
+    limits = httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+    )
+    return LoopLocalTransport(limits, http2=LLM_HTTP2)
+
+
+@lru_cache(maxsize=None)
+def get_http_client() -> httpx.AsyncClient:
+    """HTTP client with the pooled transport shared by every LLM chain."""
+    return httpx.AsyncClient(transport=get_transport(), timeout=get_timeout())
+
+
+@contextmanager
+def get_connection_stats() -> Generator[Dict, None, None]:
+    """Count the LLM requests made in scope apart from those of other jobs."""
+    stats = _new_stats()
+    token = connection_stats_var.set(stats)
+    try:
+        yield stats
+    finally:
+        connection_stats_var.reset(token)
+
+
+def connection_stats(since: Optional[Dict] = None) -> Dict:
+    """
+    Counters of the shared LLM transport, only covering the current job's
+    requests inside get_connection_stats
+
+    Args:
+        since: Earlier snapshot; when given, the cumulative counters only cover
+            requests made after it
+
+    Returns:
+        dict: Request and connection counters. requests - connections_opened
+            is the number of requests that reused a pooled connection instead
+            of paying a new TCP and TLS handshake.
+    """
+    stats = dict(connection_stats_var.get() or get_transport().stats)
+    if since is not None:
+        for name in CUMULATIVE_STATS:
+            stats[name] -= since[name]
+    return stats
+
+
+async def close_loop_connections() -> None:
+    """Close the pooled LLM connections of the running event loop."""
+    await get_transport().aclose()
+
+
+@lru_cache(maxsize=None)
+def get_llm(tier: str = "advanced"):
+    """
+    Azure OpenAI chat client of a model tier, shared by every chain and created
+    on first use
+
+    langchain_openai is imported here rather than at module level, so importing
+    the LLM modules stays cheap until a chain is actually needed.
+    """
+    from langchain_openai import AzureChatOpenAI
+
+    return AzureChatOpenAI(
+        azure_deployment=LLM_DEPLOYMENTS[tier],
+        api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
+        temperature=0,
+        # retry_call owns the retries, so the SDK does not multiply them
+        max_retries=0,
+        timeout=get_timeout(),
+        http_async_client=get_http_client(),
+    )
+
+
+@lru_cache(maxsize=None)
+def get_structured_llm(schema, tier: str = "advanced"):
+    """The shared client of a tier bound to a Pydantic output schema."""
+    return get_llm(tier).with_structured_output(schema)
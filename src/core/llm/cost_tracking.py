@@ -0,0 +1,60 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Generator, Optional
+
+from langchain_community.callbacks.openai_info import OpenAICallbackHandler
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, LLMResult
+from langchain_core.tracers.context import register_configure_hook
+
+
+class CachedTokenCallbackHandler(OpenAICallbackHandler):
+    """OpenAI cost callback that also counts prompt tokens served from the cache."""
+
+    prompt_tokens_cached: int = 0
+
+    def __repr__(self) -> str:
+        return (
+            super().__repr__()
+            + f"\n\tCached Prompt Tokens: {self.prompt_tokens_cached}"
+        )
+
+    def on_llm_end(self, response: LLMResult, **kwargs) -> None:
+        super().on_llm_end(response, **kwargs)
+
+        cached_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                if not isinstance(generation, ChatGeneration):
+                    continue
+                message = generation.message
+                if isinstance(message, AIMessage) and message.usage_metadata:
+                    details = message.usage_metadata.get("input_token_details") or {}
+                    cached_tokens += details.get("cache_read") or 0
+
+        with self._lock:
+            self.prompt_tokens_cached += cached_tokens
+
+    @property
+    def cached_prompt_ratio(self) -> float:
+        """Share of prompt tokens that were read from the prompt cache."""
+        if not self.prompt_tokens:
+            return 0.0
+        return self.prompt_tokens_cached / self.prompt_tokens
+
+
+cost_callback_var: ContextVar[Optional[CachedTokenCallbackHandler]] = ContextVar(
+    "cost_callback", default=None
+)
+register_configure_hook(cost_callback_var, True)
+
+
+@contextmanager
+def get_cost_callback() -> Generator[CachedTokenCallbackHandler, None, None]:
+    """Track cost, token usage and cached prompt tokens of every LLM call in scope."""
+    cb = CachedTokenCallbackHandler()
+    token = cost_callback_var.set(cb)
+    try:
+        yield cb
+    finally:
+        cost_callback_var.reset(token)
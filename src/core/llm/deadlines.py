@@ -0,0 +1,182 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Awaitable, Callable, Generator, List, Optional
+
+# Seconds one LLM call may take before it is abandoned and retried
+LLM_CALL_DEADLINE = float(os.getenv("LLM_CALL_DEADLINE", "45"))
+
+# Seconds the LLM stages of one job may take in total, 0 for no limit; calls
+# that would start or wait past it fail instead
+LLM_JOB_TIME_BUDGET = float(os.getenv("LLM_JOB_TIME_BUDGET", "0"))
+
+# Longest wait between two attempts of a failed call
+LLM_MAX_BACKOFF = float(os.getenv("LLM_MAX_BACKOFF", "8"))
+
+# Send a duplicate request when a call takes longer than this percentile of the
+# latencies observed for its route and tier, and keep whichever answers first
+LLM_HEDGE_REQUESTS = os.getenv("LLM_HEDGE_REQUESTS", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+
+# Latencies observed before hedging starts, and how many recent ones are kept
+MIN_LATENCY_SAMPLES = 20
+LATENCY_WINDOW = 500
+
+
+class TimeBudgetExceeded(Exception):
+    """The job's LLM time budget ran out before the call could finish."""
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of values, None when there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q * len(ordered)) - 1, 0)]
+
+
+class LatencyTracker:
+    """Latencies of the most recent successful calls of one route and tier."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.latencies = deque(maxlen=window)
+
+    def add(self, seconds: float) -> None:
+        self.latencies.append(seconds)
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds after which a call is hedged, None until enough calls were seen."""
+        if not LLM_HEDGE_REQUESTS or len(self.latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        return percentile(list(self.latencies), LLM_HEDGE_PERCENTILE)
+
+
+@lru_cache(maxsize=None)
+def latency_tracker(route: str, tier: str) -> LatencyTracker:
+    """Tracker of a route and tier, kept for the process so later jobs start warm."""
+    return LatencyTracker()
+
+
+job_deadline_var: ContextVar[Optional[float]] = ContextVar("job_deadline", default=None)
+
+
+@contextmanager
+def time_budget(seconds: float = LLM_JOB_TIME_BUDGET) -> Generator[None, None, None]:
+    """Limit every LLM call in scope to a shared budget of seconds, 0 for none."""
+    deadline = time.monotonic() + seconds if seconds > 0 else None
+    token = job_deadline_var.set(deadline)
+    try:
+        yield
+    finally:
+        job_deadline_var.reset(token)
+
+
+def remaining_time() -> Optional[float]:
+    """Seconds left of the job's time budget, None without a budget."""
+    deadline = job_deadline_var.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def call_timeout() -> float:
+    """
+    Seconds the next call may take: the per-call deadline, shortened to what is
+    left of the job's time budget
+
+    Raises:
+        TimeBudgetExceeded: When the budget is already used up
+    """
+    remaining = remaining_time()
+    if remaining is None:
+        return LLM_CALL_DEADLINE
+    if remaining <= 0:
+        raise TimeBudgetExceeded("LLM time budget of the job is used up")
+    return min(LLM_CALL_DEADLINE, remaining)
+
+
+def backoff_delay(retry_count: int, jitter: float = 0.0) -> float:
+    """
+    Exponential backoff before attempt retry_count + 1, capped at LLM_MAX_BACKOFF
+
+    Raises:
+        TimeBudgetExceeded: When the wait would outlast the job's time budget
+    """
+    wait_time = min(2**retry_count, LLM_MAX_BACKOFF) + jitter
+    remaining = remaining_time()
+    if remaining is not None and wait_time >= remaining:
+        raise TimeBudgetExceeded("LLM time budget of the job is used up")
+    return wait_time
+
+
+async def hedged_call(
+    call: Callable[[], Awaitable],
+    hedge_after: Optional[float],
+    on_hedge: Optional[Callable[[bool], None]] = None,
+):
+    """
+    Await call(), sending a second call() when the first has not answered after
+    hedge_after seconds
+
+    The first successful answer is returned and the other request cancelled; a
+    request that fails leaves the other one running.
+
+    Args:
+        call: Starts one request
+        hedge_after: Seconds before hedging, None to never hedge
+        on_hedge: Called with whether the hedge answered first, once a hedged
+            call has an answer
+    """
+    first = asyncio.ensure_future(call())
+    if hedge_after is None:
+        return await first
+
+    pending = {first}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=hedge_after)
+        if done:
+            return first.result()
+
+        hedge = asyncio.ensure_future(call())
+        pending.add(hedge)
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            answered = [task for task in done if task.exception() is None]
+            if answered:
+                if on_hedge is not None:
+                    on_hedge(answered[0] is hedge)
+                return answered[0].result()
+        # Both requests failed, raise the error of the hedge
+        return hedge.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def deadline_call(
+    call: Callable[[], Awaitable],
+    hedge_after: Optional[float] = None,
+    on_hedge: Optional[Callable[[bool], None]] = None,
+):
+    """
+    Await a possibly hedged call within the per-call deadline and the job's
+    time budget
+
+    Raises:
+        asyncio.TimeoutError: When no answer arrived before the deadline
+        TimeBudgetExceeded: When the job's time budget is used up
+    """
+    return await asyncio.wait_for(
+        hedged_call(call, hedge_after, on_hedge), call_timeout()
+    )
@@ -1,7 +1,11 @@
 from langchain_core.prompts import ChatPromptTemplate
 
+from src.core.llm.redaction_prompts import REPAIR_MESSAGES
 
-alias_prompt = ChatPromptTemplate.from_template("""
+
+# The long instructions are kept in a static system message so the prompt prefix
+# stays byte-identical across files and can be served from the prompt cache.
+ALIAS_SYSTEM_PROMPT = """
 # Entity Resolution for Personal Names
 
 Identify ALL variations that refer to the same person as the subject name, including those with titles/honorifics when combined with the name.
@@ -20,7 +24,6 @@ Identify ALL variations that refer to the same person as the subject name, inclu
    - Title/honorific + name combinations (e.g., "Chief Harrison", "Dr. Smith")
    - Name variations in contextually linked mentions
 
-
 ## Context Analysis
 1. IMPORTANT: Scan entire context thoroughly for:
    - Role/position confirmations
@@ -38,7 +41,7 @@ Return Python list of ALL valid name variations:
 
 ```
 "VERY IMPORTANTLY":
-                                             
+
 DO NOT make assumptions:
    - Similar names without clear linking context are not matches
    - Matching titles/roles alone are insufficient
@@ -47,14 +50,18 @@ Never include:
    - Standalone titles without names
    - Organizations
    - Generic references
-   - Pronouns/descriptions   
+   - Pronouns/descriptions
 
-THE ABOVE 2 POINTS ARE VERY IMPORATNT AND MAKE SURE OF THAT                                          
-                                             
+THE ABOVE 2 POINTS ARE VERY IMPORATNT AND MAKE SURE OF THAT
+"""
 
-Subject: {subject}
-Entity List: {final_result}
-""")
+alias_prompt = ChatPromptTemplate(
+    [
+        ("system", ALIAS_SYSTEM_PROMPT),
+        ("user", "Subject: {subject}\nEntity List: {final_result}"),
+        REPAIR_MESSAGES,
+    ]
+)
 
 
 s = """
@@ -1,100 +1,179 @@
 import asyncio
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 import random
 import time
-import os
-from langchain_openai import AzureChatOpenAI
-from dotenv import load_dotenv
-from src.core.llm.redaction_prompts import pronoun_prompt
+from functools import lru_cache
+from src.core.dedup import SharedCalls
+from src.core.llm.client import get_structured_llm
 from src.core.llm.pydantic_classes import RedactionResult
+from src.core.llm.routing import RoutedChain
+from src.core.records import ContextStore, ContextWindow, Redaction, intern_label
+from src.core.resilience import retry_call, with_repair
+from src.utils.context_budget import count_tokens
 
-load_dotenv()
-version = os.getenv("AZURE_OPENAI_API_VERSION")
-azure_deployment = os.getenv("AZURE_OPENAI_CHAT_MODEL_ADVANCE")
 
+@lru_cache(maxsize=None)
+def get_tier_pronoun_chain(tier):
+    """Pronoun redaction chain of a model tier."""
+    from src.core.llm.redaction_prompts import pronoun_prompt
 
-llm = AzureChatOpenAI(
-    azure_deployment=azure_deployment,
-    api_version=version,
-    temperature=0,
-    max_retries=2,
-)
+    return pronoun_prompt | get_structured_llm(RedactionResult, tier)
 
-structured_llm = llm.with_structured_output(RedactionResult)
 
-pronoun_chain = pronoun_prompt | structured_llm
+def window_context_tokens(input_data) -> int:
+    return count_tokens(input_data["input"]["context"])
 
 
-async def process_single_pronoun(
-    pronoun_chain, input_data: Dict[str, Any], max_retries: int = 7
-) -> Dict[str, Any]:
-    """Process a single pronoun with custom retry logic."""
-    retries = 0
-    while retries < max_retries:
-        try:
-            result = await pronoun_chain.ainvoke(input_data)
-
-            if result.redaction_reason:
-                return {
-                    "pronoun": input_data["input"]["entity_text"],
-                    "pos_category": input_data["input"]["pos_category"],
-                    "Redacted_text": result.redacted_text,
-                    "redaction_reason": result.redaction_reason,
-                    "corpus": input_data["input"]["context"],
-                }
-            return None
-
-        except Exception as e:
-            retries += 1
-            if retries == max_retries:
-                print(
-                    f"Failed after {max_retries} attempts for pronoun {input_data['input'].get('entity_text', 'unknown')}: {str(e)}"
-                )
-                return None
-
-            # Exponential backoff with some randomness
-            wait_time = (2**retries) + random.uniform(0, 1)
-            print(
-                f"Retry {retries} for pronoun {input_data['input'].get('entity_text', 'unknown')}. Waiting {wait_time:.2f} seconds..."
-            )
-            await asyncio.sleep(wait_time)
-
-
-async def process_pronoun_batch(
-    pronouns_batch: List[Dict], pronoun_chain, subjects: Dict
-) -> List[Dict]:
-    """Process a batch of pronouns concurrently."""
-
-    async def safe_process(pronoun_data: Dict) -> Dict:
-        input_data = {"input": pronoun_data, "subjects": subjects}
-        return await process_single_pronoun(pronoun_chain, input_data)
-
-    # Create tasks for all pronouns in the batch
-    tasks = [safe_process(pronoun) for pronoun in pronouns_batch]
+def pronoun_answered(input_data, result) -> bool:
+    """
+    A fast answer is kept when it names the text to redact and why; "nothing to
+    redact" may be a missed non-subject pronoun and is escalated, as for entities
+    """
+    return bool(result.redacted_text) and bool(result.redaction_reason)
 
-    # Execute all tasks concurrently
-    results = await asyncio.gather(*tasks)
 
-    # Filter out None results and return valid ones
-    return [result for result in results if result is not None]
+@lru_cache(maxsize=None)
+def get_pronoun_chain():
+    """Routed pronoun redaction chain, built on first use."""
+    return RoutedChain(
+        "pronouns", get_tier_pronoun_chain, pronoun_answered, window_context_tokens
+    )
 
 
-async def process_all_pronouns(
-    pronouns: Dict[str, List[Dict]], pronoun_chain, subjects: Dict
-) -> List[Dict]:
-    """Process all pronouns across all categories concurrently."""
-    # Flatten the pronouns dictionary into a single list
-    all_pronouns = []
-    for value in pronouns.values():
-        all_pronouns.extend(value)
-
-    # Process all pronouns concurrently
-    results = await process_pronoun_batch(all_pronouns, pronoun_chain, subjects)
-    return results
-
-
-# Example usage
-async def redact_pronouns(pronouns, subjects):
-    # Your existing pronouns dictionary and subjects
-    pronouns_result = await process_all_pronouns(pronouns, pronoun_chain, subjects)
-    return pronouns_result
+def build_window_input(
+    window: ContextWindow, context_store: ContextStore
+) -> Dict[str, Any]:
+    """Build the LLM payload for a pronoun window, listing each pronoun form once."""
+    unique_pronouns = {}
+    for pronoun in window.pronouns:
+        key = (pronoun.text, pronoun.pos_category)
+        unique_pronouns.setdefault(
+            key,
+            {"entity_text": pronoun.text, "pos_category": pronoun.pos_category},
+        )
+    return {
+        "context": context_store.get(window.context_id),
+        "pronouns": list(unique_pronouns.values()),
+    }
+
+
+async def process_pronoun_window(
+    pronoun_chain,
+    window: ContextWindow,
+    subjects,
+    context_store: ContextStore,
+    max_retries: int = 7,
+) -> Optional[Redaction]:
+    """
+    Process every pronoun in a context window with one call, retried per error
+    class; None when nothing is redacted, and the error raised when the call failed
+    """
+    window_input = build_window_input(window, context_store)
+    input_data = {"input": window_input, "subjects": subjects}
+    pronoun_texts = ", ".join(
+        dict.fromkeys(item["entity_text"] for item in window_input["pronouns"])
+    )
+
+    # Exponential backoff with some randomness, see retry_call
+    result = await retry_call(
+        lambda repair: pronoun_chain.ainvoke(with_repair(input_data, repair)),
+        f"pronouns {pronoun_texts}",
+        "llm",
+        max_retries,
+        jitter=lambda: random.uniform(0, 1),
+    )
+
+    if not result.redaction_reason:
+        return None
+    return Redaction(
+        file_name=window.file_name,
+        kind="pronoun",
+        target=pronoun_texts,
+        category=intern_label(
+            ", ".join(
+                dict.fromkeys(item["pos_category"] for item in window_input["pronouns"])
+            )
+        ),
+        redacted_text=tuple(result.redacted_text),
+        reason=result.redaction_reason,
+        context_id=window.context_id,
+    )
+
+
+def window_key(window: ContextWindow):
+    """Windows with the same key send the same payload, whichever file they are in."""
+    return (
+        window.context_id,
+        tuple(
+            dict.fromkeys(
+                (pronoun.text, pronoun.pos_category) for pronoun in window.pronouns
+            )
+        ),
+    )
+
+
+async def redact_shared_window(
+    shared_calls: SharedCalls,
+    window: ContextWindow,
+    subjects,
+    context_store: ContextStore,
+) -> Optional[Redaction]:
+    """
+    Redact a window through shared_calls, so a window repeated in another file
+    with the same context and pronoun forms is sent once and its result copied
+    """
+    result = await shared_calls.run(
+        window_key(window),
+        lambda: process_pronoun_window(
+            get_pronoun_chain(), window, subjects, context_store
+        ),
+    )
+    if result is None:
+        return None
+    return result._replace(file_name=window.file_name)
+
+
+def build_pronoun_tasks(
+    pronouns: Dict[str, List[ContextWindow]], subjects, context_store: ContextStore
+) -> List:
+    """
+    Create one task per pronoun window, as (file_name, coroutine) pairs
+
+    Windows repeated across files with the same context share one call.
+    """
+    shared_calls = SharedCalls()
+    return [
+        (
+            file_name,
+            redact_shared_window(shared_calls, window, subjects, context_store),
+        )
+        for file_name, windows in pronouns.items()
+        for window in windows
+    ]
+
+
+async def stream_pronoun_redactions(pronoun_tasks):
+    """
+    Run pronoun window tasks concurrently and yield each result as it completes
+
+    Yields:
+        tuple: (file_name, Redaction or None when nothing was redacted, whether
+            the call failed)
+    """
+
+    async def run(file_name, task):
+        try:
+            return file_name, await task, False
+        except Exception:
+            return file_name, None, True
+
+    tasks = [
+        asyncio.ensure_future(run(file_name, task)) for file_name, task in pronoun_tasks
+    ]
+    try:
+        for future in asyncio.as_completed(tasks):
+            yield await future
+    finally:
+        # Closing the stream, as a cancelled job does, stops the calls left
+        for task in tasks:
+            task.cancel()
@@ -65,3 +65,21 @@ class RedactionResult(BaseModel):
         "specifically identifying the type of non-subject PII found (e.g., 'Contains "
         "names and details of non-subject individuals')",
     )
+
+
+class EntityRedaction(RedactionResult):
+    """Redaction result for one of several target entities sharing a context."""
+
+    entity_text: str = Field(
+        description="The target entity this redaction belongs to, copied exactly as "
+        "given in the input's entity_texts list"
+    )
+
+
+class GroupRedactionResult(BaseModel):
+    """Redaction results for every target entity of a shared context, one per entity."""
+
+    redactions: List[EntityRedaction] = Field(
+        default=[],
+        description="One redaction result per target entity in entity_texts",
+    )
@@ -1,130 +1,345 @@
-from langchain_openai import AzureChatOpenAI
-from src.core.llm.pydantic_classes import RedactionResult
-import os
-from src.core.llm.redaction_prompts import (
-    persom_prompt,
-    phone_number_prompt,
-    email_prompt,
-    organisation_prompt,
-    address_prompt,
-)
-from dotenv import load_dotenv
+from functools import lru_cache
+from src.core.dedup import SharedCalls
+from src.core.llm.client import get_structured_llm
+from src.core.llm.pydantic_classes import GroupRedactionResult, RedactionResult
+from src.core.llm.routing import RoutedChain
+from src.core.records import Redaction
+from src.core.resilience import retry_call, with_repair
+from src.utils.context_budget import count_tokens
+from src.utils.context_collapsing import collapse_mentions
 import asyncio
-from asyncio import sleep
 
-load_dotenv()
-version = os.getenv("AZURE_OPENAI_API_VERSION")
-azure_deployment = os.getenv("AZURE_OPENAI_CHAT_MODEL_ADVANCE")
 
+class IncompleteRedactions(Exception):
+    """Some targets of a request failed; redactions holds those that succeeded."""
 
-llm = AzureChatOpenAI(
-    azure_deployment=azure_deployment,
-    api_version=version,
-    temperature=0,
-    max_retries=2,
-)
+    def __init__(self, redactions):
+        super().__init__(f"{len(redactions)} targets redacted before a failure")
+        self.redactions = redactions
 
-structured_llm = llm.with_structured_output(RedactionResult)
 
-person_chain = persom_prompt | structured_llm
-organization_chain = organisation_prompt | structured_llm
-phone_number_chain = phone_number_prompt | structured_llm
-email_chain = email_prompt | structured_llm
-address_chain = address_prompt | structured_llm
+# Entity types that get redacted, each with its own chain
+REDACTED_ENTITY_TYPES = ("Person", "Organization", "Email", "PhoneNumber", "Address")
+
+
+@lru_cache(maxsize=None)
+def redaction_prompts():
+    """Prompt used for each entity type that gets redacted."""
+    from src.core.llm.redaction_prompts import (
+        persom_prompt,
+        phone_number_prompt,
+        email_prompt,
+        address_prompt,
+    )
+
+    return {
+        "Person": persom_prompt,
+        "Organization": persom_prompt,
+        "Email": email_prompt,
+        "PhoneNumber": phone_number_prompt,
+        "Address": address_prompt,
+    }
+
+
+@lru_cache(maxsize=None)
+def group_redaction_prompts():
+    """Prompt used when several entities of a type share one collapsed context."""
+    from src.core.llm.redaction_prompts import (
+        persom_group_prompt,
+        email_group_prompt,
+        phone_number_group_prompt,
+        address_group_prompt,
+    )
+
+    return {
+        "Person": persom_group_prompt,
+        "Organization": persom_group_prompt,
+        "Email": email_group_prompt,
+        "PhoneNumber": phone_number_group_prompt,
+        "Address": address_group_prompt,
+    }
+
+
+@lru_cache(maxsize=None)
+def tier_redaction_chains(tier):
+    """Chain of a model tier for each entity type that gets redacted."""
+    structured_llm = get_structured_llm(RedactionResult, tier)
+    return {
+        entity_type: prompt | structured_llm
+        for entity_type, prompt in redaction_prompts().items()
+    }
+
+
+@lru_cache(maxsize=None)
+def tier_group_redaction_chains(tier):
+    """Chain of a model tier for several entities sharing one collapsed context."""
+    structured_group_llm = get_structured_llm(GroupRedactionResult, tier)
+    return {
+        entity_type: prompt | structured_group_llm
+        for entity_type, prompt in group_redaction_prompts().items()
+    }
+
+
+def entity_context_tokens(input_data):
+    return count_tokens(input_data["input"]["context"])
+
+
+def redaction_answered(input_data, result):
+    """A fast answer is kept when it names the text to redact and why."""
+    return bool(result.redacted_text) and bool(result.redaction_reason)
+
+
+def group_redaction_answered(input_data, result):
+    """A fast grouped answer is kept when it redacts every target entity."""
+    answered = {
+        redaction.entity_text
+        for redaction in result.redactions
+        if redaction.redacted_text and redaction.redaction_reason
+    }
+    return answered.issuperset(input_data["input"]["entity_texts"])
+
+
+@lru_cache(maxsize=None)
+def redaction_chains():
+    """Routed chain used for each entity type that gets redacted, built on first use."""
+    return {
+        entity_type: RoutedChain(
+            entity_type,
+            lambda tier, entity_type=entity_type: tier_redaction_chains(tier)[
+                entity_type
+            ],
+            redaction_answered,
+            entity_context_tokens,
+        )
+        for entity_type in REDACTED_ENTITY_TYPES
+    }
+
+
+@lru_cache(maxsize=None)
+def group_redaction_chains():
+    """Routed chain used when several entities of a type share one collapsed context."""
+    return {
+        entity_type: RoutedChain(
+            entity_type,
+            lambda tier, entity_type=entity_type: tier_group_redaction_chains(tier)[
+                entity_type
+            ],
+            group_redaction_answered,
+            entity_context_tokens,
+        )
+        for entity_type in REDACTED_ENTITY_TYPES
+    }
 
 
 async def process_entity(chain, item, subjects, max_retries=6):
-    retry_count = 0
-    while retry_count < max_retries:
-        try:
-            input_data = {"subjects": subjects, "input": item}
-            result = await chain.ainvoke(input_data)
-            return {
-                "Entity": item["entity_text"],
-                "Redaction_text": result.redacted_text,
-                "redaction_reason": result.redaction_reason,
-                "corpus": item["context"],
-            }
-        except Exception as e:
-            retry_count += 1
-            if retry_count == max_retries:
-                print(
-                    f"Failed after {max_retries} attempts for entity {item['entity_text']}: {str(e)}"
-                )
-                raise e
-
-            # Exponential backoff: 2^retry_count seconds
-            wait_time = 2**retry_count
-            print(
-                f"Attempt {retry_count} failed for {item['entity_text']}, retrying in {wait_time} seconds..."
-            )
-            await sleep(wait_time)
+    """Redact one target entity, retried per error class, see retry_call."""
+    input_data = {"subjects": subjects, "input": item}
+    result = await retry_call(
+        lambda repair: chain.ainvoke(with_repair(input_data, repair)),
+        f"entity {item['entity_text']}",
+        "llm",
+        max_retries,
+    )
+    return {
+        "Entity": item["entity_text"],
+        "Redaction_text": result.redacted_text,
+        "redaction_reason": result.redaction_reason,
+        "corpus": item["context"],
+    }
+
+
+async def process_entity_group(chain, item, subjects, max_retries=6):
+    """
+    Redact several target entities sharing one context with a single call
+
+    Returns:
+        dict: Entity text mapped to its redaction result, for every target the
+            model answered for
+    """
+    input_data = {"subjects": subjects, "input": item}
+    result = await retry_call(
+        lambda repair: chain.ainvoke(with_repair(input_data, repair)),
+        f"entities {item['entity_texts']}",
+        "llm",
+        max_retries,
+    )
+    return {
+        redaction.entity_text: redaction
+        for redaction in result.redactions
+        if redaction.entity_text in item["entity_texts"]
+    }
+
+
+async def redact_single_mention(mention, alias, context_store):
+    entity = {
+        "entity_text": mention.entity_text,
+        "context": context_store.get(mention.context_id),
+    }
+    result = await process_entity(
+        redaction_chains()[mention.entity_type], entity, alias
+    )
+    return Redaction(
+        file_name=mention.file_name,
+        kind="entity",
+        target=mention.entity_text,
+        category=mention.entity_type,
+        redacted_text=tuple(result["Redaction_text"]),
+        reason=result["redaction_reason"],
+        context_id=mention.context_id,
+    )
 
 
-async def process_all_entities(
-    persons, organizations, emails, phone_numbers, addresses, subjects
-):
-    tasks = []
+async def redact_mention_group(group, alias, context_store):
+    """
+    Redact every mention of a collapsed group and fan the results back out
 
-    # Add person tasks
-    tasks.extend([process_entity(person_chain, person, subjects) for person in persons])
+    A group with one mention uses the single-entity prompt. Targets the grouped
+    call did not answer for are retried one by one with the single-entity prompt.
 
-    # Add organization tasks
-    tasks.extend([process_entity(person_chain, org, subjects) for org in organizations])
+    Returns:
+        list: One Redaction per mention
 
-    # Add email tasks
-    tasks.extend([process_entity(email_chain, email, subjects) for email in emails])
+    Raises:
+        IncompleteRedactions: When a target retried on its own failed, with the
+            redactions of the other targets
+    """
+    if len(group.mentions) == 1:
+        return [await redact_single_mention(group.mentions[0], alias, context_store)]
 
-    # Add phone number tasks
-    tasks.extend(
-        [process_entity(phone_number_chain, phone, subjects) for phone in phone_numbers]
+    item = {
+        "entity_texts": [mention.entity_text for mention in group.mentions],
+        "context": context_store.get(group.context_id),
+    }
+    answered = await process_entity_group(
+        group_redaction_chains()[group.entity_type], item, alias
     )
 
-    # Add address tasks
-    tasks.extend(
-        [process_entity(address_chain, address, subjects) for address in addresses]
+    redactions = []
+    missing = []
+    for mention in group.mentions:
+        result = answered.get(mention.entity_text)
+        if result is None:
+            missing.append(mention)
+            continue
+        redactions.append(
+            Redaction(
+                file_name=mention.file_name,
+                kind="entity",
+                target=mention.entity_text,
+                category=mention.entity_type,
+                redacted_text=tuple(result.redacted_text),
+                reason=result.redaction_reason,
+                context_id=group.context_id,
+            )
+        )
+
+    retried = await asyncio.gather(
+        *[redact_single_mention(mention, alias, context_store) for mention in missing],
+        return_exceptions=True,
+    )
+    redactions.extend(result for result in retried if not isinstance(result, Exception))
+    if len(redactions) < len(group.mentions):
+        raise IncompleteRedactions(redactions)
+    return redactions
+
+
+def group_key(group):
+    """Requests with the same key send the same payload, whichever file they are in."""
+    return (
+        group.entity_type,
+        group.context_id,
+        tuple(mention.entity_text for mention in group.mentions),
     )
 
-    # Run all tasks concurrently and gather results
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-
-    # Filter out any failed results
-    result = [r for r in results if not isinstance(r, Exception)]
-    return result
-
-
-async def generate_redactions(non_alias_parameters, alias):
-    for key, data in non_alias_parameters.items():
-        # Initialize all entity type lists in one line
-        entity_lists = {
-            entity_type: []
-            for entity_type in [
-                "Organization",
-                "PhoneNumber",
-                "PersonType",
-                "Address",
-                "Person",
-                "Email",
-                "DateTime",
+
+def entity_request_groups(non_alias_parameters, context_store):
+    """
+    Mentions that get redacted, collapsed into one MentionGroup per request
+
+    Returns:
+        tuple: (number of mentions, list of MentionGroup)
+    """
+    mentions = [
+        mention
+        for data in non_alias_parameters.values()
+        for mention in data
+        if mention.entity_type in REDACTED_ENTITY_TYPES
+    ]
+    return len(mentions), collapse_mentions(mentions, context_store)
+
+
+async def redact_shared_group(shared_calls, group, alias, context_store):
+    """
+    Redact a group through shared_calls, so a group repeated in another file
+    with the same targets and context is sent once and its results copied
+    """
+    try:
+        redactions = await shared_calls.run(
+            group_key(group), lambda: redact_mention_group(group, alias, context_store)
+        )
+    except IncompleteRedactions as e:
+        raise IncompleteRedactions(
+            [
+                redaction._replace(file_name=group.file_name)
+                for redaction in e.redactions
             ]
-        }
+        ) from e
+    return [redaction._replace(file_name=group.file_name) for redaction in redactions]
 
-        # Append full entity information to their respective lists
-        [
-            entity_lists[item["entity_type"]].append(
-                {"entity_text": item["entity_text"], "context": item["context"]}
-            )
-            for item in data
-        ]
-
-        # Unpack into separate variables
-        organizations = entity_lists["Organization"]
-        persons = entity_lists["Person"]
-        phone_numbers = entity_lists["PhoneNumber"]
-        emails = entity_lists["Email"]
-        addresses = entity_lists["Address"]
-
-        redaction = await process_all_entities(
-            persons, organizations, emails, phone_numbers, addresses, alias
+
+def build_entity_tasks(non_alias_parameters, alias, context_store):
+    """
+    Create one redaction task per request across all files
+
+    Mentions with near-duplicate contexts are collapsed into one request carrying
+    several target entities, see collapse_mentions, and identical requests of
+    different files (a duplicated email) share one call.
+
+    Returns:
+        list: (file_name, coroutine) pairs, each coroutine returning a list of
+            Redaction records
+    """
+    mention_count, groups = entity_request_groups(non_alias_parameters, context_store)
+    calls = len({group_key(group) for group in groups})
+    print(
+        f"Entity redaction requests: {mention_count} mentions -> {calls} calls "
+        f"({len(groups) - calls} repeated across files)"
+    )
+
+    shared_calls = SharedCalls()
+    return [
+        (
+            group.file_name,
+            redact_shared_group(shared_calls, group, alias, context_store),
         )
-        return redaction
+        for group in groups
+    ]
+
+
+async def stream_redactions(entity_tasks):
+    """
+    Run redaction tasks concurrently and yield each result as soon as it completes
+
+    Yields:
+        tuple: (file_name, list of Redaction records, whether a call of the task
+            failed, leaving some of its targets without a redaction)
+    """
+
+    async def run(file_name, task):
+        try:
+            return file_name, await task, False
+        except IncompleteRedactions as e:
+            return file_name, e.redactions, True
+        except Exception:
+            return file_name, [], True
+
+    tasks = [
+        asyncio.ensure_future(run(file_name, task)) for file_name, task in entity_tasks
+    ]
+    try:
+        for future in asyncio.as_completed(tasks):
+            yield await future
+    finally:
+        # Closing the stream, as a cancelled job does, stops the calls left
+        for task in tasks:
+            task.cancel()
@@ -1,16 +1,109 @@
-from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+# Asks the model to fix an answer that did not parse, empty on a first attempt
+# so the cached prompt prefix is unchanged, see src.core.resilience.with_repair
+REPAIR_MESSAGES = MessagesPlaceholder("repair", optional=True)
+
+# Every prompt below is split into a static system message followed by a short user
+# message holding the variable content. Keeping the long instructions free of
+# template variables makes the prompt prefix byte-identical across calls, so the
+# model-side prompt cache can reuse it for every item in a job.
+
+SUBJECT_INTRO = """You will be given the "SUBJECT" and the alias names of the "SUBJECT" in the user message."""
+
+# Guidelines and worked examples shared by every redaction prompt. They open each
+# system message, so the prompts share one static prefix that is long enough
+# (at least 1024 tokens) to be served from the prompt cache.
+REDACTION_GUIDELINES = """
+
+# General redaction guidelines
+
+These guidelines apply to every entity type. The instructions after them say which kind of entity you are checking and add the rules specific to it.
+
+## Who is the SUBJECT
+- The SUBJECT is the person named first in the user message. Every other name in that list is an alias of the same person, such as a nickname, the surname on its own or the name with a title like "Mr." or "Dr.".
+- Treat a mention as the SUBJECT when it matches the SUBJECT name or one of the aliases, ignoring letter case, titles and possessive endings such as "Harrison's".
+- A person who only shares the SUBJECT's surname is not the SUBJECT unless the context clearly links them.
+- Pronouns and descriptions ("the employee", "the claimant") refer to the SUBJECT only when the context makes that clear.
+
+## What to redact
+- Information that identifies or describes a person other than the SUBJECT: their name, contact details, address, role when it is tied to that person, opinions about them and events that only concern them.
+- Copy every segment exactly as it appears in the context, with the same spelling, punctuation, letter case and spacing, so that it can be found in the document. Never paraphrase, correct, shorten with ellipses or translate the text.
+- Return the shortest segment that still holds the non-subject information. Prefer a name or a clause over a whole sentence, and a sentence over a paragraph.
+- Return each distinct segment once, in the order it appears in the context.
+
+## What to keep
+- Everything about the SUBJECT, including what other people say about the SUBJECT.
+- Job titles without a name, dates, document headers, signatures of the SUBJECT and boilerplate such as email disclaimers.
+- When you cannot tell whether information belongs to the SUBJECT or to someone else, keep it and explain the doubt in the reason.
+
+## Writing the reason
+- Say in one sentence whose information the segments are and why they are not about the SUBJECT, e.g. "Names the sender's colleague, who is not the SUBJECT".
+- When nothing is redacted, say why, e.g. "The phone number is the SUBJECT's own".
+
+## Worked examples
+The examples use the SUBJECT "Mark Harrison" with the aliases "Mr. Harrison" and "Mark".
+
+Example 1 - Person
+entity_text: "Sarah Collins"
+context: "Sarah Collins met Mr. Harrison on 3 May to discuss her grievance against the depot manager."
+Redacted_Text: ["Sarah Collins", "her grievance against the depot manager"]
+Redaction_Reason: Sarah Collins and her grievance concern a person other than the SUBJECT, while the meeting with Mr. Harrison is kept.
+
+Example 2 - Email
+entity_text: "s.collins@example.com"
+context: "Please reply to s.collins@example.com and copy Mark on the thread."
+Redacted_Text: ["s.collins@example.com"]
+Redaction_Reason: The email address belongs to Sarah Collins, not to the SUBJECT.
+
+Example 3 - Phone number
+entity_text: "07700 900123"
+context: "Mark Harrison can be reached on 07700 900123 during the investigation."
+Redacted_Text: []
+Redaction_Reason: The phone number is given as the SUBJECT's own contact number.
+
+Example 4 - Address
+entity_text: "14 Mill Lane, Leeds"
+context: "The letter was sent to Mr. Harrison's neighbour, James Reid, at 14 Mill Lane, Leeds."
+Redacted_Text: ["James Reid, at 14 Mill Lane, Leeds"]
+Redaction_Reason: The name and address belong to the SUBJECT's neighbour James Reid.
+
+Example 5 - Organization
+entity_text: "Northgate Logistics"
+context: "Before joining us, Paul Evans was dismissed by Northgate Logistics for misconduct."
+Redacted_Text: ["Paul Evans was dismissed by Northgate Logistics for misconduct"]
+Redaction_Reason: The dismissal is about Paul Evans, not the SUBJECT.
+
+Example 6 - Person who is a family member
+entity_text: "Helen Harrison"
+context: "Mark Harrison's wife, Helen Harrison, called to say he would be absent."
+Redacted_Text: []
+Redaction_Reason: Information pertains to the SUBJECT's wife.
+
+Example 7 - Pronouns
+context: "Mark said that she had shouted at him in the car park."
+pronouns: "she" and "him"
+Redacted_Text: ["she had shouted"]
+Redaction_Reason: "she" is another person who shouted at the SUBJECT, while "him" is the SUBJECT and is kept.
+
+## Several target entities sharing one context
+Some requests list several target entities in "entity_texts" with one shared "context". Analyse every target on its own, exactly as if it were the only "entity_text", and return one result per target with its entity_text copied exactly as given. A segment may be returned for several targets when it mentions all of them.
+
+# Instructions for this entity type"""
+
+
+ORGANIZATION_SYSTEM_PROMPT = (
+    SUBJECT_INTRO
+    + REDACTION_GUIDELINES
+    + """
 
-organisation_prompt = ChatPromptTemplate.from_template("""
-Here is your "SUBJECT" and alias names of the "SUBJECT" {subjects}.
-                                                     
 I will be providing a dictionary which mentions an orgnisation:
 The Orgnisation name and the context of the data will be mentioned in a way such that
-"entity_text": This will contain the organization name 
+"entity_text": This will contain the organization name
 "context": This will contain the corpus or the data which is present in the data
 
-
-You need to check and verify if the data in the "context" is not related to the SUBJECT or the alias of the subjects. 
-If the data is not related to the subject and related to some other Person then redact the exact text from context and tell me the part which should be redacted. 
+You need to check and verify if the data in the "context" is not related to the SUBJECT or the alias of the subjects.
+If the data is not related to the subject and related to some other Person then redact the exact text from context and tell me the part which should be redacted.
 
 IMPORTANT: When extracting text for redaction:
    - Split sentences if needed to exclude SUBJECT mentions
@@ -29,23 +122,33 @@ Go through all this and return me the following:
 Redacted_Text: [list of minimal text segments containing ONLY non-subject information]
 Redaction_Reason: Concise explanation of why these specific segments need redaction
 
+If there is no data which should be redacted then just return an empty list in Redacted_Text
+"""
+)
 
-If there is no data which should be redacted then just return an empty list in Redacted_Text   
+organisation_prompt = ChatPromptTemplate(
+    [
+        ("system", ORGANIZATION_SYSTEM_PROMPT),
+        (
+            "user",
+            'Here is your "SUBJECT" and alias names of the "SUBJECT" {subjects}.\n\n'
+            "Here is your ORGANIZATION json input:\n{input}",
+        ),
+        REPAIR_MESSAGES,
+    ]
+)
 
-Here is your ORGANIZATION json input:  
-{input}                                                                                                                        
-""")
 
+PERSON_SYSTEM_PROMPT = (
+    SUBJECT_INTRO
+    + REDACTION_GUIDELINES
+    + """
 
-persom_prompt = ChatPromptTemplate.from_template(""" 
-Here is your "SUBJECT" and alias names of the "SUBJECT" {subjects}.
-                                                     
 I will be providing a dictionary which mentions a person:
 The Person name and the context of the data will be mentioned in a way such that
-"entity_text": This will contain the Person name 
+"entity_text": This will contain the Person name
 "context": This will contain the corpus or the data which is present in the data
 
-
 You need to:
 1. Check and verify if the data in the "context" is not related to the SUBJECT or the alias of the subjects
 2. Scan the entire context for ANY names of people (even if they're not in entity_text) who are not the SUBJECT or their aliases
@@ -68,28 +171,38 @@ Go through all this and return me the following:
 Redacted_Text: [list of minimal text segments containing ONLY non-subject information]
 Redaction_Reason: Concise explanation of why these specific segments need redaction
 
-
 "IMPORTANT: Family Member Handling:
    - If the information relates to SUBJECT's family members (parents, siblings, spouse, children, etc.), DO NOT redact it
    - In such cases, return an empty list for Redacted_Text
    - In Redaction_Reason, specify which family member was detected (e.g., 'Information pertains to SUBJECT's mother')
    - Example: If text is 'His mother lives in New York', and it refers to SUBJECT's mother, return empty list"
-If there is no data which should be redacted then just return an empty list in Redacted_Text   
+If there is no data which should be redacted then just return an empty list in Redacted_Text
+"""
+)
+
+persom_prompt = ChatPromptTemplate(
+    [
+        ("system", PERSON_SYSTEM_PROMPT),
+        (
+            "user",
+            'Here is your "SUBJECT" and alias names of the "SUBJECT" {subjects}.\n\n'
+            "Here is your PERSON json input:\n{input}",
+        ),
+        REPAIR_MESSAGES,
+    ]
+)
+
+
+EMAIL_SYSTEM_PROMPT = (
+    SUBJECT_INTRO
+    + REDACTION_GUIDELINES
+    + """
 
-Here is your PERSON json input:  
-{input}
-""")
-
-
-email_prompt = ChatPromptTemplate.from_template(""" 
-Here is your "SUBJECT" and alias names of the "SUBJECT" {subjects}.
-                                                     
 I will be providing a dictionary which mentions an email:
 The Email and the context of the data will be mentioned in a way such that
-"entity_text": This will contain the Email address 
+"entity_text": This will contain the Email address
 "context": This will contain the corpus or the data which is present in the data
 
-
 You need to:
 1. Check and verify if the data in the "context" is not related to the SUBJECT or the alias of the subjects
 2. Scan the entire context for ANY email addresses not associated with the SUBJECT or their aliases
@@ -112,23 +225,33 @@ Go through all this and return me the following:
 Redacted_Text: [list of minimal text segments containing ONLY non-subject information]
 Redaction_Reason: Concise explanation of why these specific segments need redaction
 
+If there is no data which should be redacted then just return an empty list in Redacted_Text
+"""
+)
 
-If there is no data which should be redacted then just return an empty list in Redacted_Text   
+email_prompt = ChatPromptTemplate(
+    [
+        ("system", EMAIL_SYSTEM_PROMPT),
+        (
+            "user",
+            'Here is your "SUBJECT" and alias names of the "SUBJECT" {subjects}.\n\n'
+            "Here is your EMAIL json input:\n{input}",
+        ),
+        REPAIR_MESSAGES,
+    ]
+)
 
-Here is your EMAIL json input:  
-{input}
-""")
 
+PHONE_NUMBER_SYSTEM_PROMPT = (
+    SUBJECT_INTRO
+    + REDACTION_GUIDELINES
+    + """
 
-phone_number_prompt = ChatPromptTemplate.from_template("""  
-Here is your "SUBJECT" and alias names of the "SUBJECT" {subjects}.
-                                                     
 I will be providing a dictionary which mentions a phone number:
 The Phone number and the context of the data will be mentioned in a way such that
-"entity_text": This will contain the Phone number 
+"entity_text": This will contain the Phone number
 "context": This will contain the corpus or the data which is present in the data
 
-
 You need to:
 1. Check and verify if the data in the "context" is not related to the SUBJECT or the alias of the subjects
 2. Scan the entire context for ANY phone numbers not associated with the SUBJECT or their aliases
@@ -151,23 +274,33 @@ Go through all this and return me the following:
 Redacted_Text: [list of minimal text segments containing ONLY non-subject information]
 Redaction_Reason: Concise explanation of why these specific segments need redaction
 
+If there is no data which should be redacted then just return an empty list in Redacted_Text
+"""
+)
 
-If there is no data which should be redacted then just return an empty list in Redacted_Text   
+phone_number_prompt = ChatPromptTemplate(
+    [
+        ("system", PHONE_NUMBER_SYSTEM_PROMPT),
+        (
+            "user",
+            'Here is your "SUBJECT" and alias names of the "SUBJECT" {subjects}.\n\n'
+            "Here is your PHONE NUMBER json input:\n{input}",
+        ),
+        REPAIR_MESSAGES,
+    ]
+)
 
-Here is your PHONE NUMBER json input:  
-{input}
-""")
 
+ADDRESS_SYSTEM_PROMPT = (
+    SUBJECT_INTRO
+    + REDACTION_GUIDELINES
+    + """
 
-address_prompt = ChatPromptTemplate.from_template(""" 
-Here is your "SUBJECT" and alias names of the "SUBJECT" {subjects}.
-                                                     
 I will be providing a dictionary which mentions an address:
 The Address and the context of the data will be mentioned in a way such that
-"entity_text": This will contain the Address 
+"entity_text": This will contain the Address
 "context": This will contain the corpus or the data which is present in the data
 
-
 You need to:
 1. Check and verify if the data in the "context" is not related to the SUBJECT or the alias of the subjects
 2. Scan the entire context for ANY addresses not associated with the SUBJECT or their aliases
@@ -179,13 +312,12 @@ IMPORTANT: When extracting text for redaction:
    - Never include portions that mention the SUBJECT or their aliases
    - Example: If text is "John lives at 123 Oak Street while [SUBJECT] lives nearby", return only "John lives at 123 Oak Street"
 
-                                                  
 "IMPORTANT: Family Member Handling:
    - If the information relates to SUBJECT's family members (parents, siblings, spouse, children, etc.), DO NOT redact it
    - In such cases, return an empty list for Redacted_Text
    - In Redaction_Reason, specify which family member was detected (e.g., 'Information pertains to SUBJECT's mother')
    - Example: If text is 'His mother lives in New York', and it refers to SUBJECT's mother, return empty list"
-                                                  
+
 Your role is to:
 1. Send me the exact sentence or sequence of words which contain addresses not belonging to the SUBJECT
 2. Look very carefully for sensitive data or security-related information that should be redacted
@@ -197,25 +329,37 @@ Go through all this and return me the following:
 Redacted_Text: [list of minimal text segments containing ONLY non-subject information]
 Redaction_Reason: Concise explanation of why these specific segments need redaction
 
+If there is no data which should be redacted then just return an empty list in Redacted_Text
+"""
+)
 
-If there is no data which should be redacted then just return an empty list in Redacted_Text   
+address_prompt = ChatPromptTemplate(
+    [
+        ("system", ADDRESS_SYSTEM_PROMPT),
+        (
+            "user",
+            'Here is your "SUBJECT" and alias names of the "SUBJECT" {subjects}.\n\n'
+            "Here is your ADDRESS json input:\n{input}",
+        ),
+        REPAIR_MESSAGES,
+    ]
+)
 
-Here is your ADDRESS json input:  
-{input}
- """)
 
+PRONOUN_SYSTEM_PROMPT = (
+    SUBJECT_INTRO
+    + REDACTION_GUIDELINES
+    + """
 
-pronoun_prompt = ChatPromptTemplate.from_template("""
-Here is your "SUBJECT" and alias names of the "SUBJECT" {subjects}.
-                                                     
 I will be providing a dictionary which mentions pronouns:
-The Pronoun and the context of the data will be mentioned in a way such that
-"pos_cateogry": This will contain the category such as objective pronouns, gender pronouns, possesive pronouns etc  
-"entity_text": This will contain the Pronoun 
+The Pronouns and the context of the data will be mentioned in a way such that
 "context": This will contain the corpus or the data which is present in the data
+"pronouns": This will contain a list of every pronoun found in the context, where each item has
+   - "entity_text": The Pronoun
+   - "pos_category": The category such as objective pronouns, gender pronouns, possesive pronouns etc
 
-You need to check and verify if the pronouns in the "context" are not related to the SUBJECT or the alias of the subjects. 
-Look within the context the pronoun I will be giving you in the entity text and the category in the pos_category and detect very carefully if they belong to subject or not
+You need to check and verify if the pronouns in the "context" are not related to the SUBJECT or the alias of the subjects.
+Look within the context for EVERY pronoun I will be giving you in the pronouns list and detect very carefully if each of them belongs to the subject or not
 
 IMPORTANT: When extracting text for redaction:
    - Only redact if the pronoun clearly refers to someone other than the SUBJECT
@@ -229,13 +373,53 @@ IMPORTANT: When extracting text for redaction:
    - In such cases, return an empty list for Redacted_Text
    - In Redaction_Reason, specify which family member was detected (e.g., 'Information pertains to SUBJECT's mother')
    - Example: If text is 'His mother lives in New York', and it refers to SUBJECT's mother, return empty list"
-                                                  
+
 Go through all this and return me the following:
 Redacted_Text: [list of minimal text segments containing ONLY non-subject pronoun information]
 Redaction_Reason: Concise explanation of why these specific segments need redaction
 
-If there is no data which should be redacted then just return an empty list in Redacted_Text   
-
-Here is your PRONOUN json input:  
-{input}
-""")
+If there is no data which should be redacted then just return an empty list in Redacted_Text
+"""
+)
+
+pronoun_prompt = ChatPromptTemplate(
+    [
+        ("system", PRONOUN_SYSTEM_PROMPT),
+        (
+            "user",
+            'Here is your "SUBJECT" and alias names of the "SUBJECT" {subjects}.\n\n'
+            "Here is your PRONOUN json input:\n{input}",
+        ),
+        REPAIR_MESSAGES,
+    ]
+)
+
+
+def group_prompt(system_prompt: str, label: str) -> ChatPromptTemplate:
+    """
+    Variant of an entity prompt for several target entities that share one context
+
+    The system message is the same static text as the single-entity prompt, so both
+    variants reuse the same cached prompt prefix.
+    """
+    return ChatPromptTemplate(
+        [
+            ("system", system_prompt),
+            (
+                "user",
+                'Here is your "SUBJECT" and alias names of the "SUBJECT" {subjects}.\n\n'
+                f"Here is your {label} json input. It lists several target entities in "
+                '"entity_texts" that all share the same "context". Analyse each of them '
+                'as if it were the only "entity_text" and return one redaction per '
+                "target entity, with its entity_text copied exactly as given:\n{input}",
+            ),
+            REPAIR_MESSAGES,
+        ]
+    )
+
+
+organisation_group_prompt = group_prompt(ORGANIZATION_SYSTEM_PROMPT, "ORGANIZATION")
+persom_group_prompt = group_prompt(PERSON_SYSTEM_PROMPT, "PERSON")
+email_group_prompt = group_prompt(EMAIL_SYSTEM_PROMPT, "EMAIL")
+phone_number_group_prompt = group_prompt(PHONE_NUMBER_SYSTEM_PROMPT, "PHONE NUMBER")
+address_group_prompt = group_prompt(ADDRESS_SYSTEM_PROMPT, "ADDRESS")
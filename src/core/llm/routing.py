@@ -0,0 +1,225 @@
+import asyncio
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Generator, Optional
+
+from src.core.llm.client import LLM_DEPLOYMENTS
+from src.core.llm.deadlines import deadline_call, latency_tracker, percentile
+from src.core.resilience import get_breaker, guarded_call
+
+FAST = "fast"
+ADVANCED = "advanced"
+TIERS = (FAST, ADVANCED)
+
+# Routes tried on the fast tier first: entity types, and the "aliases" and
+# "pronouns" tasks when opted in. Person and Organization decisions need the
+# advanced model, and a missed alias or subject pronoun is only caught by it.
+FAST_ROUTES = frozenset(
+    route.strip()
+    for route in os.getenv("LLM_FAST_ROUTES", "Email,PhoneNumber,Address").split(",")
+    if route.strip()
+)
+
+# Requests whose context is longer than this many tokens skip the fast tier
+LLM_FAST_MAX_CONTEXT_TOKENS = int(os.getenv("LLM_FAST_MAX_CONTEXT_TOKENS", "600"))
+
+
+def fast_tier_enabled() -> bool:
+    """Whether a fast deployment is configured; without it every call is advanced."""
+    return bool(LLM_DEPLOYMENTS[FAST])
+
+
+class TierStats:
+    """
+    Calls, latency, tokens and cost of each model tier during a run, with the
+    reason each request ended up on the tier that answered it
+    """
+
+    def __init__(self):
+        from src.core.llm.cost_tracking import CachedTokenCallbackHandler
+
+        self.handlers = {tier: CachedTokenCallbackHandler() for tier in TIERS}
+        self.calls = dict.fromkeys(TIERS, 0)
+        self.failures = dict.fromkeys(TIERS, 0)
+        self.latencies = {tier: [] for tier in TIERS}
+        self.decisions = Counter()
+        self.timeouts = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def record(self, tier: str, seconds: float, failed: bool = False) -> None:
+        self.calls[tier] += 1
+        self.latencies[tier].append(seconds)
+        if failed:
+            self.failures[tier] += 1
+
+    def record_hedge(self, hedge_won: bool) -> None:
+        self.hedges += 1
+        self.hedge_wins += hedge_won
+
+    def summary(self) -> Dict:
+        """
+        Returns:
+            dict: Per tier the calls, failed calls, mean, median and p99
+                latency, tokens and cost, "decisions" counting how requests
+                were routed, and the hedged requests and calls past their
+                deadline
+        """
+        summary = {}
+        for tier in TIERS:
+            handler = self.handlers[tier]
+            latencies = self.latencies[tier]
+            summary[tier] = {
+                "calls": self.calls[tier],
+                "failures": self.failures[tier],
+                "mean_seconds": sum(latencies) / max(len(latencies), 1),
+                "p50_seconds": percentile(latencies, 0.5) or 0.0,
+                "p99_seconds": percentile(latencies, 0.99) or 0.0,
+                "prompt_tokens": handler.prompt_tokens,
+                "completion_tokens": handler.completion_tokens,
+                "cost": handler.total_cost,
+            }
+        summary["decisions"] = dict(self.decisions)
+        summary["hedges"] = self.hedges
+        summary["hedge_wins"] = self.hedge_wins
+        summary["timeouts"] = self.timeouts
+        return summary
+
+    def report(self) -> None:
+        summary = self.summary()
+        for tier in TIERS:
+            stats = summary[tier]
+            print(
+                f"LLM {tier} tier: {stats['calls']} calls "
+                f"({stats['failures']} failed), mean {stats['mean_seconds']:.2f}s, "
+                f"p50 {stats['p50_seconds']:.2f}s, p99 {stats['p99_seconds']:.2f}s, "
+                f"{stats['prompt_tokens']} prompt tokens, ${stats['cost']:.6f}"
+            )
+        decisions = ", ".join(
+            f"{reason} {count}" for reason, count in sorted(self.decisions.items())
+        )
+        print(f"LLM routing: {decisions or 'no requests'}")
+        print(
+            f"LLM tail latency: {self.hedges} hedged requests "
+            f"({self.hedge_wins} answered first by the hedge), "
+            f"{self.timeouts} calls past their deadline"
+        )
+
+
+routing_stats_var: ContextVar[Optional[TierStats]] = ContextVar(
+    "routing_stats", default=None
+)
+
+
+@contextmanager
+def get_routing_stats() -> Generator[TierStats, None, None]:
+    """Collect per-tier statistics of every routed LLM call in scope."""
+    stats = TierStats()
+    token = routing_stats_var.set(stats)
+    try:
+        yield stats
+    finally:
+        routing_stats_var.reset(token)
+
+
+def tier_breaker(tier: str):
+    """Circuit breaker of the deployment behind a tier."""
+    return get_breaker(f"llm:{LLM_DEPLOYMENTS[tier]}")
+
+
+class RoutedChain:
+    """
+    Chain sending each request to the fast tier first, escalating to the
+    advanced tier when needed
+
+    A request goes straight to the advanced tier when its route is not one of
+    FAST_ROUTES or its context is longer than LLM_FAST_MAX_CONTEXT_TOKENS. A
+    fast answer that accept rejects (empty or inconsistent output), a failed
+    fast call or an open fast circuit sends it to the advanced tier. Failures
+    of the advanced tier are raised to the caller's retry policy.
+
+    Args:
+        route: Entity type or task name matched against FAST_ROUTES
+        build: Returns the chain of a tier, so a tier's client is only created
+            when it is used
+        accept: (input_data, result) -> whether a fast answer can be kept
+        context_tokens: input_data -> tokens of the variable part of the prompt
+    """
+
+    def __init__(
+        self,
+        route: str,
+        build: Callable,
+        accept: Callable,
+        context_tokens: Callable,
+    ):
+        self.route = route
+        self.build = build
+        self.accept = accept
+        self.context_tokens = context_tokens
+
+    def first_tier(self, input_data) -> str:
+        """The tier a request starts on, or the reason it skips the fast tier."""
+        if not fast_tier_enabled() or self.route not in FAST_ROUTES:
+            return "advanced_route"
+        if self.context_tokens(input_data) > LLM_FAST_MAX_CONTEXT_TOKENS:
+            return "long_context"
+        if tier_breaker(FAST).is_open():
+            return "fast_circuit_open"
+        return FAST
+
+    async def invoke_tier(self, tier: str, input_data):
+        """
+        Call one tier through its deployment's circuit breaker, within the call
+        deadline and hedged once the call is slower than the tier's observed p95
+        for this route, see deadline_call
+        """
+        stats = routing_stats_var.get()
+        config = {"callbacks": [stats.handlers[tier]]} if stats else None
+        chain = self.build(tier)
+        latencies = latency_tracker(self.route, tier)
+        started = time.perf_counter()
+        try:
+            result = await guarded_call(
+                tier_breaker(tier),
+                lambda: deadline_call(
+                    lambda: chain.ainvoke(input_data, config=config),
+                    latencies.hedge_delay(),
+                    stats.record_hedge if stats else None,
+                ),
+            )
+        except Exception as e:
+            if stats:
+                stats.record(tier, time.perf_counter() - started, failed=True)
+                # asyncio.TimeoutError is only an alias of TimeoutError from 3.11
+                stats.timeouts += isinstance(e, (asyncio.TimeoutError, TimeoutError))
+            raise
+        elapsed = time.perf_counter() - started
+        latencies.add(elapsed)
+        if stats:
+            stats.record(tier, elapsed)
+        return result
+
+    async def ainvoke(self, input_data):
+        decision = self.first_tier(input_data)
+        if decision == FAST:
+            try:
+                result = await self.invoke_tier(FAST, input_data)
+            except Exception as e:
+                print(f"Fast tier failed for {self.route}, escalating: {str(e)}")
+                decision = "fast_error"
+            else:
+                if self.accept(input_data, result):
+                    decision = "fast_accepted"
+                else:
+                    decision = "escalated_output"
+
+        stats = routing_stats_var.get()
+        if stats:
+            stats.decisions[decision] += 1
+        if decision == "fast_accepted":
+            return result
+        return await self.invoke_tier(ADVANCED, input_data)
@@ -0,0 +1,710 @@
+import asyncio
+from collections import defaultdict
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional
+
+from azure.ai.textanalytics import TextAnalyticsClient
+
+from src.core.bundle_manifest import BundleManifest, content_hash
+from src.core.dedup import (
+    DedupPlan,
+    SharedCalls,
+    document_text,
+    map_pii_result,
+    map_pos_result,
+)
+from src.core.events import StageMetrics, progress_event
+from src.core.entity_redaction import authenticate_client, pii_recognition_by_category
+from src.core.llm.alias_identification import get_file_aliases
+from src.core.llm.client import connection_stats, get_connection_stats
+from src.core.llm.cost_tracking import get_cost_callback
+from src.core.llm.deadlines import time_budget
+from src.core.llm.routing import get_routing_stats
+from src.core.llm.pronoun_redaction import (
+    build_pronoun_tasks,
+    stream_pronoun_redactions,
+)
+from src.core.llm.redaction_ai import build_entity_tasks, stream_redactions
+from src.core.pos_redaction import analyze_pos_categories
+from src.core.pronoun_resolution import resolve_pronouns_locally
+from src.core.resilience import error_stats, format_error_stats, get_error_stats
+from src.core.records import ContextStore
+from src.core.result_index import PERSON_TYPES, ResultIndex
+from src.utils.file_processing import (
+    group_pronouns_by_window,
+    process_documents_pos,
+    process_entities_with_context,
+    segregate_by_file,
+)
+
+
+async def _named(file_name: str, task):
+    """Pair a per-file task result with its file name for as_completed loops."""
+    return file_name, await task
+
+
+def report_failed_files(label: str, failed_files: Dict[str, set]) -> None:
+    """Warn about files left incomplete by failed calls."""
+    if failed_files:
+        files = ", ".join(
+            f"{file_name} ({', '.join(sorted(stages))})"
+            for file_name, stages in failed_files.items()
+        )
+        print(
+            f"Warning: {label} incomplete after failed calls for {files}; these "
+            "files are not stored in the bundle manifest and are retried next run"
+        )
+
+
+def _prepare_documents(documents: Dict[str, str]):
+    """Hash and chunk the extracted texts."""
+    text_hashes = {
+        file_name: content_hash(text) for file_name, text in documents.items()
+    }
+    return text_hashes, process_documents_pos(documents)
+
+
+def _cached_analysis(manifest, documents, text_hashes, context_store) -> Dict:
+    """Subject-independent outputs of the files the manifest has already analysed."""
+    cached = {}
+    for file_name in documents:
+        analysis = manifest.analysis(file_name, text_hashes[file_name], context_store)
+        if analysis is not None:
+            cached[file_name] = analysis
+    return cached
+
+
+def _plan_deduplication(documents, cached, fresh):
+    """
+    Match repeated paragraphs of new files against every file, with already
+    analysed files first so their paragraphs are the ones reused
+
+    Returns:
+        tuple: (DedupPlan, PII inputs and POS inputs of the fresh files, stats)
+    """
+    plan = DedupPlan(
+        {file_name: document_text(content) for file_name, content in documents.items()},
+        order=list(cached) + list(fresh),
+    )
+    pii_inputs = {
+        file_name: plan.analysis_input(file_name, content, "pii")
+        for file_name, content in fresh.items()
+    }
+    pos_inputs = {
+        file_name: plan.analysis_input(file_name, content, "pos")
+        for file_name, content in fresh.items()
+    }
+    dedup_stats = {
+        **plan.stats(),
+        "pii_chars": sum(
+            len(document_text(content))
+            for content, _ in pii_inputs.values()
+            if content is not None
+        ),
+        "pos_chars": sum(
+            len(document_text(content))
+            for content, _ in pos_inputs.values()
+            if content is not None
+        ),
+        "fresh_chars": sum(len(document_text(content)) for content in fresh.values()),
+    }
+    return plan, pii_inputs, pos_inputs, dedup_stats
+
+
+def _build_index(
+    documents,
+    text_hashes,
+    fresh,
+    cached,
+    results1,
+    pii_by_file,
+    pos_by_file,
+    context_store,
+    manifest,
+    failed_files,
+) -> ResultIndex:
+    """
+    Build the contexts of new files, index every file and store the new outputs
+    of the files whose analysis had no failed call
+    """
+    fresh_mentions = segregate_by_file(
+        process_entities_with_context(
+            [result for result in results1 if result["file_name"] in fresh],
+            documents,
+            context_store,
+        ),
+        fresh,
+    )
+    fresh_windows = segregate_by_file(
+        group_pronouns_by_window(
+            [pos_by_file[name] for name in fresh if pos_by_file[name]],
+            documents,
+            context_store,
+        ),
+        fresh,
+    )
+
+    index = ResultIndex(documents)
+    for file_name in documents:
+        source = cached.get(file_name)
+        if source is None:
+            source = {
+                "mentions": fresh_mentions[file_name],
+                "windows": fresh_windows[file_name],
+            }
+            if manifest is not None and file_name not in failed_files:
+                manifest.store_analysis(
+                    file_name,
+                    text_hashes[file_name],
+                    pii_by_file[file_name],
+                    pos_by_file[file_name],
+                    source["mentions"],
+                    source["windows"],
+                    context_store,
+                )
+        index.add_mentions(source["mentions"])
+        index.add_windows(source["windows"])
+    if manifest is not None:
+        manifest.save()
+    return index
+
+
+class DocumentAnalysis(NamedTuple):
+    """
+    Subject-independent outputs of a bundle: PII, POS, contexts and their index
+
+    Produced once per bundle by analyze_documents and reused for every data
+    subject the bundle is redacted for.
+    """
+
+    documents: Dict[str, List]
+    text_hashes: Dict[str, str]
+    pii_results: List[Dict]
+    index: ResultIndex
+    context_store: ContextStore
+    reused_files: List[str]
+    dedup_stats: Dict
+    error_stats: Dict
+    # File name -> stages with a failed call; their outputs are not stored
+    failed_files: Dict[str, set]
+
+
+async def analyze_documents(
+    documents: Dict[str, str],
+    key: str,
+    endpoint: str,
+    client: Optional[TextAnalyticsClient] = None,
+    manifest: Optional[BundleManifest] = None,
+    metrics: Optional[StageMetrics] = None,
+) -> AsyncIterator[Dict]:
+    """
+    Run the subject-independent stages (PII, POS and context building)
+
+    Paragraphs and pages repeated across the bundle are analysed once and their
+    results projected onto every copy, see DedupPlan.
+
+    Args:
+        documents: Dictionary with {filename: extracted document text}
+        key: Azure PII key
+        endpoint: Azure PII endpoint
+        client: Azure PII client shared between jobs, created from key and
+            endpoint when not given
+        manifest: BundleManifest of the bundle; unchanged files reuse its stage
+            outputs and the outputs of the other files are stored in it
+        metrics: StageMetrics collecting the stage timings
+
+    Yields:
+        dict: "stage" and "progress" events, and finally an "analysis" event
+            holding the DocumentAnalysis
+    """
+    pii_errors = error_stats("azure_pii")
+    # Hashing, chunking, manifest lookups and deduplication are CPU-bound and
+    # run in worker threads, keeping the event loop free for other jobs
+    text_hashes, documents = await asyncio.to_thread(_prepare_documents, documents)
+    file_order = {file_name: idx for idx, file_name in enumerate(documents)}
+    total_files = len(documents)
+    metrics = metrics or StageMetrics()
+    context_store = ContextStore()
+
+    # Subject-independent outputs of files the manifest has already analysed
+    cached = {}
+    if manifest is not None:
+        cached = await asyncio.to_thread(
+            _cached_analysis, manifest, documents, text_hashes, context_store
+        )
+        print(f"Bundle manifest: reusing analysis of {len(cached)}/{total_files} files")
+    fresh = {
+        file_name: content
+        for file_name, content in documents.items()
+        if file_name not in cached
+    }
+
+    plan, pii_inputs, pos_inputs, dedup_stats = await asyncio.to_thread(
+        _plan_deduplication, documents, cached, fresh
+    )
+    print(
+        f"Deduplication: {dedup_stats['exact_duplicates']} exact and "
+        f"{dedup_stats['near_duplicates']} near duplicates of "
+        f"{dedup_stats['blocks']} paragraphs; analysing {dedup_stats['pii_chars']} "
+        f"of {dedup_stats['fresh_chars']} characters for PII and "
+        f"{dedup_stats['pos_chars']} for POS"
+    )
+
+    # Azure PII detection, one task per new or changed file with text left to
+    # analyse once repeats are taken out
+    yield metrics.start("pii", total=total_files)
+    pii_by_file = {file_name: cached[file_name]["pii"] for file_name in cached}
+    for file_name, (content, _) in pii_inputs.items():
+        if content is None:
+            pii_by_file[file_name] = None
+    for done, file_name in enumerate(pii_by_file, 1):
+        yield progress_event("pii", file_name, done, total_files)
+    if any(content is not None for content, _ in pii_inputs.values()) and (
+        client is None
+    ):
+        client = await authenticate_client(endpoint=endpoint, key=key)
+    tasks = [
+        asyncio.ensure_future(
+            _named(
+                file_name,
+                pii_recognition_by_category(client, content, file_name, 0.75),
+            )
+        )
+        for file_name, (content, _) in pii_inputs.items()
+        if content is not None
+    ]
+    failed_files = defaultdict(set)
+    try:
+        for done, future in enumerate(
+            asyncio.as_completed(tasks), len(pii_by_file) + 1
+        ):
+            file_name, result = await future
+            if result is None:
+                failed_files[file_name].add("pii")
+            pii_by_file[file_name] = map_pii_result(result, pii_inputs[file_name][1])
+            yield progress_event("pii", file_name, done, total_files)
+    finally:
+        # A cancelled or closed job leaves no analysis running behind it
+        for task in tasks:
+            task.cancel()
+    pii_by_file = await asyncio.to_thread(plan.project_pii, pii_by_file, fresh)
+    # Copies of paragraphs whose analysis failed are missing their entities too
+    for file_name in plan.repeating_files(failed_files, fresh):
+        failed_files[file_name].add("pii")
+    for file_name in fresh:
+        result = pii_by_file[file_name]
+        pii_by_file[file_name] = (
+            result if result and any(result["categories"].values()) else None
+        )
+    results1 = sorted(
+        (result for result in pii_by_file.values() if result),
+        key=lambda result: file_order[result["file_name"]],
+    )
+    yield metrics.done("pii")
+
+    # Pronoun and gender noun analysis, one task per new or changed file with
+    # text left to analyse
+    yield metrics.start("pos", total=total_files)
+    pos_by_file = {file_name: cached[file_name]["pos"] for file_name in cached}
+    for file_name, (content, _) in pos_inputs.items():
+        if content is None:
+            pos_by_file[file_name] = None
+    for done, file_name in enumerate(pos_by_file, 1):
+        yield progress_event("pos", file_name, done, total_files)
+    tasks = [
+        asyncio.ensure_future(
+            _named(file_name, analyze_pos_categories(content, file_name))
+        )
+        for file_name, (content, _) in pos_inputs.items()
+        if content is not None
+    ]
+    try:
+        for done, future in enumerate(
+            asyncio.as_completed(tasks), len(pos_by_file) + 1
+        ):
+            file_name, result = await future
+            if result is None:
+                failed_files[file_name].add("pos")
+            pos_by_file[file_name] = (
+                map_pos_result(result, pos_inputs[file_name][1]) or None
+            )
+            yield progress_event("pos", file_name, done, total_files)
+    finally:
+        for task in tasks:
+            task.cancel()
+    pos_by_file = await asyncio.to_thread(plan.project_pos, pos_by_file, fresh)
+    pos_failed = [name for name, stages in failed_files.items() if "pos" in stages]
+    for file_name in plan.repeating_files(pos_failed, fresh):
+        failed_files[file_name].add("pos")
+    yield metrics.done("pos")
+
+    # Context building for new or changed files
+    yield metrics.start("context")
+    index = await asyncio.to_thread(
+        _build_index,
+        documents,
+        text_hashes,
+        fresh,
+        cached,
+        results1,
+        pii_by_file,
+        pos_by_file,
+        context_store,
+        manifest,
+        failed_files,
+    )
+    yield metrics.done("context")
+
+    pii_errors = error_stats("azure_pii", since=pii_errors)
+    print(f"Azure PII errors: {format_error_stats(pii_errors)}")
+    report_failed_files("Analysis", failed_files)
+
+    yield {
+        "event": "analysis",
+        "analysis": DocumentAnalysis(
+            documents=documents,
+            text_hashes=text_hashes,
+            pii_results=results1,
+            index=index,
+            context_store=context_store,
+            reused_files=list(cached),
+            dedup_stats=dedup_stats,
+            error_stats=pii_errors,
+            failed_files=dict(failed_files),
+        ),
+    }
+
+
+def _plan_subject_requests(analysis, subject, files_alias, all_aliases, manifest):
+    """
+    Reuse the redactions stored for the same alias set, resolve confident
+    pronoun links locally and create the LLM tasks for the rest
+
+    Returns:
+        tuple: (reused redactions by file, entity tasks, pronoun tasks, locally
+            resolved pronoun redactions)
+    """
+    documents = analysis.documents
+    index = analysis.index
+    context_store = analysis.context_store
+
+    # Files whose redactions were produced for the same alias set are reused
+    reused = {}
+    if manifest is not None:
+        for file_name in documents:
+            earlier = manifest.redactions(
+                file_name,
+                analysis.text_hashes[file_name],
+                subject,
+                frozenset(all_aliases),
+                context_store,
+            )
+            if earlier is not None:
+                reused[file_name] = earlier
+        print(
+            f"Bundle manifest: reusing redactions of {len(reused)}/{len(documents)} files"
+        )
+
+    non_alias_perameters = {
+        file_name: mentions
+        for file_name, mentions in index.filtered_mentions(files_alias, subject).items()
+        if file_name not in reused
+    }
+
+    # Resolve confident pronoun links locally, only the rest go to the LLM
+    pronoun_windows, local_pronoun_redactions = resolve_pronouns_locally(
+        {
+            file_name: windows
+            for file_name, windows in index.windows_by_file().items()
+            if file_name not in reused
+        },
+        all_aliases,
+        context_store,
+    )
+
+    entity_tasks = build_entity_tasks(non_alias_perameters, all_aliases, context_store)
+    pronoun_tasks = build_pronoun_tasks(pronoun_windows, all_aliases, context_store)
+    return reused, entity_tasks, pronoun_tasks, local_pronoun_redactions
+
+
+def _store_subject_redactions(
+    analysis,
+    subject,
+    alias_set,
+    reused,
+    redactions,
+    pronouns_redaction,
+    manifest,
+    failed_files,
+) -> None:
+    """
+    Store the new redactions of every file that did not reuse earlier ones and
+    had no failed call
+    """
+    documents = analysis.documents
+    new_redactions = segregate_by_file(
+        [item for item in redactions if item.file_name not in reused], documents
+    )
+    new_pronouns = segregate_by_file(
+        [item for item in pronouns_redaction if item.file_name not in reused],
+        documents,
+    )
+    for file_name in documents:
+        if file_name not in reused and file_name not in failed_files:
+            manifest.store_redactions(
+                file_name,
+                analysis.text_hashes[file_name],
+                subject,
+                alias_set,
+                new_redactions[file_name],
+                new_pronouns[file_name],
+                analysis.context_store,
+            )
+    manifest.save()
+
+
+async def redact_for_subject(
+    analysis: DocumentAnalysis,
+    subject: str,
+    manifest: Optional[BundleManifest] = None,
+    metrics: Optional[StageMetrics] = None,
+) -> AsyncIterator[Dict]:
+    """
+    Run the subject-dependent stages (aliases, entity and pronoun redactions)
+
+    Args:
+        analysis: DocumentAnalysis of the bundle
+        subject: Name of the data subject whose information is preserved
+        manifest: BundleManifest of the bundle; aliases are only requested for
+            files with new Person mentions, and earlier redactions are reused
+            while the alias set is unchanged
+        metrics: StageMetrics collecting the stage timings
+
+    Yields:
+        dict: "stage", "progress", "aliases" and "redaction" events, and finally
+            "result" with everything needed for reporting
+    """
+    metrics = metrics or StageMetrics()
+    text_hashes = analysis.text_hashes
+    index = analysis.index
+    context_store = analysis.context_store
+    segregated_results = index.mentions_by_file()
+    failed_files = defaultdict(set)
+    for file_name, stages in analysis.failed_files.items():
+        failed_files[file_name].update(stages)
+
+    llm_connections = connection_stats()
+    llm_errors = error_stats("llm")
+    with get_cost_callback() as cb, get_routing_stats() as tier_stats, time_budget():
+        # Subject alias identification, one LLM call per file with new Person
+        # mentions; other files reuse their aliases or have none
+        yield metrics.start("aliases", total=len(segregated_results))
+        files_alias = {}
+        tasks = []
+        alias_calls = SharedCalls()
+        for file_name, file_data in segregated_results.items():
+            aliases = None
+            if manifest is not None:
+                aliases = manifest.aliases(file_name, text_hashes[file_name], subject)
+            if aliases is None and not any(
+                item.entity_type in PERSON_TYPES for item in file_data
+            ):
+                aliases = []
+            if aliases is None:
+                tasks.append(
+                    get_file_aliases(
+                        file_name, file_data, subject, context_store, alias_calls
+                    )
+                )
+            else:
+                files_alias[file_name] = aliases
+        for done, file_name in enumerate(files_alias, 1):
+            yield progress_event("aliases", file_name, done, len(segregated_results))
+        tasks = [asyncio.ensure_future(task) for task in tasks]
+        try:
+            for done, future in enumerate(
+                asyncio.as_completed(tasks), len(files_alias) + 1
+            ):
+                file_name, aliases = await future
+                if aliases is None:
+                    failed_files[file_name].add("aliases")
+                    aliases = []
+                files_alias[file_name] = aliases
+                if manifest is not None and "aliases" not in failed_files.get(
+                    file_name, ()
+                ):
+                    manifest.store_aliases(
+                        file_name, text_hashes[file_name], subject, aliases
+                    )
+                yield progress_event(
+                    "aliases", file_name, done, len(segregated_results)
+                )
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        all_aliases = set()
+        for aliases in files_alias.values():
+            all_aliases.update(aliases)
+        all_aliases.discard(subject)
+        all_aliases = [subject] + sorted(all_aliases)
+        alias_set = frozenset(all_aliases)
+        yield {"event": "aliases", "aliases": all_aliases}
+        yield metrics.done("aliases")
+
+        # Reused redactions, local pronoun resolution and request collapsing
+        # are CPU-bound and run in a worker thread
+        (
+            reused,
+            entity_tasks,
+            pronoun_tasks,
+            local_pronoun_redactions,
+        ) = await asyncio.to_thread(
+            _plan_subject_requests,
+            analysis,
+            subject,
+            files_alias,
+            all_aliases,
+            manifest,
+        )
+        yield metrics.start("redactions", total=len(entity_tasks))
+        redactions = []
+        for earlier in reused.values():
+            for result in earlier["redactions"]:
+                redactions.append(result)
+                yield {"event": "redaction", "kind": "entity", "item": result}
+        done = 0
+        async for file_name, results, failed in stream_redactions(entity_tasks):
+            done += 1
+            if failed:
+                failed_files[file_name].add("redactions")
+            for result in results:
+                redactions.append(result)
+                yield {"event": "redaction", "kind": "entity", "item": result}
+            yield progress_event("redactions", file_name, done, len(entity_tasks))
+        yield metrics.done("redactions")
+
+        # Pronoun redactions, reused and local ones first and then the LLM windows
+        yield metrics.start("pronouns", total=len(pronoun_tasks))
+        pronouns_redaction = []
+        reused_pronouns = [
+            result
+            for earlier in reused.values()
+            for result in earlier["pronoun_redactions"]
+        ]
+        for result in reused_pronouns + local_pronoun_redactions:
+            pronouns_redaction.append(result)
+            yield {"event": "redaction", "kind": "pronoun", "item": result}
+        done = 0
+        async for file_name, result, failed in stream_pronoun_redactions(pronoun_tasks):
+            done += 1
+            if failed:
+                failed_files[file_name].add("pronouns")
+            if result is not None:
+                pronouns_redaction.append(result)
+                yield {"event": "redaction", "kind": "pronoun", "item": result}
+            yield progress_event("pronouns", file_name, done, len(pronoun_tasks))
+        yield metrics.done("pronouns")
+
+    failed_files = {name: stages for name, stages in failed_files.items() if stages}
+    report_failed_files("Redaction", failed_files)
+    if manifest is not None:
+        await asyncio.to_thread(
+            _store_subject_redactions,
+            analysis,
+            subject,
+            alias_set,
+            reused,
+            redactions,
+            pronouns_redaction,
+            manifest,
+            failed_files,
+        )
+
+    llm_connections = connection_stats(since=llm_connections)
+    print(
+        f"LLM connections: {llm_connections['requests']} requests over "
+        f"{llm_connections['connections_opened']} new connections "
+        f"({llm_connections['connect_seconds']:.2f}s connecting)"
+    )
+    tier_stats.report()
+    llm_errors = error_stats("llm", since=llm_errors)
+    print(f"LLM errors: {format_error_stats(llm_errors)}")
+    print(f"Total Cost (USD): ${format(cb.total_cost, '.6f')}")
+    print(
+        f"Cached Prompt Tokens: {cb.prompt_tokens_cached} of "
+        f"{cb.prompt_tokens} ({cb.cached_prompt_ratio:.1%})"
+    )
+
+    yield {
+        "event": "result",
+        "pii_results": analysis.pii_results,
+        "contexts": index.mentions(),
+        "context_store": context_store,
+        "files_alias": files_alias,
+        "aliases": all_aliases,
+        "redactions": redactions,
+        "pronouns_redaction": pronouns_redaction,
+        "reused_analysis": analysis.reused_files,
+        "reused_files": list(reused),
+        "dedup_stats": analysis.dedup_stats,
+        "total_cost": cb.total_cost,
+        "prompt_tokens": cb.prompt_tokens,
+        "prompt_tokens_cached": cb.prompt_tokens_cached,
+        "cached_prompt_ratio": cb.cached_prompt_ratio,
+        "stage_metrics": metrics.metrics,
+        "connection_stats": llm_connections,
+        "tier_stats": tier_stats.summary(),
+        "error_stats": {"azure_pii": analysis.error_stats, "llm": llm_errors},
+        "failed_files": {name: sorted(stages) for name, stages in failed_files.items()},
+    }
+
+
+async def run_pipeline(
+    documents: Dict[str, str],
+    subject: str,
+    key: str,
+    endpoint: str,
+    client: Optional[TextAnalyticsClient] = None,
+    manifest: Optional[BundleManifest] = None,
+) -> AsyncIterator[Dict]:
+    """
+    Run the full redaction pipeline and stream its progress as events
+
+    The subject-independent document analysis runs first and the alias and
+    redaction stages for the subject run on its output. With a manifest, a
+    bundle already analysed for another subject only runs the latter.
+
+    Args:
+        documents: Dictionary with {filename: extracted document text}
+        subject: Name of the data subject whose information is preserved
+        key: Azure PII key
+        endpoint: Azure PII endpoint
+        client: Azure PII client shared between jobs, created from key and
+            endpoint when not given
+        manifest: BundleManifest of the bundle, updated and saved with this
+            run's outputs
+
+    Yields:
+        dict: Events with an "event" field of "stage" (stage start/done with its
+            elapsed time), "progress" (per-file or per-item progress within a stage),
+            "aliases", "redaction" (one Redaction record as soon as it is produced)
+            and finally "result" with everything needed for reporting, including
+            the context store that the records' context ids refer to
+    """
+    metrics = StageMetrics()
+    analysis = None
+    # Connection and error counters of this job, apart from other jobs running
+    # on the same process
+    with get_connection_stats(), get_error_stats():
+        async for event in analyze_documents(
+            documents, key, endpoint, client=client, manifest=manifest, metrics=metrics
+        ):
+            if event["event"] == "analysis":
+                analysis = event["analysis"]
+            else:
+                yield event
+
+        async for event in redact_for_subject(
+            analysis, subject, manifest=manifest, metrics=metrics
+        ):
+            yield event
@@ -0,0 +1,488 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+from dotenv import load_dotenv
+
+from src.core.bundle_manifest import BundleManifest, upload_reference
+from src.core.llm.alias_identification import alias_input, alias_key
+from src.core.llm.client import LLM_MAX_CONNECTIONS
+from src.core.llm.pronoun_redaction import build_window_input, window_key
+from src.core.llm.pydantic_classes import (
+    AliasMatch,
+    GroupRedactionResult,
+    RedactionResult,
+)
+from src.core.llm.redaction_ai import (
+    entity_request_groups,
+    group_key,
+    group_redaction_prompts,
+    redaction_prompts,
+)
+from src.core.pipeline import DocumentAnalysis, analyze_documents
+from src.core.pos_redaction import get_nlp
+from src.core.pronoun_resolution import resolve_pronouns_locally
+from src.core.result_index import PERSON_TYPES
+from src.utils.context_budget import count_tokens
+
+load_dotenv()
+
+# Rate limits of the Azure OpenAI deployment and of the Azure Language resource
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "900"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "150000"))
+AZURE_PII_REQUESTS_PER_MINUTE = int(os.getenv("AZURE_PII_REQUESTS_PER_MINUTE", "1000"))
+
+# Typical seconds per call when nothing is rate limited
+LLM_CALL_SECONDS = float(os.getenv("LLM_CALL_SECONDS", "3"))
+AZURE_PII_CALL_SECONDS = float(os.getenv("AZURE_PII_CALL_SECONDS", "0.5"))
+
+# Model name of the deployment in langchain's OpenAI cost table, and the Azure
+# PII price per 1000 text records of up to PII_RECORD_CHARS characters
+LLM_PRICING_MODEL = os.getenv("LLM_PRICING_MODEL", "gpt-4o")
+AZURE_PII_PRICE_PER_1K_RECORDS = float(
+    os.getenv("AZURE_PII_PRICE_PER_1K_RECORDS", "1.0")
+)
+PII_RECORD_CHARS = 1000
+
+# Tokens OpenAI adds around every chat message and to prime the reply
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_OVERHEAD_TOKENS = 3
+
+# Azure serves a repeated prompt prefix from its cache from this length on
+MIN_CACHED_PREFIX_TOKENS = 1024
+
+# Expected tokens of one structured answer, per target entity for groups
+COMPLETION_TOKENS = {"aliases": 30, "entities": 60, "pronouns": 60}
+
+# spaCy entity labels standing in for the Azure PII categories while planning
+NER_CATEGORIES = {
+    "PERSON": "Person",
+    "ORG": "Organization",
+    "GPE": "Address",
+    "LOC": "Address",
+    "FAC": "Address",
+    "DATE": "DateTime",
+    "TIME": "DateTime",
+}
+PATTERN_CATEGORIES = (
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+"), "Email"),
+    (re.compile(r"\+?\d[\d ()-]{7,}\d"), "PhoneNumber"),
+)
+
+LLM_STAGES = ("aliases", "entities", "pronouns")
+
+
+class LocalEntity(NamedTuple):
+    text: str
+    category: str
+    confidence_score: float
+    offset: int
+    length: int
+
+
+class LocalDocument(NamedTuple):
+    is_error: bool
+    entities: List[LocalEntity]
+
+
+class EstimatingPiiClient:
+    """
+    Stand-in for the Azure PII client while planning
+
+    Counts the requests and text records the pipeline sends, and answers them
+    locally with spaCy NER and patterns so that the later stages are planned on
+    realistic entities.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.records = 0
+        self._lock = threading.Lock()
+
+    def recognize_pii_entities(self, documents, language="en", categories_filter=None):
+        nlp = get_nlp()
+        results = []
+        for text in documents:
+            with self._lock:
+                self.calls += 1
+                self.records += max(math.ceil(len(text) / PII_RECORD_CHARS), 1)
+
+            entities = [
+                LocalEntity(
+                    ent.text,
+                    NER_CATEGORIES[ent.label_],
+                    1.0,
+                    ent.start_char,
+                    len(ent.text),
+                )
+                for ent in nlp(text).ents
+                if ent.label_ in NER_CATEGORIES
+            ]
+            for pattern, category in PATTERN_CATEGORIES:
+                entities.extend(
+                    LocalEntity(
+                        match.group(), category, 1.0, match.start(), len(match.group())
+                    )
+                    for match in pattern.finditer(text)
+                )
+            if categories_filter:
+                entities = [
+                    entity
+                    for entity in entities
+                    if entity.category in categories_filter
+                ]
+            results.append(LocalDocument(False, entities))
+        return results
+
+
+class ChainEstimate:
+    """Calls and tokens of one LLM stage, with the prompt prefix tokens cacheable."""
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cacheable_tokens = 0
+        self._prefixes = set()
+
+    def add(self, prompt, inputs: Dict, schema, completion_tokens: int) -> None:
+        messages = prompt.format_messages(**inputs)
+        counts = [
+            count_tokens(message.content) + MESSAGE_OVERHEAD_TOKENS
+            for message in messages
+        ]
+        self.calls += 1
+        self.prompt_tokens += (
+            sum(counts) + REPLY_OVERHEAD_TOKENS + schema_tokens(schema)
+        )
+        self.completion_tokens += completion_tokens
+
+        # The static system message is served from the prompt cache after the
+        # first call of each prompt
+        if id(prompt) in self._prefixes:
+            if counts[0] >= MIN_CACHED_PREFIX_TOKENS:
+                self.cacheable_tokens += counts[0]
+        else:
+            self._prefixes.add(id(prompt))
+
+
+_schema_tokens: Dict = {}
+
+
+def schema_tokens(schema) -> int:
+    """Tokens of the structured output schema sent along with every call."""
+    if schema not in _schema_tokens:
+        _schema_tokens[schema] = count_tokens(json.dumps(schema.model_json_schema()))
+    return _schema_tokens[schema]
+
+
+def estimate_llm_requests(
+    analysis: DocumentAnalysis,
+    subject: str,
+    manifest: Optional[BundleManifest] = None,
+) -> Dict[str, ChainEstimate]:
+    """
+    LLM requests the subject-dependent stages would send for a bundle
+
+    Requests are built with the same grouping, sharing and local pronoun
+    resolution as the pipeline, and counted by rendering the actual prompt
+    templates. The subject's aliases are not known before the alias calls, so
+    only the subject name itself is treated as the subject, an upper bound on
+    the entity and pronoun requests.
+    """
+    from src.core.llm.prompts import alias_prompt
+    from src.core.llm.redaction_prompts import pronoun_prompt
+
+    context_store = analysis.context_store
+    index = analysis.index
+    subjects = [subject]
+    chains = {stage: ChainEstimate() for stage in LLM_STAGES}
+
+    # Alias identification, one call per distinct set of Person mentions
+    alias_requests = {}
+    for file_name, file_data in index.mentions_by_file().items():
+        if manifest is not None and (
+            manifest.aliases(file_name, analysis.text_hashes[file_name], subject)
+            is not None
+        ):
+            continue
+        if any(item.entity_type in PERSON_TYPES for item in file_data):
+            alias_requests.setdefault(alias_key(file_data), file_data)
+    for file_data in alias_requests.values():
+        chains["aliases"].add(
+            alias_prompt,
+            alias_input(file_data, subject, context_store),
+            AliasMatch,
+            COMPLETION_TOKENS["aliases"],
+        )
+
+    # Entity redactions, one call per distinct collapsed group
+    _, groups = entity_request_groups(
+        index.filtered_mentions({}, subject), context_store
+    )
+    entity_requests = {}
+    for group in groups:
+        entity_requests.setdefault(group_key(group), group)
+    for group in entity_requests.values():
+        context = context_store.get(group.context_id)
+        if len(group.mentions) == 1:
+            chains["entities"].add(
+                redaction_prompts()[group.entity_type],
+                {
+                    "subjects": subjects,
+                    "input": {
+                        "entity_text": group.mentions[0].entity_text,
+                        "context": context,
+                    },
+                },
+                RedactionResult,
+                COMPLETION_TOKENS["entities"],
+            )
+        else:
+            chains["entities"].add(
+                group_redaction_prompts()[group.entity_type],
+                {
+                    "subjects": subjects,
+                    "input": {
+                        "entity_texts": [
+                            mention.entity_text for mention in group.mentions
+                        ],
+                        "context": context,
+                    },
+                },
+                GroupRedactionResult,
+                COMPLETION_TOKENS["entities"] * len(group.mentions),
+            )
+
+    # Pronoun windows the local resolution leaves for the LLM
+    pronoun_windows, _ = resolve_pronouns_locally(
+        index.windows_by_file(), subjects, context_store
+    )
+    window_requests = {}
+    for windows in pronoun_windows.values():
+        for window in windows:
+            window_requests.setdefault(window_key(window), window)
+    for window in window_requests.values():
+        chains["pronouns"].add(
+            pronoun_prompt,
+            {"input": build_window_input(window, context_store), "subjects": subjects},
+            RedactionResult,
+            COMPLETION_TOKENS["pronouns"],
+        )
+
+    return chains
+
+
+def stage_seconds(
+    calls: int,
+    tokens: int,
+    requests_per_minute: float,
+    tokens_per_minute: Optional[float],
+    concurrency: float,
+    call_seconds: float,
+) -> float:
+    """
+    Wall time of a stage: the slower of what the rate limits allow and of
+    running the calls in waves of concurrency
+    """
+    if not calls:
+        return 0.0
+    minutes = calls / requests_per_minute
+    if tokens_per_minute:
+        minutes = max(minutes, tokens / tokens_per_minute)
+    return max(minutes * 60, math.ceil(calls / concurrency) * call_seconds)
+
+
+def llm_cost(prompt_tokens: int, completion_tokens: int) -> float:
+    from langchain_community.callbacks.openai_info import (
+        get_openai_token_cost_for_model,
+    )
+
+    try:
+        return get_openai_token_cost_for_model(
+            LLM_PRICING_MODEL, prompt_tokens
+        ) + get_openai_token_cost_for_model(
+            LLM_PRICING_MODEL, completion_tokens, is_completion=True
+        )
+    except ValueError as e:
+        print(f"No price for {LLM_PRICING_MODEL}, set LLM_PRICING_MODEL: {str(e)}")
+        return 0.0
+
+
+def stage_row(stage: str, calls: int = 0, seconds: float = 0.0, **values) -> Dict:
+    return {
+        "stage": stage,
+        "calls": calls,
+        "text_records": values.get("text_records", 0),
+        "prompt_tokens": values.get("prompt_tokens", 0),
+        "completion_tokens": values.get("completion_tokens", 0),
+        "cacheable_tokens": values.get("cacheable_tokens", 0),
+        "seconds": seconds,
+        "cost": values.get("cost", 0.0),
+    }
+
+
+async def plan_documents(
+    documents: Dict[str, str],
+    subject: str,
+    manifest: Optional[BundleManifest] = None,
+    extraction_seconds: float = 0.0,
+) -> Dict:
+    """
+    Estimate the calls, tokens, wall time and cost of running a bundle
+
+    The local stages (chunking, deduplication, POS and context building) run as
+    they would in the pipeline, with Azure PII answered locally by
+    EstimatingPiiClient, and the LLM requests are then counted without being
+    sent. Nothing is written to the manifest.
+
+    Args:
+        documents: Dictionary with {filename: extracted document text}
+        subject: Name of the data subject whose information is preserved
+        manifest: Read-only BundleManifest of the bundle; files it has
+            analysed before need no PII calls
+        extraction_seconds: Time the text extraction took, added to the plan
+
+    Returns:
+        dict: "stages" rows with calls, tokens, seconds and cost per stage,
+            "total_seconds", "total_cost" and the bundle's size and duplicates
+    """
+    started = time.perf_counter()
+    client = EstimatingPiiClient()
+    analysis = None
+    async for event in analyze_documents(
+        documents, None, None, client=client, manifest=manifest
+    ):
+        if event["event"] == "analysis":
+            analysis = event["analysis"]
+    chains = await asyncio.to_thread(estimate_llm_requests, analysis, subject, manifest)
+    local_seconds = extraction_seconds + time.perf_counter() - started
+
+    pii_files = max(len(documents) - len(analysis.reused_files), 1)
+    stages = [
+        stage_row("local", seconds=local_seconds),
+        stage_row(
+            "pii",
+            client.calls,
+            # Files run concurrently, the chunks of one file one after another
+            stage_seconds(
+                client.calls,
+                0,
+                AZURE_PII_REQUESTS_PER_MINUTE,
+                None,
+                pii_files,
+                AZURE_PII_CALL_SECONDS,
+            ),
+            text_records=client.records,
+            cost=client.records * AZURE_PII_PRICE_PER_1K_RECORDS / 1000,
+        ),
+    ]
+    for stage, chain in chains.items():
+        stages.append(
+            stage_row(
+                stage,
+                chain.calls,
+                stage_seconds(
+                    chain.calls,
+                    chain.prompt_tokens + chain.completion_tokens,
+                    LLM_REQUESTS_PER_MINUTE,
+                    LLM_TOKENS_PER_MINUTE,
+                    LLM_MAX_CONNECTIONS,
+                    LLM_CALL_SECONDS,
+                ),
+                prompt_tokens=chain.prompt_tokens,
+                completion_tokens=chain.completion_tokens,
+                cacheable_tokens=chain.cacheable_tokens,
+                cost=llm_cost(chain.prompt_tokens, chain.completion_tokens),
+            )
+        )
+
+    return {
+        "subject": subject,
+        "files": len(documents),
+        "characters": sum(len(text) for text in documents.values()),
+        "reused_files": len(analysis.reused_files),
+        "dedup_stats": analysis.dedup_stats,
+        "stages": stages,
+        "total_seconds": sum(row["seconds"] for row in stages),
+        "total_cost": sum(row["cost"] for row in stages),
+    }
+
+
+async def plan_bundle(
+    files: Dict[str, bytes], subject: str, bundle_id: Optional[str] = None
+) -> Dict:
+    """Extract the texts of uploaded PDFs and plan their run, see plan_documents."""
+    from src.utils.intial_file_processing import extract_pdf_texts
+
+    manifest = await asyncio.to_thread(
+        lambda: BundleManifest.for_bundle(
+            bundle_id or upload_reference(files), read_only=True
+        )
+    )
+    started = time.perf_counter()
+    documents = await extract_pdf_texts(files, manifest)
+    return await plan_documents(
+        documents,
+        subject,
+        manifest=manifest,
+        extraction_seconds=time.perf_counter() - started,
+    )
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h {minutes:02d}m"
+    if minutes:
+        return f"{minutes}m {seconds:02d}s"
+    return f"{seconds}s"
+
+
+def format_plan(plan: Dict) -> str:
+    """Plain-text table of a plan for the command line."""
+    lines = [
+        f"{plan['files']} files, {plan['characters']} characters, "
+        f"{plan['reused_files']} analysed before",
+        f"{'stage':<10}{'calls':>8}{'records':>9}{'prompt':>11}{'output':>9}"
+        f"{'cacheable':>11}{'time':>10}{'cost':>11}",
+    ]
+    for row in plan["stages"]:
+        lines.append(
+            f"{row['stage']:<10}{row['calls']:>8}{row['text_records']:>9}"
+            f"{row['prompt_tokens']:>11}{row['completion_tokens']:>9}"
+            f"{row['cacheable_tokens']:>11}{format_duration(row['seconds']):>10}"
+            f"{'$' + format(row['cost'], '.4f'):>11}"
+        )
+    lines.append(
+        f"Estimated time {format_duration(plan['total_seconds'])}, "
+        f"cost ${format(plan['total_cost'], '.4f')} (USD)"
+    )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Estimate the cost and time of redacting a bundle, without running it"
+    )
+    parser.add_argument("files", nargs="+", type=Path, help="PDF files of the bundle")
+    parser.add_argument("--subject", required=True, help="Name of the data subject")
+    parser.add_argument("--bundle-id", help="Bundle reference of earlier runs")
+    parser.add_argument("--json", action="store_true", help="Print the plan as JSON")
+    args = parser.parse_args()
+
+    files = {path.name: path.read_bytes() for path in args.files}
+    plan = asyncio.run(plan_bundle(files, args.subject, args.bundle_id))
+    print(json.dumps(plan, indent=2) if args.json else format_plan(plan))
+
+
+if __name__ == "__main__":
+    main()
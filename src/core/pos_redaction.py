@@ -1,6 +1,141 @@
 import spacy
 import asyncio
-from typing import Dict, List, Union, Optional
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from spacy.attrs import DEP, LOWER, POS, TAG
+from spacy.strings import get_string_id
+
+from src.core.pronoun_resolution import resolve_antecedents
+from src.core.records import PronounOccurrence, intern_label
+
+# Gender-related nouns, matched on the lowercased token
+GENDER_NOUNS = {
+    "man",
+    "woman",
+    "boy",
+    "girl",
+    "male",
+    "female",
+    "gentleman",
+    "lady",
+    "sir",
+    "madam",
+    "father",
+    "mother",
+    "son",
+    "daughter",
+    "brother",
+    "sister",
+    "uncle",
+    "aunt",
+    "king",
+    "queen",
+    "prince",
+    "princess",
+    "husband",
+    "wife",
+    # Plurals
+    "men",
+    "women",
+    "boys",
+    "girls",
+    "males",
+    "females",
+    "gentlemen",
+    "ladies",
+    "fathers",
+    "mothers",
+    "sons",
+    "daughters",
+    "brothers",
+    "sisters",
+    "uncles",
+    "aunts",
+    "kings",
+    "queens",
+    "princes",
+    "princesses",
+    "husbands",
+    "wives",
+}
+
+# Pronoun categories in the order of the codes used by classify_tokens
+POS_CATEGORIES = tuple(
+    intern_label(category)
+    for category in (
+        "personal_pronouns",
+        "objective_pronouns",
+        "possessive_pronouns",
+        "interrogative_pronouns",
+        "gender_nouns",
+    )
+)
+PERSONAL, OBJECTIVE, POSSESSIVE, INTERROGATIVE, GENDER = range(len(POS_CATEGORIES))
+
+# Hash ids of the strings checked per token, as found in Doc.to_array columns
+GENDER_NOUN_IDS = np.array(
+    [get_string_id(noun) for noun in GENDER_NOUNS], dtype=np.uint64
+)
+PRON_ID = get_string_id("PRON")
+POSSESSIVE_TAG_ID = get_string_id("PRP$")
+INTERROGATIVE_TAG_IDS = np.array(
+    [get_string_id(tag) for tag in ("WP", "WDT", "WP$")], dtype=np.uint64
+)
+OBJECT_DEP_IDS = np.array(
+    [get_string_id(dep) for dep in ("dobj", "pobj", "iobj")], dtype=np.uint64
+)
+
+
+@lru_cache(maxsize=None)
+def get_nlp():
+    """Load the spaCy English model once per process."""
+    return spacy.load("en_core_web_sm")
+
+
+def classify_tokens(doc) -> List[Tuple[int, str]]:
+    """
+    Find gender nouns and pronouns in a parsed document
+
+    Works on the LOWER, POS, TAG and DEP columns of the whole document at once.
+    Gender nouns take precedence over pronouns, and a pronoun is interrogative
+    by tag (WP, WDT, WP$), then possessive (PRP$), then objective when its
+    dependency is dobj, pobj or iobj, and personal otherwise (nsubj, nsubjpass
+    and any other dependency).
+
+    Returns:
+        list: (token index, category) pairs in document order
+    """
+    if not len(doc):
+        return []
+    lower, pos, tag, dep = doc.to_array([LOWER, POS, TAG, DEP]).T
+
+    gender = np.isin(lower, GENDER_NOUN_IDS)
+    pronoun = (pos == PRON_ID) & ~gender
+
+    codes = np.full(len(doc), PERSONAL, dtype=np.int8)
+    codes[np.isin(dep, OBJECT_DEP_IDS)] = OBJECTIVE
+    codes[tag == POSSESSIVE_TAG_ID] = POSSESSIVE
+    codes[np.isin(tag, INTERROGATIVE_TAG_IDS)] = INTERROGATIVE
+    codes[gender] = GENDER
+
+    indices = np.flatnonzero(gender | pronoun)
+    return [
+        (index, POS_CATEGORIES[code])
+        for index, code in zip(indices.tolist(), codes[indices].tolist())
+    ]
+
+
+def _sentence_bounds(doc) -> Tuple[List[int], List[Tuple[int, int]]]:
+    """First token index and character bounds of every sentence in a doc."""
+    starts = []
+    bounds = []
+    for sentence in doc.sents:
+        starts.append(sentence.start)
+        bounds.append((sentence.start_char, sentence.end_char))
+    return starts, bounds
 
 
 async def analyze_pos_categories(
@@ -14,13 +149,14 @@ async def analyze_pos_categories(
         file_name (str): Name of the file being processed
 
     Returns:
-        dict: Dictionary containing categorized words in standardized format
+        dict: Dictionary containing categorized words in standardized format, plus an
+            "occurrences" list of PronounOccurrence records with every matched token
+            and its offsets in the document text (chunks joined with a single space)
     """
-    # Load English language model
-    # Move this to a global variable or pass as parameter for better performance
-    nlp = spacy.load("en_core_web_sm")
+    nlp = get_nlp()
 
     # Initialize results structure
+    file_name = intern_label(file_name)
     categorized_results = {
         "file_name": file_name,
         "categories": {
@@ -32,60 +168,16 @@ async def analyze_pos_categories(
         },
     }
 
-    # Define gender-related nouns
-    gender_nouns = {
-        "man",
-        "woman",
-        "boy",
-        "girl",
-        "male",
-        "female",
-        "gentleman",
-        "lady",
-        "sir",
-        "madam",
-        "father",
-        "mother",
-        "son",
-        "daughter",
-        "brother",
-        "sister",
-        "uncle",
-        "aunt",
-        "king",
-        "queen",
-        "prince",
-        "princess",
-        "husband",
-        "wife",
-        # Plurals
-        "men",
-        "women",
-        "boys",
-        "girls",
-        "males",
-        "females",
-        "gentlemen",
-        "ladies",
-        "fathers",
-        "mothers",
-        "sons",
-        "daughters",
-        "brothers",
-        "sisters",
-        "uncles",
-        "aunts",
-        "kings",
-        "queens",
-        "princes",
-        "princesses",
-        "husbands",
-        "wives",
-    }
-
     # Ensure document_chunks is a list
     chunks = [document_chunks] if isinstance(document_chunks, str) else document_chunks
 
+    # Start offset of each chunk in the joined document text
+    chunk_offsets = []
+    offset = 0
+    for chunk in chunks:
+        chunk_offsets.append(offset)
+        offset += len(chunk) + 1
+
     try:
         # Track unique words across all chunks
         unique_entries = {
@@ -95,49 +187,64 @@ async def analyze_pos_categories(
         # Process chunks asynchronously
         loop = asyncio.get_running_loop()
 
-        async def process_chunk(chunk):
-            # Process the text using spaCy in a thread pool
-            doc = await loop.run_in_executor(None, nlp, chunk)
+        def process_chunk(chunk, chunk_offset):
+            # Runs in a thread pool: parsing, antecedent linking and token
+            # classification are all CPU-bound
+            doc = nlp(chunk)
 
             chunk_entries = {
                 category: set() for category in categorized_results["categories"]
             }
+            chunk_occurrences = []
 
-            # Process each token
-            for token in doc:
-                word_lower = token.text.lower()
-
-                # Check for gender nouns
-                if word_lower in gender_nouns:
-                    chunk_entries["gender_nouns"].add(token.text)
-                    continue
+            # Link gendered pronouns to nearby named mentions for local resolution
+            antecedents = resolve_antecedents(doc)
 
-                # Check for pronouns
-                if token.pos_ == "PRON":
-                    if token.tag_ in ["WP", "WDT", "WP$"]:
-                        category = "interrogative_pronouns"
-                    elif token.tag_ == "PRP$":
-                        category = "possessive_pronouns"
-                    elif token.dep_ in ["nsubj", "nsubjpass"]:
-                        category = "personal_pronouns"
-                    elif token.dep_ in ["dobj", "pobj", "iobj"]:
-                        category = "objective_pronouns"
-                    else:
-                        category = "personal_pronouns"
+            # Classify all tokens at once, then build records for the matches
+            matches = classify_tokens(doc)
+            if matches:
+                sentence_starts, sentence_bounds = _sentence_bounds(doc)
+            for token_index, category in matches:
+                token = doc[token_index]
+                chunk_entries[category].add(token.text)
 
-                    chunk_entries[category].add(token.text)
+                antecedent = antecedents.get(token_index)
+                if antecedent is not None:
+                    antecedent = antecedent._replace(
+                        start=chunk_offset + antecedent.start,
+                        end=chunk_offset + antecedent.end,
+                    )
+                sentence_start, sentence_end = sentence_bounds[
+                    bisect_right(sentence_starts, token_index) - 1
+                ]
+                chunk_occurrences.append(
+                    PronounOccurrence(
+                        text=token.text,
+                        pos_category=category,
+                        start=chunk_offset + token.idx,
+                        end=chunk_offset + token.idx + len(token.text),
+                        sentence_start=chunk_offset + sentence_start,
+                        sentence_end=chunk_offset + sentence_end,
+                        antecedent=antecedent,
+                    )
+                )
 
-            return chunk_entries
+            return chunk_entries, chunk_occurrences
 
         # Process all chunks concurrently
         chunk_results = await asyncio.gather(
-            *[process_chunk(chunk) for chunk in chunks]
+            *[
+                loop.run_in_executor(None, process_chunk, chunk, chunk_offset)
+                for chunk, chunk_offset in zip(chunks, chunk_offsets)
+            ]
         )
 
         # Combine results from all chunks
-        for chunk_result in chunk_results:
+        occurrences = []
+        for chunk_result, chunk_occurrences in chunk_results:
             for category, entries in chunk_result.items():
                 unique_entries[category].update(entries)
+            occurrences.extend(chunk_occurrences)
 
         # Convert unique entries to final format
         for category in categorized_results["categories"]:
@@ -151,40 +258,10 @@ async def analyze_pos_categories(
             for category, entities in categorized_results["categories"].items()
             if entities
         }
+        categorized_results["occurrences"] = occurrences
 
     except Exception as e:
         print(f"Error processing file {file_name}: {str(e)}")
         return None
 
     return categorized_results
-
-
-async def process_multiple_documents_for_pos(
-    documents_dict: Dict[str, Union[str, List[str]]],
-) -> List[Dict]:
-    """
-    Process multiple documents concurrently
-
-    Args:
-        documents_dict: Dictionary with {filename: document_text or list_of_chunks}
-
-    Returns:
-        List of dictionaries containing categorized words for each document
-    """
-    # Create tasks for all documents
-    tasks = [
-        analyze_pos_categories(document_content, file_name)
-        for file_name, document_content in documents_dict.items()
-    ]
-
-    # Process all documents concurrently
-    results = await asyncio.gather(*tasks)
-
-    # Filter out None results
-    return [result for result in results if result]
-
-
-# Example usage in your Streamlit app:
-async def process_pos_analysis(documents):
-    """Wrapper function for POS analysis"""
-    return await process_multiple_documents_for_pos(documents)
@@ -0,0 +1,280 @@
+import re
+from bisect import bisect_right
+from typing import Dict, List, Optional, Tuple
+
+from src.core.records import (
+    Antecedent,
+    ContextStore,
+    ContextWindow,
+    PronounOccurrence,
+    Redaction,
+    intern_label,
+)
+
+
+# Third-person singular pronouns whose gender lets us link them to a named mention
+PRONOUN_GENDER = {
+    "he": "male",
+    "him": "male",
+    "his": "male",
+    "himself": "male",
+    "she": "female",
+    "her": "female",
+    "hers": "female",
+    "herself": "female",
+}
+
+# Honorifics that reveal the gender of the following name
+TITLE_GENDER = {
+    "mr": "male",
+    "mister": "male",
+    "sir": "male",
+    "lord": "male",
+    "mrs": "female",
+    "ms": "female",
+    "miss": "female",
+    "madam": "female",
+    "lady": "female",
+    "dame": "female",
+}
+
+# Titles ignored when comparing a mention with the subject aliases
+NAME_TITLES = set(TITLE_GENDER) | {"dr", "prof", "professor", "chief", "rev"}
+
+
+def _mention_gender(doc, ent) -> Optional[str]:
+    """Infer the gender of a PERSON mention from an honorific before or inside it."""
+    title_tokens = [doc[ent.start]]
+    if ent.start > 0:
+        title_tokens.append(doc[ent.start - 1])
+    for token in title_tokens:
+        gender = TITLE_GENDER.get(token.lower_.rstrip("."))
+        if gender:
+            return gender
+    return None
+
+
+def resolve_antecedents(doc, max_sentence_distance: int = 1) -> Dict[int, Antecedent]:
+    """
+    Link gendered third-person pronouns to the nearest compatible PERSON mention
+
+    Args:
+        doc: spaCy Doc with named entities and sentence boundaries
+        max_sentence_distance (int): How many sentences back to look for a mention
+
+    Returns:
+        dict: Token index of each pronoun mapped to its antecedent, with the mention
+            text and offsets, the sentence distance and whether another compatible
+            mention in the look-back window makes the link ambiguous
+    """
+    persons = [ent for ent in doc.ents if ent.label_ == "PERSON"]
+    if not persons:
+        return {}
+
+    sentence_starts = [sent.start for sent in doc.sents]
+
+    def sentence_index(token_idx):
+        return bisect_right(sentence_starts, token_idx) - 1
+
+    person_sentences = [
+        (ent, sentence_index(ent.start), _mention_gender(doc, ent)) for ent in persons
+    ]
+    antecedents = {}
+
+    for token in doc:
+        gender = PRONOUN_GENDER.get(token.lower_)
+        if gender is None or token.pos_ != "PRON":
+            continue
+
+        token_sentence = sentence_index(token.i)
+        candidates = [
+            (ent, ent_sentence, ent_gender)
+            for ent, ent_sentence, ent_gender in person_sentences
+            if ent.end <= token.i
+            and token_sentence - ent_sentence <= max_sentence_distance
+            and ent_gender in (None, gender)
+        ]
+        if not candidates:
+            continue
+
+        nearest, nearest_sentence, nearest_gender = candidates[-1]
+        antecedents[token.i] = Antecedent(
+            text=nearest.text,
+            start=nearest.start_char,
+            end=nearest.end_char,
+            sentence_distance=token_sentence - nearest_sentence,
+            ambiguous=len({ent.text for ent, _, _ in candidates}) > 1,
+            gender=nearest_gender,
+        )
+
+    return antecedents
+
+
+def _name_tokens(name: str) -> set:
+    """Lower-cased name parts with punctuation and titles removed."""
+    return {
+        part for part in re.findall(r"[a-z']+", name.lower()) if part not in NAME_TITLES
+    }
+
+
+def _name_gender(name: str) -> Optional[str]:
+    """Gender revealed by an honorific in a name, e.g. "Mr. Harrison"."""
+    for part in re.findall(r"[a-z']+", name.lower()):
+        gender = TITLE_GENDER.get(part)
+        if gender:
+            return gender
+    return None
+
+
+def alias_profiles(aliases: List[str]) -> List[Tuple[set, Optional[str]]]:
+    """Name parts and honorific gender of each subject alias."""
+    return [(_name_tokens(alias), _name_gender(alias)) for alias in aliases]
+
+
+def classify_pronoun(
+    pronoun: PronounOccurrence, aliases: List[Tuple[set, Optional[str]]]
+) -> str:
+    """
+    Decide locally whether a pronoun refers to the subject
+
+    A pronoun refers to the subject only when every name part of its antecedent
+    belongs to one alias and no honorific of the antecedent or that alias
+    contradicts the pronoun's gender. A part of a name ("Harrison" for "Mark
+    Harrison") also needs an alias whose honorific matches the pronoun ("Mr.
+    Harrison" for "he"), as a relative may share the surname. A longer name
+    sharing parts with an alias ("Jane Harrison") is left to the LLM too.
+
+    Args:
+        pronoun: Pronoun with its locally resolved antecedent
+        aliases: Name parts and honorific gender of each alias, see alias_profiles
+
+    Returns:
+        str: "subject", "non_subject" or "llm" when the link is not confident enough
+    """
+    antecedent = pronoun.antecedent
+    if antecedent is None or antecedent.ambiguous:
+        return "llm"
+    gender = PRONOUN_GENDER.get(pronoun.text.lower())
+    if gender is None:
+        return "llm"
+
+    mention_tokens = _name_tokens(antecedent.text)
+    if not mention_tokens:
+        return "llm"
+    # The honorific may sit outside the mention, e.g. "Mrs." before "Harrison"
+    mention_gender = antecedent.gender or _name_gender(antecedent.text)
+
+    matches = [
+        (alias_tokens, alias_gender)
+        for alias_tokens, alias_gender in aliases
+        if mention_tokens <= alias_tokens
+    ]
+    if matches:
+        titles = [alias_gender for _, alias_gender in matches] + [mention_gender]
+        if any(title_gender not in (None, gender) for title_gender in titles):
+            return "llm"
+        if any(mention_tokens == alias_tokens for alias_tokens, _ in matches) or (
+            any(alias_gender == gender for _, alias_gender in matches)
+        ):
+            return "subject"
+        return "llm"
+
+    # Any shared name part (e.g. a relative sharing a surname) needs the LLM
+    if any(mention_tokens & alias_tokens for alias_tokens, _ in aliases):
+        return "llm"
+    return "non_subject"
+
+
+def resolve_pronouns_locally(
+    windows: Dict[str, List[ContextWindow]],
+    aliases: List[str],
+    context_store: ContextStore,
+) -> Tuple[Dict[str, List[ContextWindow]], List[Redaction]]:
+    """
+    Resolve high-confidence pronouns without calling the LLM
+
+    Pronouns linked to the subject are dropped, pronouns linked to another named
+    person are redacted locally, and only the remaining low-confidence pronouns are
+    kept in the windows sent to the LLM.
+
+    Args:
+        windows: Pronoun windows grouped by file name
+        aliases: Subject name and all of its aliases
+        context_store: Store holding the text of every window
+
+    Returns:
+        tuple: (windows still needing the LLM grouped by file, local redactions)
+    """
+    aliases = [alias for alias in aliases if alias]
+    profiles = alias_profiles(aliases)
+    alias_pattern = (
+        re.compile(
+            "|".join(
+                re.escape(alias) for alias in sorted(aliases, key=len, reverse=True)
+            )
+        )
+        if aliases
+        else None
+    )
+
+    remaining = {}
+    local_redactions = []
+
+    for file_name, file_windows in windows.items():
+        remaining[file_name] = []
+
+        for window in file_windows:
+            context = context_store.get(window.context_id)
+            llm_pronouns = []
+            resolved = []
+            redacted_sentences = {}
+
+            for pronoun in window.pronouns:
+                decision = classify_pronoun(pronoun, profiles)
+
+                if decision == "non_subject":
+                    start = max(pronoun.sentence_start, window.start)
+                    end = min(pronoun.sentence_end, window.end)
+                    sentence = context[
+                        start - window.start : end - window.start
+                    ].strip()
+
+                    # Sentences that also mention the subject need a careful split
+                    if not sentence or (
+                        alias_pattern and alias_pattern.search(sentence)
+                    ):
+                        decision = "llm"
+                    else:
+                        resolved.append(pronoun)
+                        redacted_sentences.setdefault(sentence, None)
+
+                if decision == "llm":
+                    llm_pronouns.append(pronoun)
+
+            if redacted_sentences:
+                local_redactions.append(
+                    Redaction(
+                        file_name=window.file_name,
+                        kind="pronoun",
+                        target=", ".join(dict.fromkeys(item.text for item in resolved)),
+                        category=intern_label(
+                            ", ".join(
+                                dict.fromkeys(item.pos_category for item in resolved)
+                            )
+                        ),
+                        redacted_text=tuple(redacted_sentences),
+                        reason="Pronouns refer to "
+                        + ", ".join(
+                            dict.fromkeys(item.antecedent.text for item in resolved)
+                        )
+                        + ", who is not the subject (resolved locally)",
+                        context_id=window.context_id,
+                    )
+                )
+
+            if llm_pronouns:
+                remaining[file_name].append(
+                    window._replace(pronouns=tuple(llm_pronouns))
+                )
+
+    return remaining, local_redactions
@@ -0,0 +1,120 @@
+import sys
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+
+def intern_label(value: str) -> str:
+    """Intern file names and categories so every record shares one string object."""
+    return sys.intern(value)
+
+
+class ContextStore:
+    """
+    Stores each distinct context string once and hands out integer ids.
+
+    Records refer to their context by id, so a context shared by several mentions
+    or windows is kept in memory once and compared by id rather than by content.
+    """
+
+    __slots__ = ("_ids", "_texts")
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._texts: List[str] = []
+
+    def add(self, text: str) -> int:
+        context_id = self._ids.get(text)
+        if context_id is None:
+            context_id = len(self._texts)
+            self._ids[text] = context_id
+            self._texts.append(text)
+        return context_id
+
+    def get(self, context_id: int) -> str:
+        return self._texts[context_id]
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+
+class Entity(NamedTuple):
+    """
+    A PII entity detected by Azure in one file.
+
+    offset and length locate the most confident detection in the document text
+    (chunks joined with a single space), or are -1 and 0 when unknown.
+    """
+
+    file_name: str
+    category: str
+    text: str
+    confidence_score: float
+    offset: int = -1
+    length: int = 0
+
+
+class Mention(NamedTuple):
+    """An entity located in a document together with the context built around it."""
+
+    file_name: str
+    entity_type: str
+    entity_text: str
+    context_id: int
+    start: int
+    end: int
+
+
+class Antecedent(NamedTuple):
+    """The named mention a pronoun was linked to by local coreference."""
+
+    text: str
+    start: int
+    end: int
+    sentence_distance: int
+    ambiguous: bool
+    # Gender of an honorific before or inside the mention, e.g. "Mrs. Harrison"
+    gender: Optional[str] = None
+
+
+class PronounOccurrence(NamedTuple):
+    """One pronoun or gender noun token with its document offsets."""
+
+    text: str
+    pos_category: str
+    start: int
+    end: int
+    sentence_start: int
+    sentence_end: int
+    antecedent: Optional[Antecedent]
+
+
+class ContextWindow(NamedTuple):
+    """A context window sent to the LLM with every pronoun occurring inside it."""
+
+    file_name: str
+    context_id: int
+    start: int
+    end: int
+    pronouns: Tuple[PronounOccurrence, ...]
+
+
+class Redaction(NamedTuple):
+    """A redaction produced for an entity or for the pronouns of a window."""
+
+    file_name: str
+    kind: str
+    target: str
+    category: str
+    redacted_text: Tuple[str, ...]
+    reason: str
+    context_id: int
+
+
+class MentionGroup(NamedTuple):
+    """Mentions of one entity type whose overlapping contexts are sent in one request."""
+
+    file_name: str
+    entity_type: str
+    context_id: int
+    start: int
+    end: int
+    mentions: Tuple[Mention, ...]
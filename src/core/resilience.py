@@ -0,0 +1,330 @@
+import asyncio
+import os
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, Generator, Optional
+
+from src.core.llm.deadlines import TimeBudgetExceeded, backoff_delay, remaining_time
+
+# Error classes of a failed external call
+RETRYABLE = "retryable"
+FATAL = "fatal"
+CONTENT_FILTER = "content_filter"
+PARSE_ERROR = "parse_error"
+ERROR_CLASSES = (RETRYABLE, FATAL, CONTENT_FILTER, PARSE_ERROR)
+
+# HTTP statuses worth retrying: timeouts, conflicts, throttling and server errors
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+# Exceptions, by class name anywhere in their hierarchy, so the Azure, OpenAI,
+# httpx and langchain packages need not be imported to classify their errors
+RETRYABLE_ERRORS = {
+    "TimeoutError",
+    "ConnectionError",
+    "APIConnectionError",
+    "APITimeoutError",
+    "TransportError",
+    "ServiceRequestError",
+    "ServiceResponseError",
+}
+PARSE_ERRORS = {"ValidationError", "OutputParserException", "JSONDecodeError"}
+CONTENT_FILTER_ERRORS = {"ContentFilterFinishReasonError"}
+CONTENT_FILTER_MARKERS = ("content_filter", "ResponsibleAIPolicyViolation")
+
+# Consecutive retryable failures that open an endpoint's circuit, and seconds
+# it stays open before one probe request is let through
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+
+# Seconds a call waits for an open circuit before giving up
+CIRCUIT_MAX_WAIT = float(os.getenv("CIRCUIT_MAX_WAIT", "120"))
+
+# Seconds between checks while another call probes a half-open circuit
+PROBE_POLL_SECONDS = 1.0
+
+# Times an unparseable answer is asked again with a repair message
+PARSE_REPAIR_ATTEMPTS = int(os.getenv("PARSE_REPAIR_ATTEMPTS", "2"))
+
+# Failed calls per class, retries, repairs and circuit events, per layer
+# ("azure_pii" or "llm"); they only grow, see error_stats
+ERROR_STATS: Dict[str, Counter] = defaultdict(Counter)
+
+# The same counters for the calls of one job, see get_error_stats
+error_stats_var: ContextVar[Optional[Dict[str, Counter]]] = ContextVar(
+    "error_stats", default=None
+)
+
+
+def _count(layer: str, name: str) -> None:
+    ERROR_STATS[layer][name] += 1
+    job_stats = error_stats_var.get()
+    if job_stats is not None:
+        job_stats[layer][name] += 1
+
+
+@contextmanager
+def get_error_stats() -> Generator[Dict[str, Counter], None, None]:
+    """Count the failures of calls in scope apart from those of other jobs."""
+    stats = defaultdict(Counter)
+    token = error_stats_var.set(stats)
+    try:
+        yield stats
+    finally:
+        error_stats_var.reset(token)
+
+
+class CircuitOpenError(Exception):
+    """An endpoint's circuit stayed open longer than the call could wait."""
+
+
+def _error_names(error: Exception) -> set:
+    return {cls.__name__ for cls in type(error).__mro__}
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def classify_error(error: Exception) -> str:
+    """
+    Class of a failed call: RETRYABLE (throttling, timeouts, outages), FATAL
+    (authentication, bad requests, used-up time budget and unrecognised errors,
+    which are most likely bugs), CONTENT_FILTER (the input was rejected by
+    content filtering) or PARSE_ERROR (the answer did not match the output
+    schema)
+    """
+    if isinstance(error, (TimeBudgetExceeded, CircuitOpenError)):
+        return FATAL
+
+    names = _error_names(error)
+    message = str(error)
+    if names & CONTENT_FILTER_ERRORS or any(
+        marker in message for marker in CONTENT_FILTER_MARKERS
+    ):
+        return CONTENT_FILTER
+    if names & PARSE_ERRORS:
+        return PARSE_ERROR
+
+    status = _status_code(error)
+    if status is not None:
+        return RETRYABLE if status in RETRYABLE_STATUSES or status >= 500 else FATAL
+    if names & RETRYABLE_ERRORS:
+        return RETRYABLE
+    return FATAL
+
+
+class CircuitBreaker:
+    """
+    Circuit of one endpoint or deployment, shared by every call to it
+
+    After CIRCUIT_FAILURE_THRESHOLD consecutive retryable failures the circuit
+    opens: calls wait for it instead of each backing off and retrying on their
+    own. After CIRCUIT_RESET_SECONDS one probe call is let through; its success
+    closes the circuit and its failure opens it again. Answers that are not
+    retryable failures (a content filter rejection, an unparseable answer)
+    show the endpoint is up.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        reset_seconds: float = CIRCUIT_RESET_SECONDS,
+    ):
+        self.name = name
+        self.layer = name.split(":")[0]
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    async def acquire(self) -> None:
+        """
+        Wait until a call may be sent
+
+        Raises:
+            CircuitOpenError: When the circuit stays open longer than
+                CIRCUIT_MAX_WAIT or the job's time budget allows
+        """
+        waited = 0.0
+        while self.opened_at is not None:
+            wait_time = self.opened_at + self.reset_seconds - time.monotonic()
+            if wait_time <= 0 and not self.probing:
+                self.probing = True
+                return
+
+            wait_time = max(wait_time, PROBE_POLL_SECONDS)
+            remaining = remaining_time()
+            if waited + wait_time > CIRCUIT_MAX_WAIT or (
+                remaining is not None and wait_time >= remaining
+            ):
+                _count(self.layer, "circuit_rejected")
+                raise CircuitOpenError(f"Circuit of {self.name} is open")
+            await asyncio.sleep(wait_time)
+            waited += wait_time
+
+    def release(self) -> None:
+        """Give up a call that was never answered, letting another call probe."""
+        self.probing = False
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            print(f"Circuit of {self.name} closed")
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self, error_class: str) -> None:
+        if error_class != RETRYABLE:
+            self.record_success()
+            return
+
+        self.failures += 1
+        if self.probing or (self.opened_at is None and self.failures >= self.threshold):
+            _count(self.layer, "circuit_trips")
+            print(
+                f"Circuit of {self.name} open for {self.reset_seconds:.0f}s after "
+                f"{self.failures} consecutive failures"
+            )
+            self.opened_at = time.monotonic()
+            self.probing = False
+
+
+@lru_cache(maxsize=None)
+def get_breaker(name: str) -> CircuitBreaker:
+    """Circuit breaker of an endpoint, named "<layer>" or "<layer>:<deployment>"."""
+    return CircuitBreaker(name)
+
+
+async def guarded_call(breaker: CircuitBreaker, call: Callable[[], Awaitable]):
+    """
+    Send one call through an endpoint's circuit, counting its failure class
+
+    A call that ends without an answer (cancelled, or out of time budget) is
+    neither a success nor a failure, but frees the probe slot it may hold.
+    """
+    await breaker.acquire()
+    answered = False
+    try:
+        result = await call()
+        answered = True
+    except TimeBudgetExceeded:
+        raise
+    except Exception as e:
+        answered = True
+        error_class = classify_error(e)
+        _count(breaker.layer, error_class)
+        breaker.record_failure(error_class)
+        raise
+    finally:
+        if not answered:
+            breaker.release()
+    breaker.record_success()
+    return result
+
+
+async def retry_call(
+    call: Callable[[Optional[str]], Awaitable],
+    label: str,
+    layer: str,
+    max_attempts: int = 6,
+    jitter: Callable[[], float] = lambda: 0.0,
+):
+    """
+    Await call(repair) with the retry policy of its error class
+
+    Retryable failures are retried up to max_attempts times with capped
+    exponential backoff within the job's time budget. Parse errors are asked
+    again up to PARSE_REPAIR_ATTEMPTS times without waiting, with repair set to
+    the parse error so the caller can add a repair message, see with_repair.
+    Fatal errors and content filter rejections are raised at once.
+
+    Args:
+        call: Sends one attempt; repair is None or the last parse error
+        label: What is being called, for log messages
+        layer: Counter group of the retries, "azure_pii" or "llm"
+        max_attempts: Attempts for retryable failures
+        jitter: Returns seconds added to each backoff
+    """
+    attempts = 0
+    repairs = 0
+    repair = None
+    while True:
+        try:
+            return await call(repair)
+        except Exception as e:
+            error_class = classify_error(e)
+            if error_class == PARSE_ERROR and repairs < PARSE_REPAIR_ATTEMPTS:
+                repairs += 1
+                repair = str(e)
+                _count(layer, "repairs")
+                print(f"Unparseable answer for {label}, asking again to repair it")
+                continue
+
+            attempts += 1
+            if error_class != RETRYABLE or attempts >= max_attempts:
+                print(
+                    f"Failed after {attempts} attempts for {label} "
+                    f"({error_class}): {str(e)}"
+                )
+                raise
+
+            wait_time = backoff_delay(attempts, jitter())
+            _count(layer, "retries")
+            print(
+                f"Attempt {attempts} failed for {label}, retrying in "
+                f"{wait_time:.2f} seconds..."
+            )
+            await asyncio.sleep(wait_time)
+
+
+def with_repair(input_data: Dict, repair: Optional[str]) -> Dict:
+    """
+    Prompt input asking the model to fix its last answer, filling the optional
+    "repair" messages placeholder at the end of every prompt
+    """
+    if repair is None:
+        return input_data
+
+    from langchain_core.messages import HumanMessage
+
+    message = HumanMessage(
+        "Your previous answer could not be parsed into the required output "
+        f"schema: {repair}\nAnswer again, following the schema exactly."
+    )
+    return {**input_data, "repair": [message]}
+
+
+def error_stats(layer: str, since: Optional[Dict] = None) -> Dict:
+    """
+    Failure counters of a layer: calls failed per error class, "retries",
+    "repairs", "circuit_trips" and "circuit_rejected"
+
+    Inside get_error_stats only the failures of that job are counted.
+
+    Args:
+        since: Earlier snapshot; when given, only failures after it are counted
+    """
+    counts = (error_stats_var.get() or ERROR_STATS)[layer]
+    stats = {name: counts[name] for name in ERROR_CLASSES}
+    for name in ("retries", "repairs", "circuit_trips", "circuit_rejected"):
+        stats[name] = counts[name]
+    if since is not None:
+        stats = {name: count - since.get(name, 0) for name, count in stats.items()}
+    return stats
+
+
+def format_error_stats(stats: Dict) -> str:
+    return (
+        ", ".join(f"{count} {name}" for name, count in stats.items() if count) or "none"
+    )
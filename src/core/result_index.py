@@ -0,0 +1,119 @@
+from typing import Dict, Iterable, List, Optional
+
+from src.core.records import ContextWindow, Mention
+
+# Entity types that describe people and share one context per mention
+PERSON_TYPES = ("Person", "PersonType")
+
+
+class ResultIndex:
+    """
+    Single store for the contextual results of a job, indexed as they are added.
+
+    Mentions are grouped by file and entity type on insert and Person/PersonType
+    mentions are deduplicated by context id at the same time, so segregating,
+    deduplicating and filtering are lookups rather than extra passes over the
+    results. Pronoun windows are grouped by file the same way.
+    """
+
+    __slots__ = ("_mentions", "_windows", "_person_contexts")
+
+    def __init__(self, file_names: Iterable[str] = ()):
+        # Pre-seeding the files keeps the document order in every grouping
+        self._mentions: Dict[str, Dict[str, List[Mention]]] = {
+            file_name: {} for file_name in file_names
+        }
+        self._windows: Dict[str, List[ContextWindow]] = {
+            file_name: [] for file_name in self._mentions
+        }
+        # Context id mapped to the Person/PersonType mention that owns it
+        self._person_contexts: Dict[int, Mention] = {}
+
+    def add_mention(self, mention: Mention) -> bool:
+        """
+        Add a mention, keeping one Person/PersonType mention per context
+
+        A Person mention replaces a PersonType mention with the same context, any
+        other repeat of a context is dropped.
+
+        Returns:
+            bool: Whether the mention was kept
+        """
+        if mention.entity_type in PERSON_TYPES:
+            owner = self._person_contexts.get(mention.context_id)
+            if owner is not None:
+                if owner.entity_type == "Person" or mention.entity_type != "Person":
+                    return False
+                self._group(owner.file_name, owner.entity_type).remove(owner)
+            self._person_contexts[mention.context_id] = mention
+
+        self._group(mention.file_name, mention.entity_type).append(mention)
+        return True
+
+    def add_mentions(self, mentions: Iterable[Mention]) -> None:
+        for mention in mentions:
+            self.add_mention(mention)
+
+    def add_windows(self, windows: Iterable[ContextWindow]) -> None:
+        for window in windows:
+            self._windows.setdefault(window.file_name, []).append(window)
+
+    def _group(self, file_name: str, entity_type: str) -> List[Mention]:
+        return self._mentions.setdefault(file_name, {}).setdefault(entity_type, [])
+
+    def file_mentions(
+        self, file_name: str, entity_types: Optional[Iterable[str]] = None
+    ) -> List[Mention]:
+        """Mentions of one file, optionally only those of the given entity types."""
+        groups = self._mentions.get(file_name, {})
+        if entity_types is None:
+            entity_types = groups
+        return [
+            mention
+            for entity_type in entity_types
+            for mention in groups.get(entity_type, ())
+        ]
+
+    def mentions(self) -> List[Mention]:
+        """Every kept mention, in file order."""
+        return [
+            mention
+            for file_name in self._mentions
+            for mention in self.file_mentions(file_name)
+        ]
+
+    def mentions_by_file(self) -> Dict[str, List[Mention]]:
+        """Mentions grouped by file, leaving out files without any mention."""
+        return {
+            file_name: mentions
+            for file_name in self._mentions
+            if (mentions := self.file_mentions(file_name))
+        }
+
+    def windows_by_file(self) -> Dict[str, List[ContextWindow]]:
+        """Pronoun windows grouped by file, including files without windows."""
+        return self._windows
+
+    def filtered_mentions(
+        self, files_alias: Dict[str, List[str]], subject: str
+    ) -> Dict[str, List[Mention]]:
+        """
+        Mentions that still need redacting once the subject aliases are known
+
+        Person mentions naming the subject or one of the file's aliases are left
+        out, every other mention is kept. Files with nothing left are dropped.
+        """
+        filtered_results = {}
+        for file_name, groups in self._mentions.items():
+            subject_names = set(files_alias.get(file_name, ()))
+            subject_names.add(subject)
+
+            filtered_entities = [
+                mention
+                for entity_type, mentions in groups.items()
+                for mention in mentions
+                if entity_type != "Person" or mention.entity_text not in subject_names
+            ]
+            if filtered_entities:
+                filtered_results[file_name] = filtered_entities
+        return filtered_results
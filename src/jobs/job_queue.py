@@ -0,0 +1,606 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+# Queue used when JOB_QUEUE_URL is not set
+DEFAULT_QUEUE_URL = "sqlite:///jobs.db"
+
+# Running jobs without a heartbeat for this long are handed to another worker
+STALE_JOB_SECONDS = 300
+
+# Finished jobs, with their events and downloads, are deleted after this long
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+# Job states, in the order a job moves through them
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+FINISHED_STATES = (DONE, FAILED)
+
+# Names under which a finished job's downloads are stored
+REPORT_ARTIFACT = "report.xlsx"
+PARQUET_ARTIFACT = "parquet.zip"
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    bundle_id TEXT,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    heartbeat_at REAL,
+    worker_id TEXT,
+    attempt INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    summary TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS job_files (
+    job_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    file_name TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (job_id, position)
+);
+CREATE TABLE IF NOT EXISTS job_events (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+CREATE TABLE IF NOT EXISTS job_artifacts (
+    job_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (job_id, name)
+);
+"""
+
+
+class SQLiteJobQueue:
+    """
+    Job queue stored in a local SQLite database shared by the app and the workers.
+
+    Workers claim jobs fairly: the next job always belongs to the user with the
+    fewest running jobs, oldest first, so one user submitting many bundles cannot
+    starve everyone else. Progress events, the result summary and the report files
+    are kept in the same database for the app to poll until prune removes them.
+    """
+
+    def __init__(
+        self,
+        path: str = "jobs.db",
+        stale_after: float = STALE_JOB_SECONDS,
+        retention: float = JOB_RETENTION_SECONDS,
+    ):
+        self.path = path
+        self.stale_after = stale_after
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SQLITE_SCHEMA)
+        # Databases created before bundle references existed
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")]
+        if "bundle_id" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN bundle_id TEXT")
+        if "attempt" not in columns:
+            self._conn.execute(
+                "ALTER TABLE jobs ADD COLUMN attempt INTEGER NOT NULL DEFAULT 0"
+            )
+
+    def _transaction(self, work):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work(self._conn)
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def _query(self, sql: str, params=()) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def submit(
+        self,
+        user_id: str,
+        subject: str,
+        files: Dict[str, bytes],
+        bundle_id: Optional[str] = None,
+    ) -> str:
+        """
+        Queue a bundle of PDF files for a subject and return the new job id
+
+        Jobs given the same bundle_id share a bundle manifest, so resubmitting a
+        bundle only reprocesses its new or changed files.
+        """
+        job_id = uuid.uuid4().hex
+
+        def work(conn):
+            conn.execute(
+                "INSERT INTO jobs (id, user_id, subject, bundle_id, status, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, user_id, subject, bundle_id, QUEUED, time.time()),
+            )
+            conn.executemany(
+                "INSERT INTO job_files (job_id, position, file_name, data) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (job_id, position, file_name, data)
+                    for position, (file_name, data) in enumerate(files.items())
+                ],
+            )
+
+        self._transaction(work)
+        return job_id
+
+    def claim(self, worker_id: str) -> Optional[Dict]:
+        """
+        Take the next job for a worker, or None when nothing is queued
+
+        Jobs whose worker stopped sending heartbeats are queued again first. Each
+        claim starts a new attempt of the job with an empty event list.
+        """
+
+        def work(conn):
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker_id = NULL "
+                "WHERE status = ? AND heartbeat_at < ?",
+                (QUEUED, RUNNING, now - self.stale_after),
+            )
+            row = conn.execute(
+                "SELECT id, user_id, subject, bundle_id FROM jobs AS queued "
+                "WHERE status = ? "
+                "ORDER BY (SELECT COUNT(*) FROM jobs AS running "
+                "WHERE running.user_id = queued.user_id AND running.status = ?), "
+                "created_at "
+                "LIMIT 1",
+                (QUEUED, RUNNING),
+            ).fetchone()
+            if row is None:
+                return None
+
+            job_id, user_id, subject, bundle_id = row
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker_id = ?, started_at = ?, "
+                "heartbeat_at = ?, attempt = attempt + 1 WHERE id = ?",
+                (RUNNING, worker_id, now, now, job_id),
+            )
+            # A requeued job starts over, so its earlier progress is dropped
+            conn.execute("DELETE FROM job_events WHERE job_id = ?", (job_id,))
+            files = conn.execute(
+                "SELECT file_name, data FROM job_files WHERE job_id = ? "
+                "ORDER BY position",
+                (job_id,),
+            ).fetchall()
+            return {
+                "id": job_id,
+                "user_id": user_id,
+                "subject": subject,
+                "bundle_id": bundle_id,
+                "files": {file_name: bytes(data) for file_name, data in files},
+            }
+
+        return self._transaction(work)
+
+    def heartbeat(self, job_id: str) -> None:
+        self._transaction(
+            lambda conn: conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (time.time(), job_id)
+            )
+        )
+
+    def add_events(self, job_id: str, events: List[Dict]) -> None:
+        """Append JSON-serialisable progress events and refresh the heartbeat."""
+
+        def work(conn):
+            (last_seq,) = conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM job_events WHERE job_id = ?",
+                (job_id,),
+            ).fetchone()
+            conn.executemany(
+                "INSERT INTO job_events (job_id, seq, payload) VALUES (?, ?, ?)",
+                [
+                    (job_id, seq, json.dumps(event))
+                    for seq, event in enumerate(events, last_seq + 1)
+                ],
+            )
+            conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (time.time(), job_id)
+            )
+
+        self._transaction(work)
+
+    def finish(self, job_id: str, summary: Dict, artifacts: Dict[str, bytes]) -> None:
+        """Mark a job done, storing its summary and downloadable files."""
+
+        def work(conn):
+            conn.executemany(
+                "INSERT OR REPLACE INTO job_artifacts (job_id, name, data) "
+                "VALUES (?, ?, ?)",
+                [(job_id, name, data) for name, data in artifacts.items()],
+            )
+            conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, summary = ? WHERE id = ?",
+                (DONE, time.time(), json.dumps(summary), job_id),
+            )
+            # The input files are no longer needed once the job has finished
+            conn.execute("DELETE FROM job_files WHERE job_id = ?", (job_id,))
+
+        self._transaction(work)
+
+    def fail(self, job_id: str, error: str) -> None:
+        self._transaction(
+            lambda conn: conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE id = ?",
+                (FAILED, time.time(), error, job_id),
+            )
+        )
+
+    def prune(self) -> int:
+        """Delete jobs finished more than retention seconds ago, returning how many."""
+
+        def work(conn):
+            finished = "SELECT id FROM jobs WHERE status IN (?, ?) AND finished_at < ?"
+            params = (*FINISHED_STATES, time.time() - self.retention)
+            for table in ("job_events", "job_artifacts", "job_files"):
+                conn.execute(
+                    f"DELETE FROM {table} WHERE job_id IN ({finished})", params
+                )
+            return conn.execute(f"DELETE FROM jobs WHERE id IN ({finished})", params)
+
+        return self._transaction(work).rowcount
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        """
+        Current state of a job, with the number of queued jobs ahead of it
+
+        The attempt counts the claims of the job: a job queued again after its
+        worker stopped restarts its events from the first one.
+        """
+        rows = self._query(
+            "SELECT status, created_at, started_at, finished_at, worker_id, attempt, "
+            "error, summary, (SELECT COUNT(*) FROM jobs AS ahead WHERE ahead.status = ? "
+            "AND ahead.created_at < jobs.created_at) "
+            "FROM jobs WHERE id = ?",
+            (QUEUED, job_id),
+        )
+        if not rows:
+            return None
+
+        (
+            status,
+            created,
+            started,
+            finished,
+            worker_id,
+            attempt,
+            error,
+            summary,
+            ahead,
+        ) = rows[0]
+        return {
+            "id": job_id,
+            "status": status,
+            "created_at": created,
+            "started_at": started,
+            "finished_at": finished,
+            "worker_id": worker_id,
+            "attempt": attempt,
+            "error": error,
+            "summary": json.loads(summary) if summary else None,
+            "queued_ahead": ahead if status == QUEUED else 0,
+        }
+
+    def events(self, job_id: str, after: int = 0) -> List[Tuple[int, Dict]]:
+        """Progress events with a sequence number greater than after."""
+        return [
+            (seq, json.loads(payload))
+            for seq, payload in self._query(
+                "SELECT seq, payload FROM job_events WHERE job_id = ? AND seq > ? "
+                "ORDER BY seq",
+                (job_id, after),
+            )
+        ]
+
+    def artifact(self, job_id: str, name: str) -> Optional[bytes]:
+        rows = self._query(
+            "SELECT data FROM job_artifacts WHERE job_id = ? AND name = ?",
+            (job_id, name),
+        )
+        return bytes(rows[0][0]) if rows else None
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+# Queues running jobs without a recent heartbeat again, then takes the oldest
+# job of the user with the fewest running jobs, like SQLiteJobQueue.claim.
+# KEYS: users with queued jobs, running jobs by heartbeat, all queued jobs by
+# creation time. ARGV: user queue prefix, job key prefix, now, stale cutoff,
+# worker id, queued status, running status.
+REDIS_CLAIM_SCRIPT = """
+local now = ARGV[3]
+for _, job_id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[4])) do
+    local job_key = ARGV[2] .. job_id
+    local job = redis.call('HMGET', job_key, 'user_id', 'created_at')
+    redis.call('ZREM', KEYS[2], job_id)
+    redis.call('HSET', job_key, 'status', ARGV[6])
+    redis.call('HDEL', job_key, 'worker_id')
+    redis.call('ZADD', KEYS[3], job[2], job_id)
+    redis.call('ZADD', ARGV[1] .. job[1], job[2], job_id)
+    redis.call('SADD', KEYS[1], job[1])
+end
+
+local running = {}
+for _, job_id in ipairs(redis.call('ZRANGE', KEYS[2], 0, -1)) do
+    local user = redis.call('HGET', ARGV[2] .. job_id, 'user_id')
+    running[user] = (running[user] or 0) + 1
+end
+
+local best, best_user, best_running, best_created
+for _, user in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    local oldest = redis.call('ZRANGE', ARGV[1] .. user, 0, 0, 'WITHSCORES')
+    if #oldest == 0 then
+        redis.call('SREM', KEYS[1], user)
+    else
+        local count = running[user] or 0
+        local created = tonumber(oldest[2])
+        if best == nil or count < best_running
+            or (count == best_running and created < best_created) then
+            best, best_user, best_running, best_created = oldest[1], user, count, created
+        end
+    end
+end
+if best == nil then
+    return false
+end
+
+redis.call('ZREM', ARGV[1] .. best_user, best)
+redis.call('ZREM', KEYS[3], best)
+if redis.call('ZCARD', ARGV[1] .. best_user) == 0 then
+    redis.call('SREM', KEYS[1], best_user)
+end
+local job_key = ARGV[2] .. best
+redis.call(
+    'HSET', job_key, 'status', ARGV[7], 'worker_id', ARGV[5],
+    'started_at', now, 'heartbeat_at', now
+)
+redis.call('HINCRBY', job_key, 'attempt', 1)
+redis.call('ZADD', KEYS[2], now, best)
+-- A requeued job starts over, so its earlier progress is dropped
+redis.call('DEL', job_key .. ':events')
+return best
+"""
+
+
+class RedisJobQueue:
+    """
+    Job queue with the same interface and claim order as SQLiteJobQueue, stored
+    in Redis.
+
+    Use it when the app and the workers run on different machines. Each user has
+    their own sorted set of queued jobs, and running jobs are kept in a sorted set
+    scored by their last heartbeat so that jobs of a stopped worker are queued
+    again. The keys of a finished job expire after the retention period.
+    Requires the optional redis package.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        prefix: str = "sar-jobs",
+        stale_after: float = STALE_JOB_SECONDS,
+        retention: float = JOB_RETENTION_SECONDS,
+    ):
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError(
+                "The redis package is required for a redis:// JOB_QUEUE_URL"
+            ) from e
+
+        self.redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.stale_after = stale_after
+        self.retention = retention
+        self._users = f"{prefix}:queued-users"
+        self._running = f"{prefix}:running"
+        self._queued = f"{prefix}:queued"
+        self._claim = self.redis.register_script(REDIS_CLAIM_SCRIPT)
+
+    def _key(self, job_id: str, part: str = "") -> str:
+        return f"{self.prefix}:job:{job_id}{part}"
+
+    def _user_queue(self, user_id: str) -> str:
+        return f"{self.prefix}:user-queue:{user_id}"
+
+    def submit(
+        self,
+        user_id: str,
+        subject: str,
+        files: Dict[str, bytes],
+        bundle_id: Optional[str] = None,
+    ) -> str:
+        job_id = uuid.uuid4().hex
+        created_at = time.time()
+        job = {
+            "user_id": user_id,
+            "subject": subject,
+            "status": QUEUED,
+            "created_at": created_at,
+        }
+        if bundle_id:
+            job["bundle_id"] = bundle_id
+        pipe = self.redis.pipeline()
+        pipe.hset(self._key(job_id), mapping=job)
+        pipe.rpush(self._key(job_id, ":file-names"), *files.keys())
+        pipe.hset(self._key(job_id, ":files"), mapping=files)
+        pipe.zadd(self._queued, {job_id: created_at})
+        pipe.zadd(self._user_queue(user_id), {job_id: created_at})
+        pipe.sadd(self._users, user_id)
+        pipe.execute()
+        return job_id
+
+    def claim(self, worker_id: str) -> Optional[Dict]:
+        """
+        Take the next job for a worker, or None when nothing is queued
+
+        Jobs whose worker stopped sending heartbeats are queued again first.
+        """
+        now = time.time()
+        job_id = self._claim(
+            keys=[self._users, self._running, self._queued],
+            args=[
+                self._user_queue(""),
+                self._key(""),
+                now,
+                now - self.stale_after,
+                worker_id,
+                QUEUED,
+                RUNNING,
+            ],
+        )
+        if not job_id:
+            return None
+
+        job_id = job_id.decode()
+        job = self.redis.hgetall(self._key(job_id))
+        file_names = self.redis.lrange(self._key(job_id, ":file-names"), 0, -1)
+        files = self.redis.hgetall(self._key(job_id, ":files"))
+        return {
+            "id": job_id,
+            "user_id": job[b"user_id"].decode(),
+            "subject": job[b"subject"].decode(),
+            "bundle_id": job[b"bundle_id"].decode() if b"bundle_id" in job else None,
+            "files": {name.decode(): files[name] for name in file_names},
+        }
+
+    def _beat(self, pipe, job_id: str) -> None:
+        # Only jobs still running are refreshed, a requeued job stays queued
+        now = time.time()
+        pipe.hset(self._key(job_id), "heartbeat_at", now)
+        pipe.zadd(self._running, {job_id: now}, xx=True)
+
+    def heartbeat(self, job_id: str) -> None:
+        pipe = self.redis.pipeline()
+        self._beat(pipe, job_id)
+        pipe.execute()
+
+    def add_events(self, job_id: str, events: List[Dict]) -> None:
+        pipe = self.redis.pipeline()
+        if events:
+            pipe.rpush(
+                self._key(job_id, ":events"), *[json.dumps(event) for event in events]
+            )
+        self._beat(pipe, job_id)
+        pipe.execute()
+
+    def _end(self, pipe, job_id: str) -> None:
+        # A job requeued after its worker went quiet may still be finished by it
+        user_id = self.redis.hget(self._key(job_id), "user_id")
+        pipe.zrem(self._running, job_id)
+        pipe.zrem(self._queued, job_id)
+        if user_id is not None:
+            pipe.zrem(self._user_queue(user_id.decode()), job_id)
+        # The input files are no longer needed once the job has finished
+        pipe.delete(self._key(job_id, ":files"))
+        for part in ("", ":file-names", ":events", ":artifacts"):
+            pipe.expire(self._key(job_id, part), int(self.retention))
+
+    def finish(self, job_id: str, summary: Dict, artifacts: Dict[str, bytes]) -> None:
+        pipe = self.redis.pipeline()
+        if artifacts:
+            pipe.hset(self._key(job_id, ":artifacts"), mapping=artifacts)
+        pipe.hset(
+            self._key(job_id),
+            mapping={
+                "status": DONE,
+                "finished_at": time.time(),
+                "summary": json.dumps(summary),
+            },
+        )
+        self._end(pipe, job_id)
+        pipe.execute()
+
+    def fail(self, job_id: str, error: str) -> None:
+        pipe = self.redis.pipeline()
+        pipe.hset(
+            self._key(job_id),
+            mapping={"status": FAILED, "finished_at": time.time(), "error": error},
+        )
+        self._end(pipe, job_id)
+        pipe.execute()
+
+    def prune(self) -> int:
+        """Nothing to delete: the keys of finished jobs expire on their own."""
+        return 0
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        """Current state of a job, with the number of queued jobs ahead of it."""
+        job = {
+            key.decode(): value.decode()
+            for key, value in self.redis.hgetall(self._key(job_id)).items()
+        }
+        if not job:
+            return None
+
+        queued_ahead = 0
+        if job["status"] == QUEUED:
+            queued_ahead = self.redis.zcount(
+                self._queued, "-inf", f"({job['created_at']}"
+            )
+        return {
+            "id": job_id,
+            "status": job["status"],
+            "created_at": float(job["created_at"]),
+            "started_at": float(job["started_at"]) if "started_at" in job else None,
+            "finished_at": float(job["finished_at"]) if "finished_at" in job else None,
+            "worker_id": job.get("worker_id"),
+            "attempt": int(job.get("attempt", 0)),
+            "error": job.get("error"),
+            "summary": json.loads(job["summary"]) if "summary" in job else None,
+            "queued_ahead": queued_ahead,
+        }
+
+    def events(self, job_id: str, after: int = 0) -> List[Tuple[int, Dict]]:
+        payloads = self.redis.lrange(self._key(job_id, ":events"), after, -1)
+        return [
+            (seq, json.loads(payload))
+            for seq, payload in enumerate(payloads, after + 1)
+        ]
+
+    def artifact(self, job_id: str, name: str) -> Optional[bytes]:
+        return self.redis.hget(self._key(job_id, ":artifacts"), name)
+
+    def close(self) -> None:
+        self.redis.close()
+
+
+def create_job_queue(url: str = DEFAULT_QUEUE_URL):
+    """
+    Open the job queue named by a URL
+
+    Args:
+        url: "sqlite:///path/to/jobs.db" for a local queue or "redis://host:port/db"
+
+    Returns:
+        SQLiteJobQueue or RedisJobQueue
+    """
+    if url.startswith("sqlite:///"):
+        return SQLiteJobQueue(url[len("sqlite:///") :])
+    if url.startswith(("redis://", "rediss://")):
+        return RedisJobQueue(url)
+    raise ValueError(f"Unsupported job queue URL: {url}")
@@ -0,0 +1,192 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import time
+from typing import Dict
+
+from dotenv import load_dotenv
+
+from src.core.events import serialize_event
+from src.jobs.job_queue import (
+    DEFAULT_QUEUE_URL,
+    PARQUET_ARTIFACT,
+    REPORT_ARTIFACT,
+    create_job_queue,
+)
+
+# Seconds between progress event flushes to the queue
+FLUSH_INTERVAL = 0.5
+
+# Seconds between heartbeats while a stage produces no events
+HEARTBEAT_INTERVAL = 30
+
+# Seconds an idle worker waits before asking the queue again
+POLL_INTERVAL = 1.0
+
+# Seconds between deletions of jobs finished longer ago than their retention
+PRUNE_INTERVAL = 3600
+
+
+def job_summary(result: Dict) -> Dict:
+    return {
+        "aliases": result["aliases"],
+        "total_cost": result["total_cost"],
+        "prompt_tokens": result["prompt_tokens"],
+        "prompt_tokens_cached": result["prompt_tokens_cached"],
+        "cached_prompt_ratio": result["cached_prompt_ratio"],
+        "redactions": len(result["redactions"]),
+        "pronoun_redactions": len(result["pronouns_redaction"]),
+        "reused_analysis": len(result.get("reused_analysis", ())),
+        "reused_files": len(result.get("reused_files", ())),
+        "connection_stats": result.get("connection_stats"),
+        "dedup_stats": result.get("dedup_stats"),
+        "tier_stats": result.get("tier_stats"),
+        "error_stats": result.get("error_stats"),
+        "failed_files": result.get("failed_files"),
+    }
+
+
+async def process_job(queue, job: Dict) -> None:
+    """Run the pipeline for one claimed job, reporting progress to the queue."""
+    # Imported here so starting the workers does not wait for the pipeline stack
+    from src.core.bundle_manifest import BundleManifest, upload_reference
+    from src.core.llm.client import close_loop_connections
+    from src.core.pipeline import run_pipeline
+    from src.utils.download_excel import create_combined_report
+    from src.utils.intial_file_processing import extract_pdf_texts
+    from src.utils.parquet_export import create_parquet_bundle
+
+    job_id = job["id"]
+    key = os.getenv("AZURE_PII_KEY")
+    endpoint = os.getenv("AZURE_PII_ENDPOINT")
+
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            queue.heartbeat(job_id)
+
+    # Resubmitted bundles reuse the outputs of files that did not change, and
+    # the same upload for another subject reuses its document analysis
+    manifest = BundleManifest.for_bundle(
+        job.get("bundle_id") or upload_reference(job["files"])
+    )
+
+    def build_artifacts(result):
+        with create_combined_report(
+            result["pii_results"],
+            result["redactions"],
+            job["subject"],
+            result["context_store"],
+            result["pronouns_redaction"],
+        ) as report_file:
+            # The queue stores each download as one blob
+            return {
+                REPORT_ARTIFACT: report_file.read(),
+                PARQUET_ARTIFACT: create_parquet_bundle(result),
+            }
+
+    # Heartbeats go on until the job is stored as finished, so a long report
+    # build does not get the job handed to another worker
+    heartbeat_task = asyncio.create_task(heartbeat())
+    try:
+        try:
+            documents = await extract_pdf_texts(job["files"], manifest)
+
+            pending = []
+            last_flush = time.monotonic()
+            result = None
+            async for event in run_pipeline(
+                documents, job["subject"], key, endpoint, manifest=manifest
+            ):
+                if event["event"] == "result":
+                    result = event
+                    continue
+
+                pending.append(serialize_event(event))
+                now = time.monotonic()
+                if now - last_flush >= FLUSH_INTERVAL:
+                    queue.add_events(job_id, pending)
+                    pending = []
+                    last_flush = now
+            queue.add_events(job_id, pending)
+        finally:
+            # Every job runs on its own event loop, whose pooled connections end
+            # with it
+            await close_loop_connections()
+
+        # Built and stored in threads, keeping the loop free for heartbeats
+        artifacts = await asyncio.to_thread(build_artifacts, result)
+        await asyncio.to_thread(queue.finish, job_id, job_summary(result), artifacts)
+    finally:
+        heartbeat_task.cancel()
+
+
+def worker_loop(queue_url: str, worker_id: str, poll_interval: float = POLL_INTERVAL):
+    """Claim and run jobs one at a time until the process is stopped."""
+    load_dotenv()
+    queue = create_job_queue(queue_url)
+    print(f"Worker {worker_id} waiting for jobs")
+    last_prune = 0.0
+
+    while True:
+        job = queue.claim(worker_id)
+        if job is None:
+            if time.monotonic() - last_prune >= PRUNE_INTERVAL:
+                pruned = queue.prune()
+                if pruned:
+                    print(f"Worker {worker_id} deleted {pruned} finished jobs")
+                last_prune = time.monotonic()
+            time.sleep(poll_interval)
+            continue
+
+        print(f"Worker {worker_id} running job {job['id']} for {job['user_id']}")
+        started = time.perf_counter()
+        try:
+            asyncio.run(process_job(queue, job))
+            print(
+                f"Worker {worker_id} finished job {job['id']} in "
+                f"{time.perf_counter() - started:.1f}s"
+            )
+        except Exception as e:
+            print(f"Worker {worker_id} failed job {job['id']}: {str(e)}")
+            queue.fail(job["id"], str(e))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run redaction job workers")
+    parser.add_argument(
+        "--workers", type=int, default=2, help="Number of worker processes"
+    )
+    parser.add_argument(
+        "--queue-url",
+        default=os.getenv("JOB_QUEUE_URL", DEFAULT_QUEUE_URL),
+        help="sqlite:///path/to/jobs.db or redis://host:port/db",
+    )
+    args = parser.parse_args()
+
+    processes = [
+        multiprocessing.Process(
+            target=worker_loop,
+            args=(args.queue_url, f"{socket.gethostname()}-{idx}"),
+            # Not daemonic: a job may start the OCR process pool
+            daemon=False,
+        )
+        for idx in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        print("Stopping workers")
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+import re
+from bisect import bisect_right
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import tiktoken
+
+# Encoding used by the gpt-4o family of Azure OpenAI deployments
+TOKEN_ENCODING = "o200k_base"
+
+# Hard token budget for the context of a single LLM item, per entity type
+TOKEN_BUDGETS = {
+    "Person": 400,
+    "PersonType": 400,
+    "Organization": 250,
+    "Address": 250,
+    "Email": 200,
+    "PhoneNumber": 200,
+    "DateTime": 200,
+    "pronouns": 400,
+}
+DEFAULT_TOKEN_BUDGET = 250
+
+# Maximum number of sentences before/after the mention, per entity type
+CONTEXT_SENTENCES = {
+    "Person": (5, 3),
+    "PersonType": (5, 3),
+}
+DEFAULT_CONTEXT_SENTENCES = (2, 2)
+
+_encoding = None
+
+
+def get_encoding():
+    """Load the tiktoken encoding once and reuse it."""
+    global _encoding
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Count the tokens the LLM will see for a piece of text."""
+    return len(get_encoding().encode(text, disallowed_special=()))
+
+
+def split_sentences_with_offsets(text: str) -> List[Tuple[int, int]]:
+    """
+    Split text into sentences at a sentence-ending mark followed by whitespace
+    and a capital letter, returning (start, end) offsets for each sentence
+    """
+    spans = []
+    start = 0
+    for match in re.finditer(r"(?<=[.!?])\s+(?=[A-Z])", text):
+        spans.append((start, match.start()))
+        start = match.end()
+    spans.append((start, len(text)))
+    return spans
+
+
+class ContextBuilder:
+    """
+    Builds token-budgeted context windows around mentions in a single document.
+
+    Sentence offsets and the token counts of sentences with their separators are
+    computed once per document, so growing a window for each mention only costs a
+    few dictionary lookups.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.sentence_spans = split_sentences_with_offsets(text)
+        self._sentence_starts = [start for start, _ in self.sentence_spans]
+        self._span_tokens = {}
+
+    def sentence_index(self, offset: int) -> int:
+        return max(0, bisect_right(self._sentence_starts, offset) - 1)
+
+    def tokens(self, start: int, end: int) -> int:
+        return count_tokens(self.text[start:end])
+
+    def span_tokens(self, start: int, end: int) -> int:
+        if (start, end) not in self._span_tokens:
+            self._span_tokens[start, end] = self.tokens(start, end)
+        return self._span_tokens[start, end]
+
+    def window(
+        self,
+        anchor_start: int,
+        anchor_end: int,
+        token_budget: int,
+        context_before: int,
+        context_after: int,
+    ) -> Tuple[int, int, int, bool]:
+        """
+        Build a window of whole sentences around the anchor span that fits the budget
+
+        Sentences are added alternately before and after the anchor, each with the
+        separator between it and the window, until the sentence limits or the token
+        budget are reached. If the sentences holding the anchor alone exceed the
+        budget, the window is trimmed token-wise around it. The token count returned
+        is that of the final window text.
+
+        Returns:
+            tuple: (start offset, end offset, token count, whether it was trimmed)
+        """
+        spans = self.sentence_spans
+        first = self.sentence_index(anchor_start)
+        last = self.sentence_index(max(anchor_start, anchor_end - 1))
+        used = self.span_tokens(spans[first][0], spans[last][1])
+
+        if used > token_budget:
+            start, end = self.trim(
+                spans[first][0], spans[last][1], anchor_start, anchor_end, token_budget
+            )
+            return start, end, self.tokens(start, end), True
+
+        before = after = 0
+        trimmed = False
+        growing = True
+        while growing:
+            growing = False
+            if before < context_before and first - 1 >= 0:
+                tokens = self.span_tokens(spans[first - 1][0], spans[first][0])
+                if used + tokens <= token_budget:
+                    first -= 1
+                    before += 1
+                    used += tokens
+                    growing = True
+                else:
+                    trimmed = True
+                    context_before = before
+            if after < context_after and last + 1 < len(self.sentence_spans):
+                tokens = self.span_tokens(spans[last][1], spans[last + 1][1])
+                if used + tokens <= token_budget:
+                    last += 1
+                    after += 1
+                    used += tokens
+                    growing = True
+                else:
+                    trimmed = True
+                    context_after = after
+
+        start, end = spans[first][0], spans[last][1]
+        used = self.tokens(start, end)
+        # Tokens can merge across the joins, rarely making the whole longer than
+        # its parts
+        if used > token_budget:
+            start, end = self.trim(start, end, anchor_start, anchor_end, token_budget)
+            return start, end, self.tokens(start, end), True
+        return start, end, used, trimmed
+
+    def trim(
+        self,
+        start: int,
+        end: int,
+        anchor_start: int,
+        anchor_end: int,
+        token_budget: int,
+    ) -> Tuple[int, int]:
+        """Cut the text between start and end to the budget, centred on the anchor."""
+        encoding = get_encoding()
+        anchor_tokens = encoding.encode(
+            self.text[anchor_start:anchor_end], disallowed_special=()
+        )
+        if len(anchor_tokens) >= token_budget:
+            kept = encoding.decode_bytes(anchor_tokens[:token_budget])
+            return anchor_start, anchor_start + len(
+                kept.decode("utf-8", errors="ignore")
+            )
+
+        remaining = token_budget - len(anchor_tokens)
+        before_tokens = encoding.encode(
+            self.text[start:anchor_start], disallowed_special=()
+        )
+        after_tokens = encoding.encode(self.text[anchor_end:end], disallowed_special=())
+
+        before_count = min(len(before_tokens), remaining // 2)
+        after_count = min(len(after_tokens), remaining - before_count)
+        before_count = min(len(before_tokens), remaining - after_count)
+
+        kept_before = encoding.decode_bytes(
+            before_tokens[len(before_tokens) - before_count :]
+        ).decode("utf-8", errors="ignore")
+        kept_after = encoding.decode_bytes(after_tokens[:after_count]).decode(
+            "utf-8", errors="ignore"
+        )
+        return anchor_start - len(kept_before), anchor_end + len(kept_after)
+
+
+class PayloadStats:
+    """Collects context payload sizes per entity type so windows can be tuned."""
+
+    def __init__(self):
+        self._stats = defaultdict(
+            lambda: {
+                "items": 0,
+                "tokens": 0,
+                "max_tokens": 0,
+                "trimmed": 0,
+                "missing": 0,
+            }
+        )
+
+    def record(self, entity_type: str, tokens: int, trimmed: bool = False):
+        stats = self._stats[entity_type]
+        stats["items"] += 1
+        stats["tokens"] += tokens
+        stats["max_tokens"] = max(stats["max_tokens"], tokens)
+        stats["trimmed"] += int(trimmed)
+
+    def record_missing(self, entity_type: str):
+        self._stats[entity_type]["missing"] += 1
+
+    def summary(self) -> Dict[str, Dict]:
+        return {
+            entity_type: {
+                **stats,
+                "mean_tokens": round(stats["tokens"] / stats["items"], 1)
+                if stats["items"]
+                else 0,
+            }
+            for entity_type, stats in self._stats.items()
+        }
+
+    def log(self, label: str = "Context payloads"):
+        for entity_type, stats in self.summary().items():
+            print(
+                f"{label} [{entity_type}]: items={stats['items']} "
+                f"tokens={stats['tokens']} mean={stats['mean_tokens']} "
+                f"max={stats['max_tokens']} trimmed={stats['trimmed']} "
+                f"missing={stats['missing']}"
+            )
+
+
+def token_budget_for(entity_type: str, token_budgets: Optional[Dict] = None) -> int:
+    budgets = token_budgets or TOKEN_BUDGETS
+    return budgets.get(entity_type, DEFAULT_TOKEN_BUDGET)
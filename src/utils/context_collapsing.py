@@ -0,0 +1,88 @@
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+from src.core.records import ContextStore, Mention, MentionGroup
+from src.utils.context_budget import count_tokens, token_budget_for
+
+# Share of a window that must overlap the current group for it to be merged
+MIN_WINDOW_OVERLAP = 0.6
+
+# Upper bound on target entities carried by a single request
+MAX_GROUP_TARGETS = 8
+
+
+def _single(mention: Mention) -> MentionGroup:
+    return MentionGroup(
+        file_name=mention.file_name,
+        entity_type=mention.entity_type,
+        context_id=mention.context_id,
+        start=mention.start,
+        end=mention.end,
+        mentions=(mention,),
+    )
+
+
+def collapse_mentions(
+    mentions: Iterable[Mention],
+    context_store: ContextStore,
+    min_overlap: float = MIN_WINDOW_OVERLAP,
+    max_targets: int = MAX_GROUP_TARGETS,
+    token_budgets: Optional[Dict] = None,
+) -> List[MentionGroup]:
+    """
+    Merge mentions whose context windows are near duplicates into shared requests
+
+    Windows of the same file and entity type are merged by interval merging on
+    their document offsets: a window joins the current group when at least
+    min_overlap of it is already covered by the group and the merged context
+    stays within the entity type's token budget, the same limit as a single
+    context; otherwise the group is closed and the window starts a new one.
+    Merged contexts are stitched from the overlapping window texts and added
+    to the context store.
+
+    Returns:
+        list: One MentionGroup per request, single mentions keep their own context
+    """
+    by_type = defaultdict(list)
+    for mention in mentions:
+        by_type[(mention.file_name, mention.entity_type)].append(mention)
+
+    groups = []
+
+    def close(group, context):
+        # Merged contexts are new text, so they get their own context id
+        if len(group.mentions) > 1:
+            group = group._replace(context_id=context_store.add(context))
+        groups.append(group)
+
+    for (_, entity_type), type_mentions in by_type.items():
+        max_tokens = token_budget_for(entity_type, token_budgets)
+        current = None
+        current_context = ""
+
+        for mention in sorted(type_mentions, key=lambda item: (item.start, item.end)):
+            context = context_store.get(mention.context_id)
+            if current is not None and len(current.mentions) < max_targets:
+                covered = min(current.end, mention.end) - mention.start
+                length = max(mention.end - mention.start, 1)
+                if covered / length >= min_overlap:
+                    merged_context = current_context
+                    if mention.end > current.end:
+                        merged_context += context[current.end - mention.start :]
+                    if count_tokens(merged_context) <= max_tokens:
+                        current = current._replace(
+                            end=max(current.end, mention.end),
+                            mentions=current.mentions + (mention,),
+                        )
+                        current_context = merged_context
+                        continue
+
+            if current is not None:
+                close(current, current_context)
+            current = _single(mention)
+            current_context = context
+
+        if current is not None:
+            close(current, current_context)
+
+    return groups
@@ -1,114 +1,226 @@
-import pandas as pd
-from io import BytesIO
+import re
+import tempfile
 from datetime import datetime
+from itertools import chain
 
+import xlsxwriter
+from src.utils.report_styles import ColumnWidths, ReportStyles, apply_banding
 
-def create_combined_report(pii_data, redactions_data, subject, pronouns_redaction=None):
+# Reports are built in memory up to this size and spill to a temporary file beyond it
+SPILL_THRESHOLD_BYTES = 32 * 1024 * 1024
+
+# Characters Excel does not allow in sheet names
+INVALID_SHEET_CHARS = re.compile(r"[\[\]:*?/\\]")
+
+
+def truncate_context(context, limit=200):
+    return context[:limit] + "..." if len(context) > limit else context
+
+
+def summary_rows(pii_data, redactions_data, subject, pronouns_redaction):
+    total_pronoun_redactions = len(pronouns_redaction) if pronouns_redaction else 0
+
+    yield ("Analysis Date", datetime.now().strftime("%Y-%m-%d %H:%M"))
+    yield ("Subject", subject)
+    yield ("Number of Files Analyzed", len(pii_data))
+    yield (
+        "Total Entities Detected",
+        sum(len(file_data["categories"].get("Person", [])) for file_data in pii_data),
+    )
+    yield ("Total Entity Redactions", len(redactions_data))
+    yield ("Total Pronoun Redactions", total_pronoun_redactions)
+
+
+def entity_rows(categories):
+    for entities in categories.values():
+        for entity in entities:
+            yield (entity.category, entity.text, entity.confidence_score)
+
+
+def redaction_rows(redactions_data, context_store):
+    for item in redactions_data:
+        yield (
+            item.target,
+            ", ".join(item.redacted_text),
+            item.reason,
+            truncate_context(context_store.get(item.context_id)),
+        )
+
+
+def pronoun_rows(pronouns_redaction, context_store):
+    for item in pronouns_redaction:
+        yield (
+            item.target,
+            item.category,
+            ", ".join(item.redacted_text),
+            item.reason,
+            truncate_context(context_store.get(item.context_id)),
+        )
+
+
+class SheetNamer:
+    """Produces valid, unique Excel sheet names (31 chars, no reserved characters)."""
+
+    def __init__(self):
+        self._used = set()
+
+    def __call__(self, name):
+        base = INVALID_SHEET_CHARS.sub("_", name)[:31]
+        candidate = base
+        suffix = 1
+        while candidate.lower() in self._used:
+            tag = f"~{suffix}"
+            candidate = base[: 31 - len(tag)] + tag
+            suffix += 1
+        self._used.add(candidate.lower())
+        return candidate
+
+
+def write_sheet(workbook, sheet_name, headers, rows, styles):
     """
-    Create a single comprehensive Excel report containing PII entities, redactions, and pronoun redactions
+    Write a sheet row by row straight from an iterator
+
+    The sheet is only created once the first row is available, so empty sheets are
+    skipped without materialising the rows. Column widths are measured while the
+    rows stream past and banding is one conditional format over the written range.
+
+    Returns:
+        int: Number of data rows written
+    """
+    rows = iter(rows)
+    first_row = next(rows, None)
+    if first_row is None:
+        return 0
+
+    worksheet = workbook.add_worksheet(sheet_name)
+    worksheet.write_row(0, 0, headers, styles["header"])
+
+    widths = ColumnWidths(headers)
+    row_count = 0
+    for row_count, row in enumerate(chain([first_row], rows), 1):
+        worksheet.write_row(row_count, 0, row)
+        widths.update(row)
+
+    widths.apply(worksheet)
+    apply_banding(worksheet, styles, last_row=row_count, last_col=len(headers) - 1)
+    return row_count
+
+
+def write_combined_report(
+    output, pii_data, redactions_data, subject, context_store, pronouns_redaction=None
+):
+    """
+    Stream the comprehensive report into an Excel workbook
+
+    Rows are generated lazily from the results and written with xlsxwriter's
+    constant_memory mode, which flushes each row to disk as soon as the next one
+    starts, so memory use does not grow with the number of rows.
 
     Args:
+        output: File path or binary file object to write the workbook to
         pii_data: List of dictionaries containing PII entities
         redactions_data: List of redaction results
         subject: String containing the subject name
+        context_store: ContextStore the redactions' context ids refer to
         pronouns_redaction: List of pronoun redaction results (optional)
     """
-    excel_buffer = BytesIO()
+    workbook = xlsxwriter.Workbook(output, {"constant_memory": True})
+    styles = ReportStyles(workbook)
+    sheet_name = SheetNamer()
 
-    with pd.ExcelWriter(excel_buffer, engine="openpyxl") as writer:
+    try:
         # Create summary sheet
-        total_pronoun_redactions = len(pronouns_redaction) if pronouns_redaction else 0
-
-        summary_data = {
-            "Report Information": [
-                "Analysis Date",
-                "Subject",
-                "Number of Files Analyzed",
-                "Total Entities Detected",
-                "Total Entity Redactions",
-                "Total Pronoun Redactions",
-            ],
-            "Details": [
-                datetime.now().strftime("%Y-%m-%d %H:%M"),
-                subject,
-                len(pii_data),
-                sum(
-                    len(file_data["categories"].get("Person", []))
-                    for file_data in pii_data
-                ),
-                len(redactions_data),
-                total_pronoun_redactions,
-            ],
-        }
-        pd.DataFrame(summary_data).to_excel(writer, sheet_name="Summary", index=False)
+        write_sheet(
+            workbook,
+            sheet_name("Summary"),
+            ["Report Information", "Details"],
+            summary_rows(pii_data, redactions_data, subject, pronouns_redaction),
+            styles,
+        )
 
         # Add PII Entities sheets (organized by file and category)
         for file_data in pii_data:
-            file_name = file_data["file_name"]
-            categories = file_data["categories"]
-
-            # Create consolidated sheet for each file
-            file_entities = []
-            for category, entities in categories.items():
-                for entity in entities:
-                    entity_data = {
-                        "Category": category,
-                        "Entity": entity["text"],
-                        "Confidence": entity["confidence_score"],
-                    }
-                    file_entities.append(entity_data)
-
-            if file_entities:
-                df = pd.DataFrame(file_entities)
-                sheet_name = f"{file_name[:27]}_Entities"[:31]  # Excel sheet name limit
-                df.to_excel(writer, sheet_name=sheet_name, index=False)
-
-        # Add Entity Redactions sheet
-        redactions_formatted = []
-        for item in redactions_data:
-            redactions_formatted.append(
-                {
-                    "Original Entity": item["Entity"],
-                    "Redaction Text": ", ".join(item["Redaction_text"]),
-                    "Redaction Reason": item["redaction_reason"],
-                    "Source Context": item["corpus"][:200] + "..."
-                    if len(item["corpus"]) > 200
-                    else item["corpus"],
-                }
+            write_sheet(
+                workbook,
+                sheet_name(f"{file_data['file_name'][:27]}_Entities"),
+                ["Category", "Entity", "Confidence"],
+                entity_rows(file_data["categories"]),
+                styles,
             )
 
-        if redactions_formatted:
-            pd.DataFrame(redactions_formatted).to_excel(
-                writer, sheet_name="Entity_Redactions", index=False
-            )
+        # Add Entity Redactions sheet
+        write_sheet(
+            workbook,
+            sheet_name("Entity_Redactions"),
+            ["Original Entity", "Redaction Text", "Redaction Reason", "Source Context"],
+            redaction_rows(redactions_data, context_store),
+            styles,
+        )
 
         # Add Pronoun Redactions sheet
         if pronouns_redaction:
-            pronouns_formatted = []
-            for item in pronouns_redaction:
-                # Handle cases where Redacted_text is a list
-                redacted_text = (
-                    ", ".join(item["Redacted_text"])
-                    if isinstance(item["Redacted_text"], list)
-                    else item["Redacted_text"]
-                )
-
-                pronouns_formatted.append(
-                    {
-                        "Pronoun": item["pronoun"],
-                        "POS Category": item["pos_category"],
-                        "Redacted Text": redacted_text,
-                        "Redaction Reason": item["redaction_reason"],
-                        "Source Context": item["corpus"][:200] + "..."
-                        if len(item["corpus"]) > 200
-                        else item["corpus"],
-                    }
-                )
-
-            if pronouns_formatted:
-                pd.DataFrame(pronouns_formatted).to_excel(
-                    writer, sheet_name="Pronoun_Redactions", index=False
-                )
-
-    excel_buffer.seek(0)
-    return excel_buffer.getvalue()
+            write_sheet(
+                workbook,
+                sheet_name("Pronoun_Redactions"),
+                [
+                    "Pronoun",
+                    "POS Category",
+                    "Redacted Text",
+                    "Redaction Reason",
+                    "Source Context",
+                ],
+                pronoun_rows(pronouns_redaction, context_store),
+                styles,
+            )
+    finally:
+        workbook.close()
+
+
+def spool_combined_report(
+    pii_data,
+    redactions_data,
+    subject,
+    context_store,
+    pronouns_redaction=None,
+    spill_threshold=SPILL_THRESHOLD_BYTES,
+):
+    """
+    Write the report into a spooled file that stays in memory for small reports and
+    moves to a temporary file on disk once it grows past spill_threshold bytes
+
+    Returns:
+        SpooledTemporaryFile: The finished workbook, rewound to the start
+    """
+    report_file = tempfile.SpooledTemporaryFile(max_size=spill_threshold)
+    write_combined_report(
+        report_file,
+        pii_data,
+        redactions_data,
+        subject,
+        context_store,
+        pronouns_redaction,
+    )
+    report_file.seek(0)
+    return report_file
+
+
+def create_combined_report(
+    pii_data, redactions_data, subject, context_store, pronouns_redaction=None
+):
+    """
+    Create a single comprehensive Excel report containing PII entities, redactions, and pronoun redactions
+
+    Args:
+        pii_data: List of dictionaries containing PII entities
+        redactions_data: List of redaction results
+        subject: String containing the subject name
+        context_store: ContextStore the redactions' context ids refer to
+        pronouns_redaction: List of pronoun redaction results (optional)
+
+    Returns:
+        SpooledTemporaryFile: The workbook rewound to the start, for the caller to
+            stream and close, see spool_combined_report
+    """
+    return spool_combined_report(
+        pii_data, redactions_data, subject, context_store, pronouns_redaction
+    )
@@ -1,81 +1,65 @@
-import pandas as pd
 from io import BytesIO
 import aiofiles
 import asyncio
-import pdfplumber
 from pathlib import Path
 from typing import Dict
 import shutil
 import streamlit as st
-
-
-async def create_pii_excel(pii_results):
-    """Create a formatted Excel file from PII results."""
-    records = []
-
+import xlsxwriter
+from src.core.bundle_manifest import content_hash
+from src.utils.ocr import ocr_pages, read_pdf_pages
+from src.utils.report_styles import (
+    ColumnWidths,
+    ReportStyles,
+    apply_banding,
+    set_column_formats,
+)
+
+
+def pii_records(pii_results):
+    """Yield one (file, category, text, confidence) row per detected entity."""
     for result in pii_results:
-        file_name = result["file_name"]
-        categories = result["categories"]
-
-        for category, entities in categories.items():
+        for entities in result["categories"].values():
             for entity in entities:
-                records.append(
-                    {
-                        "File Name": file_name,
-                        "Category": category,
-                        "Detected Text": entity["text"],
-                        "Confidence Score": f"{entity['confidence_score']:.2%}",
-                    }
+                yield (
+                    entity.file_name,
+                    entity.category,
+                    entity.text,
+                    entity.confidence_score,
                 )
 
-    df = pd.DataFrame(records)
+
+async def create_pii_excel(pii_results):
+    """Create a formatted Excel file from PII results."""
+    headers = ["File Name", "Category", "Detected Text", "Confidence Score"]
 
     # Create Excel file in memory
     output = BytesIO()
-    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-        df.to_excel(writer, index=False, sheet_name="PII Detection Results")
-
-        workbook = writer.book
-        worksheet = writer.sheets["PII Detection Results"]
-
-        # Add formatting
-        header_format = workbook.add_format(
-            {
-                "bold": True,
-                "bg_color": "#4B0082",  # Dark purple background
-                "font_color": "white",
-                "border": 1,
-                "align": "center",
-            }
-        )
-
-        # Center align format for cells
-        center_format = workbook.add_format({"align": "center"})
-
-        # Percentage format for confidence scores
-        percent_format = workbook.add_format({"num_format": "0.00%", "align": "center"})
-
-        # Apply formats to columns
-        for col_num, column in enumerate(df.columns):
-            worksheet.write(0, col_num, column, header_format)
-
-            # Set column width based on content
-            max_length = max(df[column].astype(str).apply(len).max(), len(column))
-            worksheet.set_column(col_num, col_num, max_length + 3)
-
-            # Apply center alignment to all cells in the column
-            if column == "Confidence Score":
-                worksheet.set_column(col_num, col_num, max_length + 3, percent_format)
-            else:
-                worksheet.set_column(col_num, col_num, max_length + 3, center_format)
-
-        # Add alternating row colors
-        for row_num in range(1, len(df) + 1):
-            if row_num % 2 == 0:
-                worksheet.set_row(
-                    row_num, None, workbook.add_format({"bg_color": "#F0F0F0"})
-                )
-
+    workbook = xlsxwriter.Workbook(output, {"in_memory": True})
+    worksheet = workbook.add_worksheet("PII Detection Results")
+    styles = ReportStyles(workbook)
+
+    # Shared formats: center alignment, percentages for confidence scores
+    column_formats = {
+        col_num: styles["percent"] if column == "Confidence Score" else styles["center"]
+        for col_num, column in enumerate(headers)
+    }
+    set_column_formats(worksheet, column_formats)
+    worksheet.write_row(0, 0, headers, styles["header"])
+
+    # Write rows and measure column widths in the same pass
+    widths = ColumnWidths(headers)
+    row_num = 0
+    for row_num, record in enumerate(pii_records(pii_results), 1):
+        worksheet.write_row(row_num, 0, record)
+        widths.update((record[0], record[1], record[2], f"{record[3]:.2%}"))
+
+    widths.apply(worksheet, column_formats)
+
+    # Add alternating row colors with one conditional format for the whole range
+    apply_banding(worksheet, styles, last_row=row_num, last_col=len(headers) - 1)
+
+    workbook.close()
     return output.getvalue()
 
 
@@ -88,17 +72,11 @@ async def create_upload_dir():
 
 
 async def process_pdf(pdf_path: Path) -> str:
-    """Extract text from PDF using pdfplumber asynchronously."""
+    """Extract text from PDF using pdfplumber asynchronously, with OCR for scans."""
     loop = asyncio.get_running_loop()
-    try:
-
-        def extract_text():
-            with pdfplumber.open(pdf_path) as pdf:
-                return "\n\n".join(page.extract_text() for page in pdf.pages)
-
-        return await loop.run_in_executor(None, extract_text)
-    except Exception as e:
-        return f"Error processing PDF: {str(e)}"
+    data = await loop.run_in_executor(None, pdf_path.read_bytes)
+    texts = await extract_pdf_texts({pdf_path.name: data})
+    return texts[pdf_path.name]
 
 
 async def cleanup_files(directory: Path):
@@ -151,3 +129,64 @@ async def process_uploaded_files(uploaded_files) -> Dict[str, str]:
             await cleanup_files(upload_dir)
 
     return results
+
+
+async def extract_pdf_texts(files: Dict[str, bytes], manifest=None) -> Dict[str, str]:
+    """
+    Extract text from PDFs held in memory, keyed by file name, without saving them
+
+    Pages without a text layer are sent to OCR, all scanned pages of all files
+    together so they are recognised in parallel. With a BundleManifest, files
+    whose bytes were extracted before are taken from it and only new or changed
+    files are parsed.
+    """
+    loop = asyncio.get_running_loop()
+
+    def read_pdf(data):
+        try:
+            return read_pdf_pages(data), None
+        except Exception as e:
+            return None, f"Error processing PDF: {str(e)}"
+
+    results = {}
+    source_hashes = {}
+    if manifest is not None:
+        for file_name, data in files.items():
+            source_hashes[file_name] = content_hash(data)
+            text = manifest.cached_text(file_name, source_hashes[file_name])
+            if text is not None:
+                results[file_name] = text
+
+    pending = [file_name for file_name in files if file_name not in results]
+    contents = await asyncio.gather(
+        *[
+            loop.run_in_executor(None, read_pdf, files[file_name])
+            for file_name in pending
+        ]
+    )
+
+    page_texts = {}
+    scanned = []
+    for file_name, (pages, error) in zip(pending, contents):
+        if pages is None:
+            results[file_name] = error
+            continue
+        page_texts[file_name], images = pages
+        scanned.extend((file_name, number, image) for number, image in images.items())
+
+    ocr_texts = await ocr_pages([image for _, _, image in scanned])
+    unrecognised = set()
+    for (file_name, number, _), text in zip(scanned, ocr_texts):
+        if text is None:
+            unrecognised.add(file_name)
+            continue
+        page_texts[file_name][number] = text
+
+    for file_name, texts in page_texts.items():
+        results[file_name] = "\n\n".join(texts)
+        # Files with pages OCR could not read are extracted again next time
+        if manifest is not None and file_name not in unrecognised:
+            manifest.store_text(file_name, source_hashes[file_name], results[file_name])
+
+    # Keep the upload order
+    return {file_name: results[file_name] for file_name in files}
@@ -0,0 +1,159 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+
+import pdfplumber
+
+from src.core.bundle_manifest import content_hash
+
+# Processes running Tesseract, one page per task
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+
+# Resolution pages are rendered at before OCR, and the Tesseract language
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+OCR_LANGUAGE = os.getenv("OCR_LANGUAGE", "eng")
+
+# Directory holding the OCR text of every page image seen so far
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", "ocr_cache")
+
+# A page with an image and less text than this is treated as a scan
+MIN_PAGE_TEXT_CHARS = 20
+
+
+def needs_ocr(page, text: str) -> bool:
+    """Classify a page as scanned: it carries images but (almost) no text layer."""
+    return len(text.strip()) < MIN_PAGE_TEXT_CHARS and bool(page.images)
+
+
+def render_page(page) -> bytes:
+    """Render a page to PNG bytes for OCR."""
+    buffer = BytesIO()
+    page.to_image(resolution=OCR_DPI).original.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def read_pdf_pages(data: bytes) -> Tuple[List[str], Dict[int, bytes]]:
+    """
+    Extract the text layer of every page of a PDF
+
+    Returns:
+        tuple: (text of each page, "" when it has none, and {page index: PNG
+            image} for the pages classified as scanned)
+    """
+    texts = []
+    images = {}
+    with pdfplumber.open(BytesIO(data)) as pdf:
+        for number, page in enumerate(pdf.pages):
+            text = page.extract_text() or ""
+            if needs_ocr(page, text):
+                images[number] = render_page(page)
+            texts.append(text)
+    return texts, images
+
+
+def ocr_image(image: bytes, language: str = OCR_LANGUAGE) -> str:
+    """Run Tesseract on one page image, inside an OCR pool process."""
+    import pytesseract
+    from PIL import Image
+
+    return pytesseract.image_to_string(Image.open(BytesIO(image)), lang=language)
+
+
+@lru_cache(maxsize=None)
+def ocr_available() -> bool:
+    """Whether pytesseract and the tesseract binary are installed, checked once."""
+    try:
+        import pytesseract
+
+        pytesseract.get_tesseract_version()
+    except Exception as e:
+        print(f"OCR unavailable, scanned pages are left empty: {str(e)}")
+        return False
+    return True
+
+
+@lru_cache(maxsize=None)
+def get_ocr_pool() -> ProcessPoolExecutor:
+    """Process pool for OCR, created on first use and kept for the process."""
+    return ProcessPoolExecutor(max_workers=OCR_WORKERS)
+
+
+class OcrCache:
+    """OCR text of page images on disk, one file per image hash."""
+
+    def __init__(self, directory: str = OCR_CACHE_DIR):
+        self.directory = directory
+
+    def _path(self, image_hash: str) -> str:
+        return os.path.join(self.directory, f"{image_hash}.txt")
+
+    def get(self, image_hash: str) -> Optional[str]:
+        try:
+            with open(self._path(image_hash), encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, image_hash: str, text: str) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(image_hash)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(temp_path, path)
+
+
+async def ocr_pages(images: List[bytes], cache: Optional[OcrCache] = None) -> List[str]:
+    """
+    OCR page images in parallel, one page per task in the OCR process pool
+
+    Pages whose image was recognised before are taken from the cache and
+    identical images are recognised once.
+
+    Returns:
+        list: Text of each page, in the order of images, None for pages that
+            could not be recognised
+    """
+    if not images:
+        return []
+
+    cache = cache or OcrCache()
+    started = time.perf_counter()
+    hashes = [content_hash(image) for image in images]
+    texts = {image_hash: cache.get(image_hash) for image_hash in hashes}
+    pending = {
+        image_hash: image
+        for image_hash, image in zip(hashes, images)
+        if texts[image_hash] is None
+    }
+
+    recognised = 0
+    if pending and ocr_available():
+        loop = asyncio.get_running_loop()
+        pool = get_ocr_pool()
+        results = await asyncio.gather(
+            *[
+                loop.run_in_executor(pool, ocr_image, image)
+                for image in pending.values()
+            ],
+            return_exceptions=True,
+        )
+        for image_hash, result in zip(pending, results):
+            if isinstance(result, Exception):
+                print(f"Error running OCR on a page: {str(result)}")
+                continue
+            texts[image_hash] = result
+            cache.put(image_hash, result)
+            recognised += 1
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"OCR: {len(images)} scanned pages, {len(images) - len(pending)} cached, "
+        f"{recognised} recognised in {elapsed:.2f}s "
+        f"({len(images) / max(elapsed, 1e-9):.1f} pages/sec)"
+    )
+    return [texts[image_hash] for image_hash in hashes]
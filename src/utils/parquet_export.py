@@ -0,0 +1,193 @@
+import io
+import zipfile
+from pathlib import Path
+from typing import Dict
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Low-cardinality text columns stored dictionary-encoded
+DICTIONARY_STRING = pa.dictionary(pa.int32(), pa.string())
+
+SCHEMAS = {
+    "entities": pa.schema(
+        [
+            ("file_name", DICTIONARY_STRING),
+            ("category", DICTIONARY_STRING),
+            ("text", pa.string()),
+            ("confidence_score", pa.float64()),
+            ("offset", pa.int64()),
+            ("length", pa.int64()),
+        ]
+    ),
+    "contexts": pa.schema(
+        [
+            ("file_name", DICTIONARY_STRING),
+            ("category", DICTIONARY_STRING),
+            ("entity_text", pa.string()),
+            ("start", pa.int64()),
+            ("end", pa.int64()),
+            ("context", pa.string()),
+        ]
+    ),
+    "redactions": pa.schema(
+        [
+            ("file_name", DICTIONARY_STRING),
+            ("entity", pa.string()),
+            ("redacted_text", pa.list_(pa.string())),
+            ("redaction_reason", pa.string()),
+            ("corpus", pa.string()),
+        ]
+    ),
+    "pronouns": pa.schema(
+        [
+            ("file_name", DICTIONARY_STRING),
+            ("pronoun", pa.string()),
+            ("category", DICTIONARY_STRING),
+            ("redacted_text", pa.list_(pa.string())),
+            ("redaction_reason", pa.string()),
+            ("corpus", pa.string()),
+        ]
+    ),
+    "aliases": pa.schema(
+        [
+            ("file_name", DICTIONARY_STRING),
+            ("alias", pa.string()),
+        ]
+    ),
+    "stage_metrics": pa.schema(
+        [
+            ("stage", DICTIONARY_STRING),
+            ("elapsed_seconds", pa.float64()),
+            ("items", pa.int64()),
+        ]
+    ),
+}
+
+
+def entity_records(pii_results):
+    for result in pii_results:
+        for entities in result["categories"].values():
+            for entity in entities:
+                yield entity._asdict()
+
+
+def context_records(contexts, context_store):
+    for item in contexts:
+        yield {
+            "file_name": item.file_name,
+            "category": item.entity_type,
+            "entity_text": item.entity_text,
+            "start": item.start,
+            "end": item.end,
+            "context": context_store.get(item.context_id),
+        }
+
+
+def redaction_records(redactions, context_store):
+    for item in redactions:
+        yield {
+            "file_name": item.file_name,
+            "entity": item.target,
+            "redacted_text": list(item.redacted_text),
+            "redaction_reason": item.reason,
+            "corpus": context_store.get(item.context_id),
+        }
+
+
+def pronoun_records(pronouns_redaction, context_store):
+    for item in pronouns_redaction:
+        yield {
+            "file_name": item.file_name,
+            "pronoun": item.target,
+            "category": item.category,
+            "redacted_text": list(item.redacted_text),
+            "redaction_reason": item.reason,
+            "corpus": context_store.get(item.context_id),
+        }
+
+
+def alias_records(files_alias):
+    for file_name, aliases in files_alias.items():
+        for alias in aliases:
+            yield {"file_name": file_name, "alias": alias}
+
+
+def stage_metric_records(stage_metrics):
+    for metric in stage_metrics:
+        yield {
+            "stage": metric["stage"],
+            "elapsed_seconds": metric["elapsed"],
+            "items": metric.get("total"),
+        }
+
+
+def build_table(name: str, records) -> pa.Table:
+    """Collect records column by column into an Arrow table with the table's schema."""
+    schema = SCHEMAS[name]
+    columns = {field.name: [] for field in schema}
+    for record in records:
+        for column, values in columns.items():
+            values.append(record[column])
+    return pa.Table.from_pydict(columns, schema=schema)
+
+
+def build_tables(result: Dict) -> Dict[str, pa.Table]:
+    """
+    Build every export table from a finished pipeline result
+
+    Args:
+        result: The "result" event produced by run_pipeline
+
+    Returns:
+        dict: Table name mapped to its Arrow table
+    """
+    context_store = result["context_store"]
+    return {
+        "entities": build_table("entities", entity_records(result["pii_results"])),
+        "contexts": build_table(
+            "contexts", context_records(result["contexts"], context_store)
+        ),
+        "redactions": build_table(
+            "redactions", redaction_records(result["redactions"], context_store)
+        ),
+        "pronouns": build_table(
+            "pronouns", pronoun_records(result["pronouns_redaction"], context_store)
+        ),
+        "aliases": build_table("aliases", alias_records(result["files_alias"])),
+        "stage_metrics": build_table(
+            "stage_metrics", stage_metric_records(result["stage_metrics"])
+        ),
+    }
+
+
+def export_results_parquet(result: Dict, output_dir) -> Dict[str, Path]:
+    """
+    Write one Parquet file per table into output_dir
+
+    Files are zstd-compressed with dictionary encoding, so they can be queried with
+    DuckDB or pandas column by column without loading the whole export.
+
+    Returns:
+        dict: Table name mapped to the written file path
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    paths = {}
+    for name, table in build_tables(result).items():
+        path = output_dir / f"{name}.parquet"
+        pq.write_table(table, path, compression="zstd")
+        paths[name] = path
+    return paths
+
+
+def create_parquet_bundle(result: Dict) -> bytes:
+    """Zip the Parquet tables of a pipeline result for download."""
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_STORED) as bundle:
+        for name, table in build_tables(result).items():
+            table_buffer = io.BytesIO()
+            pq.write_table(table, table_buffer, compression="zstd")
+            bundle.writestr(f"{name}.parquet", table_buffer.getvalue())
+    return zip_buffer.getvalue()
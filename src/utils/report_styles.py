@@ -0,0 +1,77 @@
+# Cell formats shared by every report, keyed by name
+STYLES = {
+    "header": {
+        "bold": True,
+        "bg_color": "#4B0082",  # Dark purple background
+        "font_color": "white",
+        "border": 1,
+        "align": "center",
+    },
+    "center": {"align": "center"},
+    "percent": {"num_format": "0.00%", "align": "center"},
+    "band": {"bg_color": "#F0F0F0"},
+}
+
+# Columns never grow wider than this, however long their content
+MAX_COLUMN_WIDTH = 80
+
+
+class ReportStyles:
+    """
+    Creates each cell format once per workbook and hands out the shared object.
+
+    xlsxwriter stores one entry per add_format call, so creating formats inside
+    row loops bloats the file; going through this class keeps one per style.
+    """
+
+    def __init__(self, workbook):
+        self.workbook = workbook
+        self._formats = {}
+
+    def __getitem__(self, name):
+        if name not in self._formats:
+            self._formats[name] = self.workbook.add_format(STYLES[name])
+        return self._formats[name]
+
+
+class ColumnWidths:
+    """Tracks the widest value per column while rows are written, in a single pass."""
+
+    def __init__(self, headers):
+        self.widths = [len(str(header)) for header in headers]
+
+    def update(self, row):
+        for col_num, value in enumerate(row):
+            length = len(str(value)) if value is not None else 0
+            if length > self.widths[col_num]:
+                self.widths[col_num] = length
+
+    def apply(self, worksheet, column_formats=None, padding=3):
+        """Set every column width, keeping any column format already chosen."""
+        column_formats = column_formats or {}
+        for col_num, width in enumerate(self.widths):
+            worksheet.set_column(
+                col_num,
+                col_num,
+                min(width + padding, MAX_COLUMN_WIDTH),
+                column_formats.get(col_num),
+            )
+
+
+def set_column_formats(worksheet, column_formats):
+    """Assign column formats before rows are written so unformatted cells pick them up."""
+    for col_num, cell_format in column_formats.items():
+        worksheet.set_column(col_num, col_num, None, cell_format)
+
+
+def apply_banding(worksheet, styles, last_row, last_col, first_row=1):
+    """Shade every other data row with one conditional format over the whole range."""
+    if last_row < first_row:
+        return
+    worksheet.conditional_format(
+        first_row,
+        0,
+        last_row,
+        last_col,
+        {"type": "formula", "criteria": "=MOD(ROW(),2)=1", "format": styles["band"]},
+    )